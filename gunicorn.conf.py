@@ -0,0 +1,67 @@
+# gunicorn.conf.py
+# ============================================
+# Gunicorn 正式環境設定
+# ============================================
+# 啟動方式：gunicorn -c gunicorn.conf.py wsgi:app
+# 各項設定皆可用環境變數覆寫（見 docs/env_template.txt）
+# ============================================
+
+import multiprocessing
+import os
+
+# 監聽位址（Nginx 反向代理到此位址）
+bind = os.getenv('GUNICORN_BIND', f"127.0.0.1:{os.getenv('PORT', 8090)}")
+
+# gthread：每個 worker 行程內以多執行緒處理請求
+# webhook 主要在等 LINE / LLM / 資料庫的 I/O，執行緒足以提高並行量
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# 讓 worker 知道總 worker 數：每個 worker 各有一份資料庫連線池，
+# db_utils 以 DB_MAX_CONNECTIONS ÷ GUNICORN_WORKERS 決定每個 worker 的連線上限
+os.environ['GUNICORN_WORKERS'] = str(workers)
+
+# 不使用 preload_app：匯入 app 時會啟動日誌寫入執行緒並建立 LINE / Qwen / 資料庫連線池，
+# 執行緒不會跟著 fork 到 worker，連線也不能在行程間共用
+# 每個 worker 各自匯入一次 app，連線池與快取在該 worker 的所有請求間共用
+preload_app = False
+
+# LLM 回覆可能需要數十秒
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 30
+
+# 日誌（未設定時輸出到 stdout/stderr，由 systemd journal 收集）
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_worker_init(worker):
+    """
+    worker 匯入 app 完成後記錄 PID，方便對照各 worker 的日誌與連線
+    """
+    worker.log.info(f"worker {worker.pid} 已載入 app")
+
+
+def on_starting(server):
+    """
+    master 行程啟動時執行一次資料表與索引檢查
+
+    說明:
+        gunicorn 不會呼叫 app.main()，原本在 main() 中的初始化需要在這裡執行
+        只匯入 db_utils，不在 master 行程載入整個 app（避免 fork 前就建立執行緒池）
+    """
+    try:
+        from mybot.db_utils import create_daily_fortune_cards_table, create_chat_history_index, close_connection_pool
+    except ImportError:
+        from db_utils import create_daily_fortune_cards_table, create_chat_history_index, close_connection_pool
+    try:
+        create_daily_fortune_cards_table()
+        create_chat_history_index()
+    except Exception as e:
+        server.log.warning(f"資料表初始化失敗: {e}")
+    finally:
+        # 連線池中的連線不可被 fork 出的 worker 共用
+        close_connection_pool()
@@ -9,13 +9,23 @@
 
 import os
 import sys
+import atexit
+import base64
+import hashlib
+import hmac
+import json
 import logging
-import uuid
+import queue
 import random
+import time
 import requests
 from datetime import datetime, date
+from logging.handlers import QueueHandler, QueueListener
+from threading import BoundedSemaphore, Lock, Thread
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
-from flask import Flask, request, abort, jsonify, send_from_directory
+from flask import Flask, Response, request, abort, jsonify, send_from_directory
 from PIL import Image, ImageDraw, ImageFont
 
 # LINE Bot SDK v3
@@ -24,9 +34,11 @@ from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
     Configuration,
     ApiClient,
+    ApiException,
     MessagingApi,
     ReplyMessageRequest,
     PushMessageRequest,
+    MulticastRequest,
     TextMessage,
     ImageMessage
 )
@@ -49,16 +61,22 @@ log_path = os.path.join(log_dir, "app.log")
 
 root_logger = logging.getLogger()
 if not root_logger.handlers:
-    root_logger.setLevel(logging.INFO)
+    # 正式環境可設定 LOG_LEVEL=WARNING，略過逐步驟的 INFO 日誌
+    root_logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
     file_handler = logging.FileHandler(log_path, encoding="utf-8")
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
 
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(formatter)
-    root_logger.addHandler(stream_handler)
+
+    # 實際的檔案與終端輸出交給背景執行緒，請求執行緒只需將記錄放入佇列
+    log_queue = queue.Queue(-1)
+    root_logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # 建立應用程式 logger
 logger = logging.getLogger('pet_chatbot')
@@ -68,38 +86,44 @@ logger = logging.getLogger('pet_chatbot')
 # 2. 作為獨立腳本運行（本地開發）：from xxx import
 try:
     from mybot.db_utils import (
+        get_connection,
         get_pet_profile, 
         get_pet_id_by_line_user,
-        save_chat_message,
         get_chat_history,
         clear_chat_history,
         get_all_bound_users,
         get_daily_fortune_card,
+        get_daily_fortune_cards,
         save_daily_fortune_card,
-        create_daily_fortune_cards_table
+        create_daily_fortune_cards_table,
+        create_chat_history_index
     )
     from mybot.personalities import pet_personality_templates
-    from mybot.chatbot_ollama import build_system_prompt, chat_with_pet as chat_with_pet_ollama
-    from mybot.chatbot_api import build_system_prompt as build_system_prompt_api, chat_with_pet as chat_with_pet_api
-    from mybot.fortune_card import generate_fortune_card as fortune_card_generate
+    from mybot.chatbot_ollama import chat_with_pet as chat_with_pet_ollama, get_ollama_client
+    from mybot.chatbot_api import build_system_prompt, chat_with_pet as chat_with_pet_api
+    from mybot.fortune_card import generate_fortune_card as fortune_card_generate, preload_fortune_backgrounds, get_cached_card, get_existing_card_url
     from mybot.line_handlers import handle_text_message as line_handle_text_message
+    from mybot.chat_log_queue import enqueue_chat_turn, flush_chat_log_queue
 except ImportError:
     from db_utils import (
+        get_connection,
         get_pet_profile, 
         get_pet_id_by_line_user,
-        save_chat_message,
         get_chat_history,
         clear_chat_history,
         get_all_bound_users,
         get_daily_fortune_card,
+        get_daily_fortune_cards,
         save_daily_fortune_card,
-        create_daily_fortune_cards_table
+        create_daily_fortune_cards_table,
+        create_chat_history_index
     )
     from personalities import pet_personality_templates
-    from chatbot_ollama import build_system_prompt, chat_with_pet as chat_with_pet_ollama
-    from chatbot_api import build_system_prompt as build_system_prompt_api, chat_with_pet as chat_with_pet_api
-    from fortune_card import generate_fortune_card as fortune_card_generate
+    from chatbot_ollama import chat_with_pet as chat_with_pet_ollama, get_ollama_client
+    from chatbot_api import build_system_prompt, chat_with_pet as chat_with_pet_api
+    from fortune_card import generate_fortune_card as fortune_card_generate, preload_fortune_backgrounds, get_cached_card, get_existing_card_url
     from line_handlers import handle_text_message as line_handle_text_message
+    from chat_log_queue import enqueue_chat_turn, flush_chat_log_queue
 
 # ============================================
 # Flask 應用程式初始化
@@ -132,6 +156,31 @@ if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_CHANNEL_SECRET:
 configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
+# 預先編碼的 Channel Secret，供 webhook 快速驗證簽名使用
+_CHANNEL_SECRET_BYTES = (LINE_CHANNEL_SECRET or '').encode('utf-8')
+
+# 背景工作執行緒池
+# LLM 推論（數秒）與資料庫寫入在背景執行，webhook 可以立即回傳 200 給 LINE
+WORKERS = int(os.getenv('WORKERS', 16))
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='line-worker')
+
+# 共用的 Messaging API 客戶端
+# 重複使用同一個 ApiClient，保留 urllib3 連線池與 TLS 連線，避免每次回覆都重新握手
+# 連線池至少與背景執行緒數相同，否則同時回覆時多出的連線用完即丟，又得重新握手
+configuration.connection_pool_maxsize = max(
+    configuration.connection_pool_maxsize,
+    int(os.getenv('LINE_API_POOL_SIZE', WORKERS))
+)
+api_client = ApiClient(configuration)
+line_bot_api = MessagingApi(api_client)
+atexit.register(api_client.close)
+
+# 背景工作上限（執行中 + 排隊中）：超過時直接回覆忙碌訊息，不再無限制地堆積在佇列中
+# LLM 變慢時佇列中的訊息早已超過 reply_token 有效期，與其排隊不如讓使用者稍後再傳
+WEBHOOK_QUEUE_LIMIT = int(os.getenv('WEBHOOK_QUEUE_LIMIT', WORKERS * 4))
+_webhook_slots = BoundedSemaphore(WEBHOOK_QUEUE_LIMIT)
+BUSY_MSG = TextMessage(text="嗚...主人，現在太多人找我玩了 🐾\n請稍後再跟我說一次")
+
 # 寵物設定（從環境變數讀取，預設為 1）
 PET_ID = int(os.getenv('PET_ID', 1))
 
@@ -159,6 +208,45 @@ else:
 # 3. 可以在多個服務實例間共享對話歷史
 # ============================================
 
+# ============================================
+# 寵物提示詞快取
+# ============================================
+# 寵物資料很少變動，但每則訊息都會呼叫 get_pet_system_prompt
+# 使用 TTL 快取（以 (pet_id, AI_MODE) 為 key）避免每則訊息都重新呼叫 API 並重建提示詞
+# 兩種模式目前共用同一份提示詞，key 保留 AI_MODE 以便日後分開調整（只有兩種值，快取不會因此變大）
+# 寵物資料更新後可呼叫 /admin/flush_prompt_cache 立即失效
+# ============================================
+
+PROMPT_CACHE_TTL = int(os.getenv('PROMPT_TTL', 300))
+_prompt_cache = TTLCache(maxsize=1024, ttl=PROMPT_CACHE_TTL)
+_prompt_cache_lock = Lock()
+
+# 載入失敗的寵物短暫記住 PROMPT_MISS_TTL 秒（預設 30 秒）
+# 不存在或 API 暫時故障的寵物，每則訊息不必再重打一次 API（與 _prompt_cache 共用鎖）
+PROMPT_MISS_TTL = int(os.getenv('PROMPT_MISS_TTL', 30))
+_prompt_miss_cache = TTLCache(maxsize=1024, ttl=PROMPT_MISS_TTL)
+
+# 已組好的提示詞（key 為 (pet_id, AI_MODE, 寵物資料版本)）
+# TTL 到期後仍需重新取得寵物資料，但資料沒有變動時不必重新組合提示詞
+_built_prompt_cache = LRUCache(maxsize=512)
+_built_prompt_cache_lock = Lock()
+
+# LINE 使用者 → 寵物 ID 的綁定快取
+# 綁定關係極少變動，快取 USER_PET_TTL 秒（預設 60 秒）
+# 只快取已綁定的結果，尚未綁定的使用者在客服設定後可以立即生效
+USER_PET_CACHE_TTL = int(os.getenv('USER_PET_TTL', 60))
+_user_pet_cache = TTLCache(maxsize=10_000, ttl=USER_PET_CACHE_TTL)
+_user_pet_cache_lock = Lock()
+
+# 當日占卜卡 URL 快取（key 為 (pet_id, 日期)）
+# 同一隻寵物當天只會有一張占卜卡，每日推播與「占卜」指令不必每次查資料庫
+# 換日後 key 自然不同，舊項目在 TTL 到期後移除
+_daily_card_cache = TTLCache(maxsize=10_000, ttl=86400)
+_daily_card_cache_lock = Lock()
+
+# 生成中的占卜卡（key 為 (pet_id, 日期)）：同一隻寵物同時有多個請求時只生成一次，其他請求等待同一結果
+_inflight_cards = {}
+
 # ============================================
 # 核心功能函數
 # ============================================
@@ -192,14 +280,67 @@ def generate_fortune_card(pet_id: int) -> str:
     
     返回:
         str: 生成的占卜卡圖片外部 URL，如果失敗則返回 None
+    
+    說明:
+        成功的結果快取到當天結束，失敗則不快取
+        同一隻寵物同時被多個執行緒請求時（single-flight），只有第一個會實際生成
     """
-    return fortune_card_generate(
-        pet_id=pet_id,
-        BASE_URL=BASE_URL,
-        EXTERNAL_URL=EXTERNAL_URL,
-        get_daily_fortune_card_func=get_daily_fortune_card,
-        save_daily_fortune_card_func=save_daily_fortune_card
-    )
+    cache_key = (pet_id, date.today())
+    with _daily_card_cache_lock:
+        cached = _daily_card_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        inflight = _inflight_cards.get(cache_key)
+        if inflight is None:
+            inflight = _inflight_cards[cache_key] = Future()
+            is_leader = True
+        else:
+            is_leader = False
+    
+    if not is_leader:
+        return inflight.result()
+    
+    fortune_card_url = None
+    try:
+        fortune_card_url = fortune_card_generate(
+            pet_id=pet_id,
+            BASE_URL=BASE_URL,
+            EXTERNAL_URL=EXTERNAL_URL,
+            get_daily_fortune_card_func=get_daily_fortune_card,
+            save_daily_fortune_card_func=save_daily_fortune_card
+        )
+    finally:
+        with _daily_card_cache_lock:
+            if fortune_card_url:
+                _daily_card_cache[cache_key] = fortune_card_url
+            _inflight_cards.pop(cache_key, None)
+        inflight.set_result(fortune_card_url)
+    return fortune_card_url
+
+
+def get_cached_pet_id_by_line_user(line_user_id: str):
+    """
+    根據 LINE 使用者 ID 查詢寵物 ID（帶快取）
+    
+    參數:
+        line_user_id (str): LINE 使用者 ID
+    
+    返回:
+        int: 對應的寵物 ID，如果找不到則返回 None
+    
+    說明:
+        快取未命中時呼叫 get_pet_id_by_line_user 並寫入快取
+    """
+    with _user_pet_cache_lock:
+        pet_id = _user_pet_cache.get(line_user_id)
+    if pet_id is not None:
+        return pet_id
+    
+    pet_id = get_pet_id_by_line_user(line_user_id)
+    if pet_id is not None:
+        with _user_pet_cache_lock:
+            _user_pet_cache[line_user_id] = pet_id
+    return pet_id
 
 
 def get_pet_system_prompt(pet_id=None):
@@ -215,44 +356,176 @@ def get_pet_system_prompt(pet_id=None):
     說明:
         從資料庫載入寵物資料並建立系統提示詞
         此函數會被多個使用者共用
-        根據 AI_MODE 選擇使用 Ollama 或 API 版本
+        Ollama 與 API 模式共用 chatbot_api.build_system_prompt
+        結果會快取 PROMPT_TTL 秒（預設 300 秒），載入失敗則記住 PROMPT_MISS_TTL 秒（預設 30 秒）
     """
     try:
         # 如果沒有指定 pet_id，使用環境變數的預設值
         if pet_id is None:
             pet_id = PET_ID
+        
+        # 先檢查快取
+        cache_key = (pet_id, AI_MODE)
+        with _prompt_cache_lock:
+            cached = _prompt_cache.get(cache_key)
+            missed = pet_id in _prompt_miss_cache
+        if cached is not None:
+            return cached
+        if missed:
+            return None, None, None
             
         pet_profile = get_pet_profile(pet_id)
         
         if not pet_profile:
+            with _prompt_cache_lock:
+                _prompt_miss_cache[pet_id] = True
             return None, None, None
         
-        # 根據 AI_MODE 選擇對應的 build_system_prompt 函數
-        if AI_MODE == 'api':
-            system_prompt = build_system_prompt_api(
-                pet_name=pet_profile["name"],
-                breed=pet_profile["breed"],
-                persona=pet_personality_templates[pet_profile["persona_key"]],
-                life_data=pet_profile["lifeData"],
-                cover_slogan=pet_profile["cover_slogan"],
-                letter=pet_profile["letter"]
-            )
-        else:  # 預設使用 Ollama
-            system_prompt = build_system_prompt(
-                pet_name=pet_profile["name"],
-                breed=pet_profile["breed"],
-                persona=pet_personality_templates[pet_profile["persona_key"]],
-                life_data=pet_profile["lifeData"],
-                cover_slogan=pet_profile["cover_slogan"],
-                letter=pet_profile["letter"]
-            )
+        system_prompt = _build_prompt_cached(pet_id, pet_profile)
         
-        return system_prompt, pet_profile["name"], pet_profile.get("web_slug")
+        result = (system_prompt, pet_profile["name"], pet_profile.get("web_slug"))
+        with _prompt_cache_lock:
+            _prompt_cache[cache_key] = result
+        return result
     except Exception as e:
         app.logger.error(f"載入寵物資料失敗: {e}")
         return None, None, None
 
 
+def _profile_version(pet_profile):
+    """
+    寵物資料的版本：API 有提供 updated_at 時直接使用，否則以資料內容的雜湊代替
+    """
+    if pet_profile.get("updated_at"):
+        return str(pet_profile["updated_at"])
+    payload = json.dumps(pet_profile, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _build_prompt_cached(pet_id, pet_profile):
+    """
+    組合寵物的系統提示詞（依 pet_id、AI_MODE 與寵物資料版本快取）
+    
+    返回:
+        str: 系統提示詞
+    """
+    cache_key = (pet_id, AI_MODE, _profile_version(pet_profile))
+    with _built_prompt_cache_lock:
+        cached = _built_prompt_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    system_prompt = build_system_prompt(
+        pet_name=pet_profile["name"],
+        breed=pet_profile["breed"],
+        persona=pet_personality_templates[pet_profile["persona_key"]],
+        life_data=pet_profile["lifeData"],
+        cover_slogan=pet_profile["cover_slogan"],
+        letter=pet_profile["letter"]
+    )
+    with _built_prompt_cache_lock:
+        _built_prompt_cache[cache_key] = system_prompt
+    return system_prompt
+
+
+def clear_pet_prompt_cache(pet_id=None):
+    """
+    清除寵物提示詞快取
+    
+    參數:
+        pet_id (int, optional): 只清除指定寵物；不提供則清除全部
+    
+    返回:
+        int: 清除的筆數
+    """
+    with _built_prompt_cache_lock:
+        if pet_id is None:
+            _built_prompt_cache.clear()
+        else:
+            for key in [key for key in _built_prompt_cache if key[0] == pet_id]:
+                _built_prompt_cache.pop(key, None)
+    with _prompt_cache_lock:
+        if pet_id is None:
+            _prompt_miss_cache.clear()
+            flushed = len(_prompt_cache)
+            _prompt_cache.clear()
+        else:
+            _prompt_miss_cache.pop(pet_id, None)
+            keys = [key for key in _prompt_cache if key[0] == pet_id]
+            for key in keys:
+                _prompt_cache.pop(key, None)
+            flushed = len(keys)
+    return flushed
+
+
+# 與 functools.lru_cache 相同的失效介面，寵物資料更新後可呼叫 get_pet_system_prompt.cache_clear()
+get_pet_system_prompt.cache_clear = clear_pet_prompt_cache
+
+
+def clear_user_pet_cache(line_user_id=None):
+    """
+    清除 LINE 使用者與寵物的綁定快取
+    
+    參數:
+        line_user_id (str, optional): 只清除指定使用者；不提供則清除全部
+    
+    返回:
+        int: 清除的筆數
+    """
+    with _user_pet_cache_lock:
+        if line_user_id is None:
+            flushed = len(_user_pet_cache)
+            _user_pet_cache.clear()
+        else:
+            flushed = 1 if _user_pet_cache.pop(line_user_id, None) is not None else 0
+    return flushed
+
+
+get_cached_pet_id_by_line_user.cache_clear = clear_user_pet_cache
+
+
+def clear_chat_history_and_binding(line_user_id: str, pet_id: int):
+    """
+    清除對話記錄，並讓該使用者的綁定快取失效
+    
+    說明:
+        使用者輸入「清除」重新開始時，順便重新讀取綁定關係，
+        剛被客服改綁的寵物可以立即生效，不必等待 USER_PET_TTL
+    """
+    clear_user_pet_cache(line_user_id)
+    # 先等背景佇列寫完，避免清除後才寫入舊的對話
+    flush_chat_log_queue()
+    return clear_chat_history(line_user_id, pet_id)
+
+
+def _is_local_request():
+    """
+    檢查目前請求是否來自 localhost
+    
+    返回:
+        bool: 來自本機返回 True，否則返回 False（並記錄警告）
+    
+    說明:
+        支援 IPv4 (127.0.0.1) 和 IPv6 (::1) 的 localhost
+        透過 Nginx 反向代理時，依序檢查 X-Real-IP > X-Forwarded-For > remote_addr
+    """
+    client_ip = request.remote_addr
+    
+    # 如果透過 Nginx 反向代理，檢查 X-Forwarded-For header
+    forwarded_for = request.headers.get('X-Forwarded-For', '').split(',')[0].strip() if request.headers.get('X-Forwarded-For') else None
+    real_ip = request.headers.get('X-Real-IP', '').strip() if request.headers.get('X-Real-IP') else None
+    
+    # 檢查實際來源 IP（優先順序：X-Real-IP > X-Forwarded-For > remote_addr）
+    actual_ip = real_ip or forwarded_for or client_ip
+    
+    allowed_ips = ['127.0.0.1', '::1', 'localhost']
+
+    if actual_ip not in allowed_ips:
+        app.logger.warning(f"拒絕非本地來源: {actual_ip}")
+        return False
+    return True
+
+
 # ============================================
 # Flask 路由處理
 # ============================================
@@ -271,6 +544,104 @@ def home():
     return "🐕 寵物聊天機器人 LINE Bot 正在運行中！"
 
 
+# 健康檢查結果快取 10 秒：探測頻繁時不會每次都連到 Ollama / 資料庫
+# 每個 TTL 週期只有一個執行緒實際探測，其他同時進來的請求直接使用上一次的結果，
+# Ollama 卡住時也不會讓所有健康檢查一起等待逾時
+HEALTH_CHECK_TTL = int(os.getenv('HEALTH_CHECK_TTL', 10))
+
+
+def _probe_cached(state, lock, check):
+    """
+    以 TTL 快取執行健康檢查
+    
+    參數:
+        state (dict): {'ts': 上次檢查時間, 'ok': 上次結果（尚未檢查過為 None）}
+        lock (Lock): 確保同一時間只有一個執行緒在探測
+        check (callable): 實際的檢查函數，失敗時拋出例外
+    
+    返回:
+        bool: 最近一次的檢查結果
+    
+    說明:
+        快取過期時由一個執行緒重新探測，其他執行緒直接沿用上次結果
+        worker 剛啟動、還沒有任何結果時則等待第一次探測完成，不會先回報失敗
+    """
+    if time.monotonic() - state['ts'] >= HEALTH_CHECK_TTL and lock.acquire(blocking=state['ok'] is None):
+        try:
+            # 等待第一次探測的執行緒取得鎖時，結果可能已由其他執行緒更新
+            if time.monotonic() - state['ts'] >= HEALTH_CHECK_TTL:
+                try:
+                    check()
+                    ok = True
+                except Exception as e:
+                    logger.warning(f"⚠️ 健康檢查失敗 ({check.__name__}): {e}")
+                    ok = False
+                state.update(ts=time.monotonic(), ok=ok)
+        finally:
+            lock.release()
+    return bool(state['ok'])
+
+
+def _check_ollama():
+    get_ollama_client().list()
+
+
+def _check_database():
+    connection = get_connection()
+    try:
+        connection.ping(reconnect=False)
+    finally:
+        connection.close()
+
+
+_ollama_probe = {'ts': float('-inf'), 'ok': None}
+_ollama_probe_lock = Lock()
+_database_probe = {'ts': float('-inf'), 'ok': None}
+_database_probe_lock = Lock()
+
+
+def _ollama_ok():
+    """檢查 Ollama 服務是否可連線（TTL 快取）"""
+    return _probe_cached(_ollama_probe, _ollama_probe_lock, _check_ollama)
+
+
+def _database_ok():
+    """檢查資料庫是否可連線（TTL 快取）"""
+    return _probe_cached(_database_probe, _database_probe_lock, _check_database)
+
+
+@app.route("/healthz")
+def healthz():
+    """
+    健康檢查路由（Nginx /line/healthz 轉發至此）
+    
+    返回:
+        JSON: 各項檢查結果；全部正常返回 200，否則返回 503
+    
+    說明:
+        檢查結果快取 HEALTH_CHECK_TTL 秒（預設 10 秒）
+        Ollama 僅在 AI_MODE=ollama 時檢查
+    """
+    checks = {"database_connection": _database_ok()}
+    if AI_MODE != 'api':
+        checks["ollama_connection"] = _ollama_ok()
+    
+    healthy = all(checks.values())
+    return jsonify({
+        "status": "ok" if healthy else "error",
+        "ai_mode": AI_MODE,
+        "checks": checks
+    }), 200 if healthy else 503
+
+
+# 占卜卡圖片快取時間（秒），預設一年
+OUTPUT_CACHE_MAX_AGE = int(os.getenv('OUTPUT_CACHE_MAX_AGE', 31536000))
+
+# Nginx 內部 location 前綴（例如 /internal-output/），設定後圖片改由 Nginx 直接傳送
+# 需搭配 docs/nginx_config.conf 中的 internal location；未設定則由 Flask 傳送
+OUTPUT_ACCEL_REDIRECT = os.getenv('OUTPUT_ACCEL_REDIRECT', '')
+
+
 @app.route("/output/<filename>")
 @app.route("/line/output/<filename>")  # 支援 Nginx 轉發的路徑
 def serve_output_file(filename):
@@ -285,9 +656,10 @@ def serve_output_file(filename):
     
     說明:
         讓 LINE Bot 可以通過 URL 訪問生成的占卜卡圖片
+        設定 OUTPUT_ACCEL_REDIRECT 時只回傳 X-Accel-Redirect header，由 Nginx 傳送檔案，
+        不佔用 Flask 執行緒
     """
     try:
-        from flask import send_from_directory
         output_dir = _get_output_dir()
         os.makedirs(output_dir, exist_ok=True)
         
@@ -296,6 +668,22 @@ def serve_output_file(filename):
             app.logger.warning(f"❌ 嘗試訪問非法文件: {filename}")
             abort(404)
         
+        # 交給 Nginx 傳送（檔案不存在時由 Nginx 回 404）
+        if OUTPUT_ACCEL_REDIRECT:
+            return Response('', headers={
+                'X-Accel-Redirect': f"{OUTPUT_ACCEL_REDIRECT.rstrip('/')}/{filename}",
+                'Content-Type': 'image/png',
+                'Cache-Control': f'public, max-age={OUTPUT_CACHE_MAX_AGE}, immutable',
+            })
+        
+        # 剛生成的占卜卡直接從記憶體回應
+        card_bytes = get_cached_card(filename)
+        if card_bytes is not None:
+            response = Response(card_bytes, mimetype='image/png')
+            response.set_etag(filename)
+            response.headers['Cache-Control'] = f'public, max-age={OUTPUT_CACHE_MAX_AGE}, immutable'
+            return response.make_conditional(request)
+        
         # 檢查文件是否存在
         file_path = os.path.join(output_dir, filename)
         if not os.path.exists(file_path):
@@ -303,17 +691,44 @@ def serve_output_file(filename):
             abort(404)
         
         # 發送文件
-        app.logger.info(f"📤 提供文件: {filename}, 路徑: {file_path}")
-        response = send_from_directory(output_dir, filename, mimetype='image/png')
-        # 確保正確的 Content-Type 和 Cache-Control
-        response.headers['Content-Type'] = 'image/png'
-        response.headers['Cache-Control'] = 'public, max-age=3600'
+        # 占卜卡檔名是隨機產生的，內容永遠不會變動，可讓用戶端與 CDN 長期快取
+        # conditional=True 支援 If-None-Match / If-Modified-Since，重複請求直接回 304
+        app.logger.debug("📤 提供文件: %s, 路徑: %s", filename, file_path)
+        response = send_from_directory(
+            output_dir,
+            filename,
+            mimetype='image/png',
+            conditional=True,
+            max_age=OUTPUT_CACHE_MAX_AGE
+        )
+        response.headers['Cache-Control'] = f'public, max-age={OUTPUT_CACHE_MAX_AGE}, immutable'
         return response
     except Exception as e:
         app.logger.error(f"❌ 提供文件失敗: {e}")
         abort(404)
 
 
+def _verify_signature(body: bytes, signature: str) -> bool:
+    """
+    驗證 LINE webhook 的 X-Line-Signature
+    
+    參數:
+        body (bytes): 原始 request body
+        signature (str): X-Line-Signature header
+    
+    返回:
+        bool: 簽名正確返回 True
+    
+    說明:
+        直接以 HMAC-SHA256 計算並以 compare_digest 比對
+        在解碼 body、解析 JSON 之前就擋掉偽造的請求
+    """
+    expected = base64.b64encode(
+        hmac.new(_CHANNEL_SECRET_BYTES, body, hashlib.sha256).digest()
+    ).decode('ascii')
+    return hmac.compare_digest(expected, signature)
+
+
 @app.route("/webhook", methods=['GET', 'POST'])
 def callback():
     """
@@ -325,48 +740,42 @@ def callback():
         處理 LINE 的驗證請求和實際事件
     """
     try:
-        # 處理 GET 請求（LINE 驗證或 ngrok 檢查）
+        # 處理 GET 請求（LINE 驗證或 ngrok 檢查）：不記錄日誌，直接返回
         if request.method == 'GET':
-            app.logger.info("✅ 收到 GET 請求（LINE webhook 驗證或 ngrok 檢查）")
-            return 'OK', 200
+            return '', 204
         
         # 處理 POST 請求（LINE 的實際 webhook）
-        app.logger.info("📨 收到 POST webhook 請求")
+        raw_body = request.get_data()
+        
+        # LINE 驗證請求可能是空 body，直接返回 OK
+        if not raw_body:
+            return '', 200
         
         # 取得 X-Line-Signature header
         signature = request.headers.get('X-Line-Signature')
         
-        # 取得 request body
-        body = request.get_data(as_text=True)
-        
-        # LINE 驗證請求可能是空 body，需要特殊處理
-        if not body or len(body) == 0:
-            app.logger.info("📨 收到空 body（可能是 LINE 驗證請求）")
-            if signature:
-                # 有簽名但空 body，可能是驗證請求，返回 OK
-                app.logger.info("✅ 驗證請求通過")
-                return 'OK', 200
-            else:
-                # 無簽名無 body，可能是測試請求
-                app.logger.info("✅ 測試請求，返回 OK")
-                return 'OK', 200
-        
         # 有 body 的請求需要驗證簽名
         if not signature:
-            app.logger.error("❌ 缺少 X-Line-Signature header（有 body 但無簽名）")
-            # 為了調試，記錄請求信息但不 abort
-            app.logger.error(f"❌ Request headers: {dict(request.headers)}")
-            app.logger.error(f"❌ Body 長度: {len(body)}")
+            app.logger.error("❌ 缺少 X-Line-Signature header（有 body 但無簽名），Body 長度: %s", len(raw_body))
+            app.logger.debug("❌ Request headers: %s", dict(request.headers))
             # 返回 200 以避免 LINE 重試（但記錄錯誤）
             return 'OK', 200
         
-        app.logger.info(f"📦 Webhook body 長度: {len(body)} 字符")
-        app.logger.info(f"📦 Body 前 100 字符: {body[:100]}")
+        # 快速驗證簽名：偽造的請求不做任何 JSON 解析
+        if not _verify_signature(raw_body, signature):
+            app.logger.error("❌ 簽名驗證失敗！請檢查 LINE_CHANNEL_SECRET 是否正確")
+            # 簽名驗證失敗時也返回 200，避免 LINE 重試
+            return 'OK', 200
+        
+        body = raw_body.decode('utf-8')
+        app.logger.info("📨 收到 webhook 事件，body 長度: %s 字符", len(body))
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug("📦 Body 前 100 字符: %s", body[:100])
         
         # 驗證簽名並處理事件
         try:
             handler.handle(body, signature)
-            app.logger.info("✅ Webhook 處理完成")
+            app.logger.debug("✅ Webhook 處理完成")
         except InvalidSignatureError as e:
             app.logger.error(f"❌ 簽名驗證失敗！請檢查 LINE_CHANNEL_SECRET 是否正確: {e}")
             # 簽名驗證失敗時也返回 200，避免 LINE 重試
@@ -386,6 +795,107 @@ def callback():
         return 'OK', 200
 
 
+# 每日推播的並行數（同時進行的 LINE push_message 請求數，依 LINE API 速率限制調整）
+DAILY_PUSH_CONCURRENCY = int(os.getenv('DAILY_PUSH_CONCURRENCY', 16))
+
+
+def _push_fortune_card(line_user_id, pet_id, fortune_card_url):
+    """
+    推播占卜卡給單一使用者
+    
+    返回:
+        bool: 推播成功返回 True
+    
+    說明:
+        由每日推播的執行緒池呼叫，共用 line_bot_api（urllib3 連線池可跨執行緒使用）
+    """
+    if not fortune_card_url:
+        app.logger.warning(f"⚠️ 占卜卡生成失敗 - pet_id: {pet_id}, line_user_id: {line_user_id}")
+        return False
+    
+    try:
+        app.logger.info(f"🔮 為使用者推播占卜卡 - pet_id: {pet_id}, line_user_id: {line_user_id}")
+        
+        # 使用 LINE Messaging API 推送圖片
+        image_message = ImageMessage(
+            original_content_url=fortune_card_url,
+            preview_image_url=fortune_card_url
+        )
+        line_bot_api.push_message(
+            PushMessageRequest(
+                to=line_user_id,
+                messages=[image_message]
+            )
+        )
+        app.logger.info(f"✅ 成功推播占卜卡給使用者 - line_user_id: {line_user_id}")
+        return True
+    except Exception as push_error:
+        app.logger.error(f"❌ LINE 推播失敗 - line_user_id: {line_user_id}, 錯誤: {push_error}")
+        return False
+
+
+# LINE multicast 每次最多 500 位收件者
+MULTICAST_BATCH_SIZE = 500
+# multicast 遇到速率限制（HTTP 429）時整批重試的次數，間隔依 Retry-After 或 1、2、4... 秒遞增
+MULTICAST_MAX_RETRIES = int(os.getenv('MULTICAST_MAX_RETRIES', 3))
+
+
+def _retry_after_seconds(error, attempt):
+    """取得 429 回應的 Retry-After 秒數，沒有時以指數退避（最多 60 秒）"""
+    try:
+        retry_after = float((error.headers or {}).get('Retry-After'))
+    except (TypeError, ValueError):
+        retry_after = 2 ** attempt
+    return min(max(retry_after, 0), 60)
+
+
+def _multicast_fortune_card(line_user_ids, pet_id, fortune_card_url):
+    """
+    以 multicast 一次推播占卜卡給綁定同一隻寵物的多位使用者
+    
+    返回:
+        tuple: (成功人數, 失敗人數)
+    
+    說明:
+        遇到速率限制（429）時等待後整批重試，不改為逐一推播（逐一推播只會更快撞上限制）
+        其他錯誤才整批改用 push_message 逐一推播，找出個別失敗的使用者
+    """
+    if not fortune_card_url:
+        app.logger.warning(f"⚠️ 占卜卡生成失敗 - pet_id: {pet_id}, 使用者: {len(line_user_ids)} 位")
+        return 0, len(line_user_ids)
+    
+    image_message = ImageMessage(
+        original_content_url=fortune_card_url,
+        preview_image_url=fortune_card_url
+    )
+    for attempt in range(MULTICAST_MAX_RETRIES + 1):
+        try:
+            line_bot_api.multicast(
+                MulticastRequest(
+                    to=line_user_ids,
+                    messages=[image_message]
+                )
+            )
+            app.logger.info(f"✅ 成功 multicast 占卜卡 - pet_id: {pet_id}, 使用者: {len(line_user_ids)} 位")
+            return len(line_user_ids), 0
+        except ApiException as multicast_error:
+            if multicast_error.status != 429:
+                app.logger.warning(f"⚠️ multicast 失敗，改為逐一推播 - pet_id: {pet_id}, 錯誤: {multicast_error}")
+                break
+            if attempt == MULTICAST_MAX_RETRIES:
+                app.logger.error(f"❌ multicast 持續遇到速率限制，放棄推播 - pet_id: {pet_id}, 使用者: {len(line_user_ids)} 位")
+                return 0, len(line_user_ids)
+            delay = _retry_after_seconds(multicast_error, attempt)
+            app.logger.warning(f"⚠️ multicast 遇到速率限制，{delay:.0f} 秒後整批重試 - pet_id: {pet_id}")
+            time.sleep(delay)
+        except Exception as multicast_error:
+            app.logger.warning(f"⚠️ multicast 失敗，改為逐一推播 - pet_id: {pet_id}, 錯誤: {multicast_error}")
+            break
+    
+    sent = sum(1 for line_user_id in line_user_ids if _push_fortune_card(line_user_id, pet_id, fortune_card_url))
+    return sent, len(line_user_ids) - sent
+
+
 @app.route("/daily-fortune", methods=['POST'])
 def daily_fortune():
     """
@@ -394,27 +904,14 @@ def daily_fortune():
     說明:
         1. 僅允許 localhost (127.0.0.1) 存取
         2. 從資料庫查出所有已綁定 LINE 的使用者
-        3. 為每位使用者生成占卜卡並推播
+        3. 每隻寵物只生成一次占卜卡，再以 multicast 推播給綁定該寵物的使用者
     
     返回:
         JSON: {"status": "success", "count": 推播成功的使用者數量}
         或 403 Forbidden (如果非 localhost 請求)
     """
     # 檢查請求來源是否為 localhost
-    # 支援 IPv4 (127.0.0.1) 和 IPv6 (::1) 的 localhost
-    client_ip = request.remote_addr
-    
-    # 如果透過 Nginx 反向代理，檢查 X-Forwarded-For header
-    forwarded_for = request.headers.get('X-Forwarded-For', '').split(',')[0].strip() if request.headers.get('X-Forwarded-For') else None
-    real_ip = request.headers.get('X-Real-IP', '').strip() if request.headers.get('X-Real-IP') else None
-    
-    # 檢查實際來源 IP（優先順序：X-Real-IP > X-Forwarded-For > remote_addr）
-    actual_ip = real_ip or forwarded_for or client_ip
-    
-    allowed_ips = ['127.0.0.1', '::1', 'localhost']
-
-    if actual_ip not in allowed_ips:
-        app.logger.warning(f"拒絕非本地來源: {actual_ip}")
+    if not _is_local_request():
         abort(403)
     
     app.logger.info("📅 Daily fortune job started")
@@ -433,7 +930,29 @@ def daily_fortune():
         success_count = 0
         failed_count = 0
         
-        # 3. 遍歷每位使用者並推播占卜卡
+        # 每隻寵物只生成一次占卜卡（多位使用者可能綁定同一隻寵物）
+        # 先以一次查詢取得今天已生成的占卜卡，只有尚未生成的寵物才需要逐一生成
+        pet_ids = [pet_id for pet_id in dict.fromkeys(user.get('pet_id') for user in bound_users) if pet_id]
+        today = date.today()
+        fortune_card_urls = {}
+        for pet_id, filename in get_daily_fortune_cards(pet_ids, today.strftime('%Y-%m-%d')).items():
+            url = get_existing_card_url(filename, EXTERNAL_URL)
+            if url:
+                fortune_card_urls[pet_id] = url
+                with _daily_card_cache_lock:
+                    _daily_card_cache[(pet_id, today)] = url
+        
+        for pet_id in pet_ids:
+            if pet_id in fortune_card_urls:
+                continue
+            try:
+                fortune_card_urls[pet_id] = generate_fortune_card(pet_id)
+            except Exception as e:
+                app.logger.error(f"❌ 占卜卡生成發生錯誤 - pet_id: {pet_id}, 錯誤: {e}", exc_info=True)
+                fortune_card_urls[pet_id] = None
+        
+        # 3. 依寵物分組，每組以 multicast 一次送出（每次最多 MULTICAST_BATCH_SIZE 人）
+        recipients_by_pet = {}
         for user in bound_users:
             pet_id = user.get('pet_id')
             line_user_id = user.get('line_user_id')
@@ -443,43 +962,23 @@ def daily_fortune():
                 failed_count += 1
                 continue
             
-            try:
-                app.logger.info(f"🔮 為使用者推播占卜卡 - pet_id: {pet_id}, line_user_id: {line_user_id}")
-                
-                # 生成占卜卡
-                fortune_card_url = generate_fortune_card(pet_id)
-                
-                if not fortune_card_url:
-                    app.logger.warning(f"⚠️ 占卜卡生成失敗 - pet_id: {pet_id}, line_user_id: {line_user_id}")
-                    failed_count += 1
-                    continue
-                
-                app.logger.info(f"✅ 占卜卡生成成功 - URL: {fortune_card_url}")
-                
-                # 使用 LINE Messaging API 推送圖片
-                image_message = ImageMessage(
-                    original_content_url=fortune_card_url,
-                    preview_image_url=fortune_card_url
-                )
-                
-                try:
-                    with ApiClient(configuration) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.push_message(
-                            PushMessageRequest(
-                                to=line_user_id,
-                                messages=[image_message]
-                            )
-                        )
-                    app.logger.info(f"✅ 成功推播占卜卡給使用者 - line_user_id: {line_user_id}")
-                    success_count += 1
-                except Exception as push_error:
-                    app.logger.error(f"❌ LINE 推播失敗 - line_user_id: {line_user_id}, 錯誤: {push_error}")
-                    failed_count += 1
-                    
-            except Exception as e:
-                app.logger.error(f"❌ 處理使用者推播時發生錯誤 - pet_id: {pet_id}, line_user_id: {line_user_id}, 錯誤: {e}", exc_info=True)
-                failed_count += 1
+            recipients_by_pet.setdefault(pet_id, []).append(line_user_id)
+        
+        futures = []
+        with ThreadPoolExecutor(max_workers=DAILY_PUSH_CONCURRENCY, thread_name_prefix='daily-push') as push_executor:
+            for pet_id, line_user_ids in recipients_by_pet.items():
+                for i in range(0, len(line_user_ids), MULTICAST_BATCH_SIZE):
+                    futures.append(push_executor.submit(
+                        _multicast_fortune_card,
+                        line_user_ids[i:i + MULTICAST_BATCH_SIZE],
+                        pet_id,
+                        fortune_card_urls.get(pet_id)
+                    ))
+            
+            for future in as_completed(futures):
+                sent, failed = future.result()
+                success_count += sent
+                failed_count += failed
         
         # 4. 回傳結果
         app.logger.info(f"📊 每日推播完成 - 成功: {success_count}, 失敗: {failed_count}")
@@ -497,6 +996,57 @@ def daily_fortune():
         }), 500
 
 
+@app.route("/admin/flush_prompt_cache", methods=['POST'])
+def flush_prompt_cache():
+    """
+    清除寵物提示詞快取
+    
+    參數 (query string，可選):
+        pet_id: 只清除指定寵物的快取；不提供則清除全部
+    
+    返回:
+        JSON: {"status": "success", "flushed": 清除的筆數}
+        或 403 Forbidden (如果非 localhost 請求)
+    
+    說明:
+        寵物資料（名字、性格、生命軌跡、信件）在後台更新後呼叫，
+        讓下一則訊息立即使用新的提示詞，不必等待 TTL 過期
+    """
+    if not _is_local_request():
+        abort(403)
+    
+    pet_id = request.args.get('pet_id', type=int)
+    flushed = clear_pet_prompt_cache(pet_id)
+    
+    app.logger.info(f"🧹 已清除提示詞快取 - pet_id: {pet_id or '全部'}, 筆數: {flushed}")
+    return jsonify({"status": "success", "flushed": flushed}), 200
+
+
+@app.route("/admin/flush_user_pet_cache", methods=['POST'])
+def flush_user_pet_cache():
+    """
+    清除 LINE 使用者與寵物的綁定快取
+    
+    參數 (query string，可選):
+        line_user_id: 只清除指定使用者的快取；不提供則清除全部
+    
+    返回:
+        JSON: {"status": "success", "flushed": 清除的筆數}
+        或 403 Forbidden (如果非 localhost 請求)
+    
+    說明:
+        使用者重新綁定或解除綁定寵物後呼叫，讓新的綁定立即生效
+    """
+    if not _is_local_request():
+        abort(403)
+    
+    line_user_id = request.args.get('line_user_id')
+    flushed = clear_user_pet_cache(line_user_id)
+    
+    app.logger.info(f"🧹 已清除綁定快取 - line_user_id: {line_user_id or '全部'}, 筆數: {flushed}")
+    return jsonify({"status": "success", "flushed": flushed}), 200
+
+
 # ============================================
 # LINE Bot 事件處理 (SDK v3)
 # ============================================
@@ -508,13 +1058,29 @@ def handle_text_message(event):
     
     參數:
         event: LINE MessageEvent 物件
+    
+    說明:
+        實際處理交給背景執行緒池，webhook 不必等待 LLM 回應即可回傳 200
+        reply_token 約 1 分鐘內有效，逾時則改用 push_message 補送
+        背景工作已達 WEBHOOK_QUEUE_LIMIT 時不排隊，直接回覆忙碌訊息
     """
-    line_handle_text_message(
+    if not _webhook_slots.acquire(blocking=False):
+        app.logger.warning("⚠️ 背景工作已滿（%s），略過此訊息: user_id=%s", WEBHOOK_QUEUE_LIMIT, event.source.user_id)
+        try:
+            line_bot_api.reply_message(
+                ReplyMessageRequest(reply_token=event.reply_token, messages=[BUSY_MSG])
+            )
+        except Exception as e:
+            app.logger.error(f"❌ 回覆忙碌訊息失敗: {e}")
+        return
+    
+    future = executor.submit(
+        line_handle_text_message,
         event=event,
-        get_pet_id_by_line_user_func=get_pet_id_by_line_user,
+        get_pet_id_by_line_user_func=get_cached_pet_id_by_line_user,
         get_pet_system_prompt_func=get_pet_system_prompt,
-        clear_chat_history_func=clear_chat_history,
-        save_chat_message_func=save_chat_message,
+        clear_chat_history_func=clear_chat_history_and_binding,
+        save_chat_turn_func=enqueue_chat_turn,
         get_chat_history_func=get_chat_history,
         chat_with_pet_api_func=chat_with_pet_api,
         chat_with_pet_ollama_func=chat_with_pet_ollama,
@@ -524,15 +1090,68 @@ def handle_text_message(event):
         AI_MODE=AI_MODE,
         QWEN_MODEL=QWEN_MODEL,
         OLLAMA_MODEL=OLLAMA_MODEL,
-        configuration=configuration,
+        line_bot_api=line_bot_api,
         base_dir=_get_base_dir()
     )
+    future.add_done_callback(lambda _: _webhook_slots.release())
+
+
+# ============================================
+# 啟動預熱
+# ============================================
+
+def _warmup_caches():
+    """
+    預先載入寵物提示詞、綁定快取與占卜卡覆蓋圖片
+    
+    說明:
+        在模組載入時執行（gunicorn 的每個 worker 也會執行），
+        讓重啟後第一則訊息不必等待寵物資料 API 與提示詞建立
+        預熱範圍：預設 PET_ID + 所有已綁定 LINE 使用者的寵物
+    """
+    try:
+        bound_users = get_all_bound_users()
+        pet_ids = {PET_ID}
+        for user in bound_users:
+            pet_ids.add(user['pet_id'])
+            with _user_pet_cache_lock:
+                _user_pet_cache[user['line_user_id']] = user['pet_id']
+        
+        warmed = 0
+        for pet_id in pet_ids:
+            system_prompt, _, _ = get_pet_system_prompt(pet_id)
+            if system_prompt:
+                warmed += 1
+        
+        logger.info(f"🔥 快取預熱完成 - 寵物提示詞: {warmed}/{len(pet_ids)}, 綁定使用者: {len(bound_users)}")
+    except Exception as e:
+        logger.warning(f"⚠️ 快取預熱失敗: {e}")
+    
+    # 占卜卡本地覆蓋圖片預先縮放
+    try:
+        preload_fortune_backgrounds()
+    except Exception as e:
+        logger.warning(f"⚠️ 覆蓋圖片預先縮放失敗: {e}")
+
+
+# 在背景執行緒預熱，不阻塞應用程式啟動
+if os.getenv('CACHE_WARMUP', 'true').lower() in ['1', 'true', 'yes', 'on']:
+    Thread(target=_warmup_caches, name='cache-warmup', daemon=True).start()
 
 
 # ============================================
 # 主程式入口
 # ============================================
 
+def _write_banner(lines):
+    """
+    一次輸出多行啟動訊息，輸出後清空列表以便繼續收集下一段
+    """
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+    lines.clear()
+
+
 def main():
     """
     主程式入口點
@@ -541,42 +1160,47 @@ def main():
         1. 顯示啟動訊息
         2. 檢查必要的環境設定
         3. 啟動 Flask 應用
+    
+    說明:
+        啟動訊息先收集到 banner，再一次寫入 stdout（減少逐行 print 的系統呼叫）
     """
-    print("=" * 50)
-    print("🐕 寵物聊天機器人 - LINE Bot (SDK v3)")
-    print("=" * 50)
+    banner = []
+    banner.append("=" * 50)
+    banner.append("🐕 寵物聊天機器人 - LINE Bot (SDK v3)")
+    banner.append("=" * 50)
     
     # 檢查環境設定
-    print("\n📋 環境設定檢查：")
+    banner.append("\n📋 環境設定檢查：")
     
     if LINE_CHANNEL_ACCESS_TOKEN and LINE_CHANNEL_ACCESS_TOKEN != 'your_channel_access_token':
-        print("✅ LINE Channel Access Token 已設定")
+        banner.append("✅ LINE Channel Access Token 已設定")
     else:
-        print("❌ LINE Channel Access Token 未設定")
+        banner.append("❌ LINE Channel Access Token 未設定")
     
     if LINE_CHANNEL_SECRET and LINE_CHANNEL_SECRET != 'your_channel_secret':
-        print("✅ LINE Channel Secret 已設定")
+        banner.append("✅ LINE Channel Secret 已設定")
     else:
-        print("❌ LINE Channel Secret 未設定")
+        banner.append("❌ LINE Channel Secret 未設定")
     
     # 測試寵物資料載入
     system_prompt, pet_name, _ = get_pet_system_prompt()
     if system_prompt and pet_name:
-        print(f"✅ 寵物資料已載入：{pet_name}")
+        banner.append(f"✅ 寵物資料已載入：{pet_name}")
     else:
-        print("⚠️  無法載入寵物資料（請確認資料庫連線）")
+        banner.append("⚠️  無法載入寵物資料（請確認資料庫連線）")
     
-    print(f"\n🤖 AI 模式：{AI_MODE}")
+    banner.append(f"\n🤖 AI 模式：{AI_MODE}")
     if AI_MODE == 'api':
-        print(f"🌐 使用的 API 模型：{QWEN_MODEL}")
+        banner.append(f"🌐 使用的 API 模型：{QWEN_MODEL}")
         api_key_status = "已設定" if os.getenv('QWEN_API_KEY') and os.getenv('QWEN_API_KEY') != 'your_qwen_api_key' else "未設定"
-        print(f"🔑 API Key 狀態：{api_key_status}")
+        banner.append(f"🔑 API Key 狀態：{api_key_status}")
         if api_key_status == "未設定":
-            print("⚠️  警告：API Key 未設定，API 模式可能無法正常工作")
+            banner.append("⚠️  警告：API Key 未設定，API 模式可能無法正常工作")
     else:
-        print(f"🏠 使用的本地模型：{OLLAMA_MODEL}")
-        print("💡 提示：如需切換到 API 模式，請設定 AI_MODE=api 和 QWEN_API_KEY")
-    print(f"🐕 寵物 ID：{PET_ID}")
+        banner.append(f"🏠 使用的本地模型：{OLLAMA_MODEL}")
+        banner.append("💡 提示：如需切換到 API 模式，請設定 AI_MODE=api 和 QWEN_API_KEY")
+    banner.append(f"🐕 寵物 ID：{PET_ID}")
+    _write_banner(banner)
     
     # 記錄啟動資訊到日誌
     logger.info("🚀 寵物聊天機器人啟動完成")
@@ -601,23 +1225,36 @@ def main():
         logger.warning(f"⚠️  初始化每日占卜卡資料表時發生錯誤: {e}")
         logger.warning("💡 提示: 請手動執行 SQL 創建 daily_fortune_cards 表")
     
+    # 確認對話歷史查詢用的索引存在
+    if create_chat_history_index():
+        logger.info("✅ chat_history 索引檢查完成")
+    else:
+        logger.warning("⚠️  無法確認 chat_history 索引，對話歷史查詢可能需要排序")
+    
     # 啟動 Flask 應用
     port = int(os.getenv('PORT', 8000))
-    print(f"\n🚀 啟動 Flask 伺服器於埠號 {port}...")
-    print(f"📍 首頁: http://localhost:{port}/")
-    print(f"📍 Webhook: http://localhost:{port}/webhook")
-    print(f"📍 測試: http://localhost:{port}/test")
-    print("\n提示：")
-    print("1. 使用 ngrok 將本地服務暴露到公網")
-    print("   ngrok http", port)
-    print("2. 在 LINE Developers Console 設定 Webhook URL:")
-    print("   https://你的ngrok網址.ngrok.io/webhook")
-    print("3. 開始與寵物聊天！")
-    print("=" * 50)
-    print()
-    
-    # 啟動 Flask (開發模式)
-    app.run(host='0.0.0.0', port=port, debug=True)
+    banner.append(f"\n🚀 啟動 Flask 伺服器於埠號 {port}...")
+    banner.append(f"📍 首頁: http://localhost:{port}/")
+    banner.append(f"📍 Webhook: http://localhost:{port}/webhook")
+    banner.append(f"📍 測試: http://localhost:{port}/test")
+    banner.append("\n提示：")
+    banner.append("1. 使用 ngrok 將本地服務暴露到公網")
+    banner.append(f"   ngrok http {port}")
+    banner.append("2. 在 LINE Developers Console 設定 Webhook URL:")
+    banner.append("   https://你的ngrok網址.ngrok.io/webhook")
+    banner.append("3. 開始與寵物聊天！")
+    banner.append("=" * 50)
+    banner.append("")
+    _write_banner(banner)
+    
+    # 內建伺服器僅供本地開發；正式環境請使用 gunicorn -c gunicorn.conf.py wsgi:app
+    if os.getenv('FLASK_ENV') == 'development':
+        app.run(host='0.0.0.0', port=port, debug=False)
+    else:
+        banner.append("⚠️  非開發環境不啟動 Flask 內建伺服器")
+        banner.append("   正式環境請執行：gunicorn -c gunicorn.conf.py wsgi:app")
+        banner.append("   本地開發請設定 FLASK_ENV=development")
+        _write_banner(banner)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+# chat_log_queue.py
+# ============================================
+# 對話記錄背景寫入佇列
+# ============================================
+# 功能：回覆使用者前不再等待資料庫寫入，對話記錄先放入佇列，
+#       由單一背景執行緒每 CHAT_LOG_FLUSH_INTERVAL 秒或累積
+#       CHAT_LOG_BATCH_SIZE 輪時，以一次多筆 INSERT 寫入
+# 設定 CHAT_LOG_ASYNC=false 可改回同步寫入
+# ============================================
+
+import atexit
+import logging
+import os
+import queue
+import time
+from threading import Lock, Thread
+
+logger = logging.getLogger('pet_chatbot')
+
+try:
+    from mybot.db_utils import save_chat_turn, save_chat_turns_bulk
+except ImportError:
+    from db_utils import save_chat_turn, save_chat_turns_bulk
+
+
+CHAT_LOG_ASYNC = os.getenv('CHAT_LOG_ASYNC', 'true').lower() in ['1', 'true', 'yes', 'on']
+CHAT_LOG_BATCH_SIZE = int(os.getenv('CHAT_LOG_BATCH_SIZE', 50))
+CHAT_LOG_FLUSH_INTERVAL = float(os.getenv('CHAT_LOG_FLUSH_INTERVAL', 0.2))
+# 佇列上限：資料庫長時間無法寫入時不無限累積，滿了改為同步寫入
+CHAT_LOG_QUEUE_MAX = int(os.getenv('CHAT_LOG_QUEUE_MAX', 10000))
+# flush_chat_log_queue 最多等待的秒數（資料庫卡住時不讓「清除」指令或結束程序一直等）
+CHAT_LOG_FLUSH_TIMEOUT = float(os.getenv('CHAT_LOG_FLUSH_TIMEOUT', 5))
+
+_queue = queue.Queue(maxsize=CHAT_LOG_QUEUE_MAX)
+_writer_thread = None
+_writer_lock = Lock()
+_atexit_registered = False
+
+
+def _writer_loop():
+    """背景執行緒：取出佇列中的對話，湊滿一批或逾時後一次寫入"""
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + CHAT_LOG_FLUSH_INTERVAL
+        while len(batch) < CHAT_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            if not save_chat_turns_bulk(batch):
+                logger.error(f"❌ 背景寫入對話記錄失敗，遺失 {len(batch)} 輪對話")
+        except Exception as e:
+            # 例如資料庫無法連線：記錄後繼續處理下一批，不能讓寫入執行緒結束
+            logger.exception(f"❌ 背景寫入對話記錄發生錯誤，遺失 {len(batch)} 輪對話: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _ensure_writer():
+    # 延遲到第一次寫入才啟動執行緒（gunicorn fork 之後，每個 worker 各自一條）
+    # 執行緒意外結束時重新啟動，避免之後的對話只進佇列而不寫入
+    global _writer_thread, _atexit_registered
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            if _writer_thread is not None:
+                logger.error("❌ 對話記錄寫入執行緒已結束，重新啟動")
+            _writer_thread = Thread(target=_writer_loop, name='chat-log-writer', daemon=True)
+            _writer_thread.start()
+            if not _atexit_registered:
+                atexit.register(flush_chat_log_queue)
+                _atexit_registered = True
+
+
+def enqueue_chat_turn(line_user_id: str, pet_id: int, user_message: str, assistant_message: str):
+    """
+    儲存一輪對話（與 db_utils.save_chat_turn 相同介面）
+    
+    返回:
+        bool: 已放入佇列（或同步寫入成功）返回 True
+    
+    說明:
+        CHAT_LOG_ASYNC 關閉時直接呼叫 save_chat_turn 同步寫入
+    """
+    if not CHAT_LOG_ASYNC:
+        return save_chat_turn(line_user_id, pet_id, user_message, assistant_message)
+    _ensure_writer()
+    try:
+        _queue.put_nowait((line_user_id, pet_id, user_message, assistant_message))
+    except queue.Full:
+        logger.warning("⚠️ 對話記錄佇列已滿，改為同步寫入")
+        return save_chat_turn(line_user_id, pet_id, user_message, assistant_message)
+    return True
+
+
+def flush_chat_log_queue(timeout: float = None):
+    """
+    等待佇列中的對話全部寫入資料庫
+    
+    參數:
+        timeout (float, optional): 最多等待秒數，預設 CHAT_LOG_FLUSH_TIMEOUT
+    
+    返回:
+        bool: 佇列已清空返回 True，逾時返回 False
+    
+    說明:
+        清除對話記錄前與程式結束時呼叫，避免尚未寫入的對話在清除後才寫入或遺失
+        資料庫卡住時最多等待 timeout 秒，不會讓呼叫端無限期停住
+    """
+    if _writer_thread is None:
+        return True
+    _ensure_writer()
+    if timeout is None:
+        timeout = CHAT_LOG_FLUSH_TIMEOUT
+    deadline = time.monotonic() + timeout
+    # Queue.join() 沒有逾時參數，改為直接等待 all_tasks_done 條件
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"⚠️ 等待對話記錄寫入逾時，仍有 {_queue.unfinished_tasks} 輪未寫入")
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
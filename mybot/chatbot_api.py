@@ -7,13 +7,138 @@
 # 依賴：httpx, opencc-python-reimplemented
 # ============================================
 
+import atexit
 import httpx
 import json
+import logging
 import os
-from opencc import OpenCC
+import re
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支援需要 h2 套件
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+logger = logging.getLogger('pet_chatbot')
+
+# API 呼叫失敗時回給主人的訊息
+ERROR_REPLY = "嗚...主人，我現在有點不舒服，請稍後再試試看 🥺"
+
+# 共用的 Qwen API 客戶端（保持連線的連線池）
+# 所有執行緒共用同一組連線，避免每則訊息都重新建立 TCP/TLS 連線
+# 安裝 h2 後啟用 HTTP/2：多則對話可在同一條連線上並行；伺服器不支援時自動使用 HTTP/1.1
+QWEN_HTTP2 = os.getenv('QWEN_HTTP2', 'true').lower() == 'true' and _HTTP2_AVAILABLE
+qwen_client = httpx.Client(
+    http2=QWEN_HTTP2,
+    timeout=float(os.getenv('QWEN_TIMEOUT', 30)),
+    limits=httpx.Limits(
+        max_connections=int(os.getenv('QWEN_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(os.getenv('QWEN_MAX_KEEPALIVE', 20))
+    ),
+    headers={"Content-Type": "application/json"}
+)
+atexit.register(qwen_client.close)
+
+
+def _json_dumps(data) -> bytes:
+    """序列化請求內容（有安裝 orjson 時使用，大型 system prompt 編碼較快）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _json_loads(data):
+    """解析回應內容（有安裝 orjson 時使用）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 是否以串流（SSE）接收 Qwen 回覆：邊接收邊組合，不必等完整 JSON 回應
+QWEN_STREAM = os.getenv('QWEN_STREAM', 'false').lower() == 'true'
+
+# 每次請求都相同的生成參數（只有 model 與 messages 會隨請求變動）
+REQUEST_DEFAULTS = {
+    "max_tokens": 100,  # 限制輸出長度（約40-50個中文字）
+    "temperature": 0.8,  # 控制創造性（0.7-0.9 較自然）
+    "top_p": 0.9,       # 控制多樣性
+    "stop": ("\n\n", "。。")  # 遇到這些符號提前停止
+}
+
+# 送進 API 的對話歷史上限（輪數），避免 prompt 與 token 成本隨歷史線性增加
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', 8))
+
+@lru_cache(maxsize=1)
+def get_converter():
+    """
+    取得簡繁轉換器（Simple to Traditional，第一次轉換時才載入字典）
+    """
+    from opencc import OpenCC
+    return OpenCC('s2t')  # 簡體轉繁體（標準配置，最穩定）
+
+# 常見需要保護的詞彙（避免錯誤轉換）
+COMMON_PROTECTED_WORDS = frozenset((
+    "起床", "起床了", "起床時間", "早上起床", "起床吃飯", "起床運動",
+    "起床看書", "起床工作", "起床學習", "起床玩耍", "起床洗澡",
+    "起床刷牙", "起床穿衣服", "起床整理", "起床準備", "起床出門",
+    "吃飯", "睡覺", "洗澡", "刷牙", "穿衣服", "整理", "準備", "出門",
+    "回家", "工作", "學習", "看書", "運動", "玩耍", "休息", "放鬆",
+    "開心", "快樂", "高興", "興奮", "緊張", "擔心", "害怕", "勇敢",
+    "聰明", "可愛", "漂亮", "帥氣", "溫柔", "體貼", "善良", "友好",
+    "主人", "朋友", "家人", "爸爸", "媽媽", "哥哥", "姐姐", "弟弟", "妹妹",
+    "狗狗", "貓貓", "寵物", "動物", "玩具", "食物", "零食", "骨頭", "球球"
+))
+
+# 後處理：修正常見的錯誤轉換
+CORRECTION_RULES = {
+    '牀': '床',
+    '起牀': '起床',
+    '裏': '裡',
+    '裏面': '裡面',
+    '裏頭': '裡頭',
+    '裏邊': '裡邊',
+    '図': '囉',
+    '哈図': '哈囉',
+    '図啦': '囉啦'
+}
+
+# 所有修正規則組成單一比對規則（較長的詞優先），一次掃描完成全部替換
+_CORRECTION_RE = re.compile('|'.join(
+    re.escape(wrong) for wrong in sorted(CORRECTION_RULES, key=len, reverse=True)
+))
+
+# 中日韓文字範圍：不含任何漢字的文字（英數、標點、emoji）簡繁轉換不會改變內容
+_CJK_RE = re.compile('[\u2e80-\u9fff\uf900-\ufaff\U00020000-\U0002ffff]')
+
+# 保護標記使用 Unicode 私用區字元（OpenCC 不會轉換，且每個標記只佔一個字元）
+_SENTINEL_BASE = 0xE000
+
+
+@lru_cache(maxsize=256)
+def _get_protected_pattern(extra_words: tuple) -> re.Pattern:
+    """
+    取得保護詞彙的比對規則（快取）
+    
+    參數:
+        extra_words (tuple): 呼叫端額外指定的保護詞彙（例如寵物名字）
+    
+    返回:
+        re.Pattern: 所有保護詞彙組成的單一比對規則
+    
+    說明:
+        較長的詞彙排在前面，重疊時優先比對最長的詞（例如「起床了」優先於「起床」）
+        同一組額外詞彙只編譯一次，之後每則回覆只需掃描文字一次
+    """
+    ordered = sorted(COMMON_PROTECTED_WORDS.union(extra_words), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(word) for word in ordered))
 
-# 初始化簡繁轉換器（Simple to Traditional）
-cc = OpenCC('s2t')  # 簡體轉繁體（標準配置，最穩定）
 
 def convert_simple_to_traditional(text: str, protected_words: list = None) -> str:
     """
@@ -30,154 +155,83 @@ def convert_simple_to_traditional(text: str, protected_words: list = None) -> st
         使用 OpenCC (Open Chinese Convert) 進行簡繁轉換
         確保 Qwen 模型輸出的簡體中文能被正確顯示為繁體
         保護特定詞彙（如寵物名字）避免被錯誤轉換（例如「里長」→「裏長」）
+        所有保護詞彙以單一規則一次掃描替換，不需逐詞搜尋整段文字
+        相同文字與保護詞彙的轉換結果會快取（常見的問候、錯誤訊息不必重複轉換）
+        不含漢字的文字（純英數、標點、emoji）直接返回，不進入 OpenCC
     """
-    if not text:
+    if not text or text.isascii() or not _CJK_RE.search(text):
         return text
     
-    # 常見需要保護的詞彙（避免錯誤轉換）
-    common_protected_words = [
-        "起床", "起床了", "起床時間", "早上起床", "起床吃飯", "起床運動",
-        "起床看書", "起床工作", "起床學習", "起床玩耍", "起床洗澡",
-        "起床刷牙", "起床穿衣服", "起床整理", "起床準備", "起床出門",
-        "吃飯", "睡覺", "洗澡", "刷牙", "穿衣服", "整理", "準備", "出門",
-        "回家", "工作", "學習", "看書", "運動", "玩耍", "休息", "放鬆",
-        "開心", "快樂", "高興", "興奮", "緊張", "擔心", "害怕", "勇敢",
-        "聰明", "可愛", "漂亮", "帥氣", "溫柔", "體貼", "善良", "友好",
-        "主人", "朋友", "家人", "爸爸", "媽媽", "哥哥", "姐姐", "弟弟", "妹妹",
-        "狗狗", "貓貓", "寵物", "動物", "玩具", "食物", "零食", "骨頭", "球球"
-    ]
-    
-    # 合併用戶指定的保護詞彙和常見保護詞彙
-    all_protected_words = []
-    if protected_words:
-        all_protected_words.extend(protected_words)
-    all_protected_words.extend(common_protected_words)
-    
-    # 去重並過濾空值
-    unique_protected_words = list(set([word for word in all_protected_words if word and word.strip()]))
-    
-    if not unique_protected_words:
-        return cc.convert(text)
-    
-    # 使用臨時標記保護特定詞彙
-    protected_map = {}
-    temp_text = text
-    
-    for i, word in enumerate(unique_protected_words):
-        if word in temp_text:
-            placeholder = f"__PROTECTED_{i}_{hash(word)}__"
-            protected_map[placeholder] = word
-            temp_text = temp_text.replace(word, placeholder)
+    # 去重並過濾空值，排序後作為快取鍵
+    extra_words = tuple(sorted({word for word in (protected_words or ()) if word and word.strip()}))
+    return _convert_cached(text, extra_words)
+
+
+@lru_cache(maxsize=4096)
+def _convert_cached(text: str, extra_words: tuple) -> str:
+    """
+    實際執行簡繁轉換（依文字與保護詞彙快取）
+    
+    參數:
+        text (str): 輸入的簡體中文文字
+        extra_words (tuple): 已去重排序的額外保護詞彙
+    
+    返回:
+        str: 轉換後的繁體中文文字
+    """
+    pattern = _get_protected_pattern(extra_words)
+    
+    # 使用臨時標記保護特定詞彙（一次掃描，同一個詞共用同一個標記）
+    sentinels = {}
+    
+    def _protect(match):
+        word = match.group(0)
+        sentinel = sentinels.get(word)
+        if sentinel is None:
+            sentinel = sentinels[word] = chr(_SENTINEL_BASE + len(sentinels))
+        return sentinel
+    
+    temp_text = pattern.sub(_protect, text)
     
     # 進行簡繁轉換
-    converted_text = cc.convert(temp_text)
-    
-    # 還原保護的詞彙
-    for placeholder, original_word in protected_map.items():
-        converted_text = converted_text.replace(placeholder, original_word)
-    
-    # 後處理：修正常見的錯誤轉換
-    correction_rules = {
-        '牀': '床',
-        '起牀': '起床',
-        '裏': '裡',
-        '裏面': '裡面',
-        '裏頭': '裡頭',
-        '裏邊': '裡邊',
-        '図': '囉',
-        '哈図': '哈囉',
-        '図啦': '囉啦'
-    }
-    
-    for wrong, correct in correction_rules.items():
-        converted_text = converted_text.replace(wrong, correct)
+    converted_text = get_converter().convert(temp_text)
+    
+    # 還原保護的詞彙（str.translate 一次掃描還原所有標記）
+    if sentinels:
+        converted_text = converted_text.translate(
+            {ord(sentinel): word for word, sentinel in sentinels.items()}
+        )
+    
+    # 後處理：修正常見的錯誤轉換（一次掃描）
+    converted_text = _CORRECTION_RE.sub(lambda match: CORRECTION_RULES[match.group(0)], converted_text)
     
     return converted_text
 
-def build_system_prompt(pet_name, persona, life_data=None, cover_slogan=None, letter=None, breed=None):
+
+# 清除轉換快取（例如調整保護詞彙或修正規則後）
+convert_simple_to_traditional.cache_clear = _convert_cached.cache_clear
+
+# 標題中常見的連接詞和助詞（提取關鍵詞時移除）
+_TITLE_STOPWORD_RE = re.compile(r'[的、了、在、和、與、到、去、帶、讓、給]')
+
+
+@lru_cache(maxsize=512)
+def _extract_title_keywords(title: str) -> tuple:
     """
-    建立寵物角色的系統提示詞 (System Prompt)
+    將生命軌跡標題分解為可能的關鍵詞（快取）
     
     參數:
-        pet_name (str): 寵物的名字
-        persona (dict): 性格模板字典，包含「性格」、「喜好」、「說話方式」
-        life_data (list, optional): 寵物的生命軌跡事件列表
-        cover_slogan (str, optional): 主人對寵物的愛意表達
-        letter (str, optional): 主人寫給寵物的信件內容
-        breed (str, optional): 寵物品種（例如：黃金獵犬）
+        title (str): 事件標題
     
     返回:
-        str: 完整的系統提示詞，用於引導 AI 模型扮演寵物角色
-    
-    說明:
-        這個函數是整個聊天機器人的靈魂，它定義了：
-        1. 寵物的身份和性格特質
-        2. 寵物的說話方式和行為規則
-        3. 寵物的生命經歷和與主人的回憶
-        4. 如何用寵物的視角思考和回覆
+        tuple: 長度大於 1 的關鍵詞
     """
-    # 建立生命軌跡文字（結構化格式）
-    life_memories = ""
-    if life_data:
-        life_memories = "\n        📸 生命軌跡記憶（請不要混淆不同事件）：\n"
-        
-        # 為每個事件生成唯一編號和結構化格式
-        for i, event in enumerate(life_data, 1):
-            age = event.get('age', '')
-            title = event.get('title', '')
-            text = event.get('text', '')
-            
-            # 清理 HTML 標籤
-            clean_text = text.replace('<br>', ' ') if text else ''
-            
-            life_memories += f"        [EventID: L{i}] 年齡：{age}\n"
-            life_memories += f"        標題：{title}\n"
-            if clean_text:
-                life_memories += f"        描述：{clean_text}\n"
-            life_memories += "\n"
-        
-        # 添加記憶檢索規則
-        life_memories += "        ⚠️ 記憶檢索規則：\n"
-        life_memories += "        - 當主人詢問「還記得 X 嗎？」時，只能根據生命軌跡記憶中對應的事件回覆\n"
-        
-        # 為每個事件生成具體的檢索規則
-        for i, event in enumerate(life_data, 1):
-            title = event.get('title', '')
-            age = event.get('age', '')
-            
-            # 動態提取標題中的關鍵詞來建立檢索規則
-            # 將標題分解為可能的關鍵詞
-            keywords = []
-            if title:
-                # 提取標題中的主要詞彙
-                import re
-                # 移除常見的連接詞和助詞
-                clean_title = re.sub(r'[的、了、在、和、與、到、去、帶、讓、給]', ' ', title)
-                words = clean_title.split()
-                keywords = [word.strip() for word in words if len(word.strip()) > 1]
-            
-            if keywords:
-                keyword_str = '」或「'.join(keywords)
-                life_memories += f"        - 如果問題包含「{keyword_str}」，只能使用 EventID: L{i}\n"
-            else:
-                life_memories += f"        - 如果問題提到「{title}」相關內容，只能使用 EventID: L{i}\n"
-        
-        life_memories += "        - 絕對不要同時引用不同事件\n"
-        life_memories += "        - 每個事件都是獨立的，有特定的時間、地點和情境\n"
-    
-    # 建立主人信件文字
-    owner_letter = ""
-    if letter:
-        owner_letter = f"\n        主人對我說的話：\n        「{letter}」\n"
-    
-    # 建立主人愛意表達文字
-    owner_love = ""
-    if cover_slogan:
-        # 清理 HTML 標籤，讓文字更自然
-        clean_slogan = cover_slogan.replace('<br>', '\n        ')
-        owner_love = f"\n        主人對我的愛意表達：\n        「{clean_slogan}」\n"
-    
-    return f"""
+    words = _TITLE_STOPWORD_RE.sub(' ', title).split()
+    return tuple(word for word in words if len(word) > 1)
+
+
+# 寵物角色的系統提示詞範本（build_system_prompt 以 format_map 填入）
+SYSTEM_PROMPT_TEMPLATE = """
         【核心身份】你必須永遠記住：你的名字是「{pet_name}」，你是一隻{breed}，是主人的寶貝毛小孩。無論何時，你都要清楚知道自己是「{pet_name}」，不是其他寵物，也不是 AI。
 
         🆔 你的身份資訊：
@@ -187,9 +241,9 @@ def build_system_prompt(pet_name, persona, life_data=None, cover_slogan=None, le
         - 重要：你必須知道自己是「{pet_name}」，當主人問你「你是誰」時，你要回答「我是{pet_name}」
 
         🐕 你的寵物特質：
-        - 性格：{persona['性格']}
-        - 喜好：{persona['喜好']}
-        - 說話方式：{persona['說話方式']}
+        - 性格：{persona_personality}
+        - 喜好：{persona_likes}
+        - 說話方式：{persona_style}
 
         🗣️ 寵物說話規則：
         1. 用簡單的詞彙，像寵物一樣思考
@@ -246,6 +300,130 @@ def build_system_prompt(pet_name, persona, life_data=None, cover_slogan=None, le
     """
 
 
+def build_system_prompt(pet_name, persona, life_data=None, cover_slogan=None, letter=None, breed=None):
+    """
+    建立寵物角色的系統提示詞 (System Prompt)
+    
+    參數:
+        pet_name (str): 寵物的名字
+        persona (dict): 性格模板字典，包含「性格」、「喜好」、「說話方式」
+        life_data (list, optional): 寵物的生命軌跡事件列表
+        cover_slogan (str, optional): 主人對寵物的愛意表達
+        letter (str, optional): 主人寫給寵物的信件內容
+        breed (str, optional): 寵物品種（例如：黃金獵犬）
+    
+    返回:
+        str: 完整的系統提示詞，用於引導 AI 模型扮演寵物角色
+    
+    說明:
+        這個函數是整個聊天機器人的靈魂，它定義了：
+        1. 寵物的身份和性格特質
+        2. 寵物的說話方式和行為規則
+        3. 寵物的生命經歷和與主人的回憶
+        4. 如何用寵物的視角思考和回覆
+    """
+    # 建立生命軌跡文字（結構化格式）
+    # 先收集成片段列表再一次 join，避免迴圈中反覆 += 產生中間字串
+    life_memories = ""
+    if life_data:
+        parts = ["\n        📸 生命軌跡記憶（請不要混淆不同事件）：\n"]
+        append = parts.append
+        
+        # 為每個事件生成唯一編號和結構化格式
+        for i, event in enumerate(life_data, 1):
+            age = event.get('age', '')
+            title = event.get('title', '')
+            text = event.get('text', '')
+            
+            # 清理 HTML 標籤
+            clean_text = text.replace('<br>', ' ') if text else ''
+            
+            append(f"        [EventID: L{i}] 年齡：{age}\n")
+            append(f"        標題：{title}\n")
+            if clean_text:
+                append(f"        描述：{clean_text}\n")
+            append("\n")
+        
+        # 添加記憶檢索規則
+        append("        ⚠️ 記憶檢索規則：\n")
+        append("        - 當主人詢問「還記得 X 嗎？」時，只能根據生命軌跡記憶中對應的事件回覆\n")
+        
+        # 為每個事件生成具體的檢索規則
+        for i, event in enumerate(life_data, 1):
+            title = event.get('title', '')
+            age = event.get('age', '')
+            
+            # 動態提取標題中的關鍵詞來建立檢索規則
+            keywords = _extract_title_keywords(title) if title else ()
+            
+            if keywords:
+                keyword_str = '」或「'.join(keywords)
+                append(f"        - 如果問題包含「{keyword_str}」，只能使用 EventID: L{i}\n")
+            else:
+                append(f"        - 如果問題提到「{title}」相關內容，只能使用 EventID: L{i}\n")
+        
+        append("        - 絕對不要同時引用不同事件\n")
+        append("        - 每個事件都是獨立的，有特定的時間、地點和情境\n")
+        life_memories = "".join(parts)
+    
+    # 建立主人信件文字
+    owner_letter = ""
+    if letter:
+        owner_letter = f"\n        主人對我說的話：\n        「{letter}」\n"
+    
+    # 建立主人愛意表達文字
+    owner_love = ""
+    if cover_slogan:
+        # 清理 HTML 標籤，讓文字更自然
+        clean_slogan = cover_slogan.replace('<br>', '\n        ')
+        owner_love = f"\n        主人對我的愛意表達：\n        「{clean_slogan}」\n"
+    
+    return SYSTEM_PROMPT_TEMPLATE.format_map({
+        'pet_name': pet_name,
+        'breed': breed,
+        'persona_personality': persona['性格'],
+        'persona_likes': persona['喜好'],
+        'persona_style': persona['說話方式'],
+        'life_memories': life_memories,
+        'owner_love': owner_love,
+        'owner_letter': owner_letter
+    })
+
+
+def _read_stream_reply(api_url, request_data, headers):
+    """
+    以串流（SSE）方式呼叫 Qwen API，並組合完整回覆
+    
+    參數:
+        api_url (str): API 端點
+        request_data (dict): 請求資料（會加上 stream=True）
+        headers (dict): 請求標頭
+    
+    返回:
+        str: 組合後的回覆文字（簡體，尚未轉換）
+    
+    說明:
+        OpenAI 相容格式：每行 "data: {...}"，內容在 choices[0].delta.content
+        收到 "data: [DONE]" 代表結束
+    """
+    parts = []
+    body = _json_dumps({**request_data, "stream": True})
+    with qwen_client.stream("POST", api_url, content=body, headers=headers) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = _json_loads(data).get("choices") or []
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    parts.append(content)
+    return "".join(parts)
+
+
 def chat_with_pet_api(system_prompt, user_input, history=None, model="qwen-flash", pet_name=None):
     """
     呼叫 Qwen Flash API 進行對話，生成寵物的回覆
@@ -270,16 +448,21 @@ def chat_with_pet_api(system_prompt, user_input, history=None, model="qwen-flash
     注意:
         - 需要設定 QWEN_API_KEY 環境變數
         - 需要網路連線
-        - 對話歷史越長，API 成本越高，建議限制在 8-10 輪以內
+        - 對話歷史越長，API 成本越高，超過 CHAT_HISTORY_TURNS 輪（預設 8）的舊對話不會送出
     """
-    if history is None:
-        history = []
+    # 只保留最近 CHAT_HISTORY_TURNS 輪對話
+    recent = history[-CHAT_HISTORY_TURNS:] if history and CHAT_HISTORY_TURNS > 0 else []
 
     # 整理成 messages 結構
     messages = [{"role": "system", "content": system_prompt}]
-    for h in history:
-        messages.append({"role": "user", "content": h["user"]})
-        messages.append({"role": "assistant", "content": h["bot"]})
+    messages.extend(
+        message
+        for h in recent
+        for message in (
+            {"role": "user", "content": h["user"]},
+            {"role": "assistant", "content": h["bot"]}
+        )
+    )
     messages.append({"role": "user", "content": user_input})
 
     # 從環境變數取得 API Key
@@ -290,48 +473,40 @@ def chat_with_pet_api(system_prompt, user_input, history=None, model="qwen-flash
     # API 端點（根據實際的 Qwen Flash API 端點調整）
     api_url = os.getenv('QWEN_API_URL', 'https://api.qwen.com/v1/chat/completions')
     
-    # 準備請求資料
-    request_data = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": 100,  # 限制輸出長度（約40-50個中文字）
-        "temperature": 0.8,  # 控制創造性（0.7-0.9 較自然）
-        "top_p": 0.9,       # 控制多樣性
-        "stop": ["\n\n", "。。"]  # 遇到這些符號提前停止
-    }
-
-    # 準備請求標頭
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    # 準備請求資料（固定參數來自 REQUEST_DEFAULTS）
+    request_data = {**REQUEST_DEFAULTS, "model": model, "messages": messages}
+
+    # 準備請求標頭（Content-Type 已設定在共用客戶端）
+    headers = {"Authorization": f"Bearer {api_key}"}
 
     try:
-        # 發送 API 請求
-        with httpx.Client(timeout=30.0) as client:
-            response = client.post(api_url, json=request_data, headers=headers)
+        # 發送 API 請求（共用連線池）
+        if QWEN_STREAM:
+            reply = _read_stream_reply(api_url, request_data, headers)
+        else:
+            response = qwen_client.post(api_url, content=_json_dumps(request_data), headers=headers)
             response.raise_for_status()
             
-            result = response.json()
+            result = _json_loads(response.content)
             
             # 取得回覆
             reply = result["choices"][0]["message"]["content"]
-            
-            # 後處理：將簡體中文轉換為繁體中文，並保護寵物名字
-            protected_words = [pet_name] if pet_name else []
-            reply = convert_simple_to_traditional(reply, protected_words=protected_words)
-            
-            return reply
+        
+        # 後處理：將簡體中文轉換為繁體中文，並保護寵物名字
+        protected_words = [pet_name] if pet_name else []
+        reply = convert_simple_to_traditional(reply, protected_words=protected_words)
+        
+        return reply
             
     except httpx.HTTPError as e:
-        print(f"[ERROR] API 請求失敗: {e}")
-        return "嗚...主人，我現在有點不舒服，請稍後再試試看 🥺"
-    except KeyError as e:
-        print(f"[ERROR] API 回應格式錯誤: {e}")
-        return "嗚...主人，我現在有點不舒服，請稍後再試試看 🥺"
-    except Exception as e:
-        print(f"[ERROR] 未知錯誤: {e}")
-        return "嗚...主人，我現在有點不舒服，請稍後再試試看 🥺"
+        logger.error(f"Qwen API 請求失敗: {e}")
+        return ERROR_REPLY
+    except (KeyError, IndexError, ValueError) as e:
+        logger.error(f"Qwen API 回應格式錯誤: {e!r}")
+        return ERROR_REPLY
+    except Exception:
+        logger.exception("Qwen API 呼叫發生未知錯誤")
+        return ERROR_REPLY
 
 
 # 為了向後相容，保留原來的函數名稱
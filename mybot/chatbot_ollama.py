@@ -4,247 +4,156 @@
 # ============================================
 # 功能：使用 Ollama + Qwen 模型實現寵物擬人化對話
 # 特色：自動將模型輸出的簡體中文轉換為繁體中文
-# 依賴：ollama, opencc-python-reimplemented
+# 依賴：ollama（簡繁轉換與提示詞共用 chatbot_api）
 # ============================================
 
-import ollama
-from opencc import OpenCC
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from threading import Lock
 
-# 初始化簡繁轉換器（Simple to Traditional）
-cc = OpenCC('s2t')  # 簡體轉繁體（標準配置，最穩定）
+from cachetools import LRUCache
 
-def convert_simple_to_traditional(text: str, protected_words: list = None) -> str:
+logger = logging.getLogger('pet_chatbot')
+
+
+@lru_cache(maxsize=1)
+def get_ollama_client():
     """
-    將簡體中文轉換為繁體中文，並保護特定詞彙不被轉換
-    
-    參數:
-        text (str): 輸入的簡體中文文字
-        protected_words (list, optional): 需要保護的詞彙列表（例如寵物名字）
-    
-    返回:
-        str: 轉換後的繁體中文文字
+    取得共用的 Ollama 客戶端（第一次使用時才載入 ollama 套件並建立）
     
     說明:
-        使用 OpenCC (Open Chinese Convert) 進行簡繁轉換
-        確保 Qwen 模型輸出的簡體中文能被正確顯示為繁體
-        保護特定詞彙（如寵物名字）避免被錯誤轉換（例如「里長」→「裏長」）
+        底層為保持連線的 httpx 連線池，所有執行緒共用同一組連線
+        設定逾時避免模型卡住時佔住 worker
+        AI_MODE=api 時不會呼叫，因此不必載入 ollama 套件
     """
-    if not text:
-        return text
-    
-    # 常見需要保護的詞彙（避免錯誤轉換）
-    common_protected_words = [
-        "起床", "起床了", "起床時間", "早上起床", "起床吃飯", "起床運動",
-        "起床看書", "起床工作", "起床學習", "起床玩耍", "起床洗澡",
-        "起床刷牙", "起床穿衣服", "起床整理", "起床準備", "起床出門",
-        "吃飯", "睡覺", "洗澡", "刷牙", "穿衣服", "整理", "準備", "出門",
-        "回家", "工作", "學習", "看書", "運動", "玩耍", "休息", "放鬆",
-        "開心", "快樂", "高興", "興奮", "緊張", "擔心", "害怕", "勇敢",
-        "聰明", "可愛", "漂亮", "帥氣", "溫柔", "體貼", "善良", "友好",
-        "主人", "朋友", "家人", "爸爸", "媽媽", "哥哥", "姐姐", "弟弟", "妹妹",
-        "狗狗", "貓貓", "寵物", "動物", "玩具", "食物", "零食", "骨頭", "球球"
-    ]
-    
-    # 合併用戶指定的保護詞彙和常見保護詞彙
-    all_protected_words = []
-    if protected_words:
-        all_protected_words.extend(protected_words)
-    all_protected_words.extend(common_protected_words)
-    
-    # 去重並過濾空值
-    unique_protected_words = list(set([word for word in all_protected_words if word and word.strip()]))
-    
-    if not unique_protected_words:
-        return cc.convert(text)
-    
-    # 使用臨時標記保護特定詞彙
-    protected_map = {}
-    temp_text = text
-    
-    for i, word in enumerate(unique_protected_words):
-        if word in temp_text:
-            placeholder = f"__PROTECTED_{i}_{hash(word)}__"
-            protected_map[placeholder] = word
-            temp_text = temp_text.replace(word, placeholder)
-    
-    # 進行簡繁轉換
-    converted_text = cc.convert(temp_text)
-    
-    # 還原保護的詞彙
-    for placeholder, original_word in protected_map.items():
-        converted_text = converted_text.replace(placeholder, original_word)
-    
-    # 後處理：修正常見的錯誤轉換
-    correction_rules = {
-        '牀': '床',
-        '起牀': '起床',
-        '裏': '裡',
-        '裏面': '裡面',
-        '裏頭': '裡頭',
-        '裏邊': '裡邊',
-        '図': '囉',
-        '哈図': '哈囉',
-        '図啦': '囉啦'
-    }
-    
-    for wrong, correct in correction_rules.items():
-        converted_text = converted_text.replace(wrong, correct)
-    
-    return converted_text
+    import ollama
+    return ollama.Client(
+        host=os.getenv('OLLAMA_HOST') or None,
+        timeout=float(os.getenv('OLLAMA_TIMEOUT', 60))
+    )
+
+
+# 簡繁轉換共用 chatbot_api 的實作（同一個 OpenCC 轉換器與轉換快取）
+# 支援兩種運行方式
+try:
+    from mybot.chatbot_api import convert_simple_to_traditional
+except ImportError:
+    from chatbot_api import convert_simple_to_traditional
+
+
+# ============================================
+# 對話歷史壓縮（舊對話摘要、近期對話保留原文）
+# ============================================
+
+# 模型 context 長度（token），同時以 num_ctx 傳給 Ollama；超過其 80% 時才壓縮
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', 2048))
+HISTORY_COMPRESS_RATIO = float(os.getenv('HISTORY_COMPRESS_RATIO', 0.8))
+# 累積多少輪尚未摘要的舊對話才更新一次摘要（其間沿用上一次的摘要）
+HISTORY_SUMMARY_EVERY = int(os.getenv('HISTORY_SUMMARY_EVERY', 4))
+
+# 每段對話（conversation_key）的滾動摘要：(摘要, 最後一輪已摘要對話的指紋)
+_summary_cache = LRUCache(maxsize=int(os.getenv('HISTORY_SUMMARY_CACHE', 1024)))
+_summary_cache_lock = Lock()
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗估 token 數：中文等非 ASCII 字元約一字一 token，其餘以 |c|/4 計算"""
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4
+
 
-def build_system_prompt(pet_name, persona, life_data=None, cover_slogan=None, letter=None, breed=None):
+def _turn_fingerprint(turn) -> bytes:
+    """單輪對話的指紋，用來在滑動的歷史視窗中找回上次摘要到哪一輪"""
+    return hashlib.blake2b(f"{turn['user']}\0{turn['bot']}".encode("utf-8"), digest_size=8).digest()
+
+
+def _summarize(previous: str, turns, model: str) -> str:
+    """把先前的摘要與新的舊對話合併成一段新摘要"""
+    transcript = "\n".join(f"主人：{h['user']}\n寵物：{h['bot']}" for h in turns)
+    if previous:
+        transcript = f"先前的摘要：\n{previous}\n\n之後的對話：\n{transcript}"
+    response = get_ollama_client().chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": "請用繁體中文，以 200 字以內摘要以下主人與寵物的對話重點，只輸出摘要內容。"},
+            {"role": "user", "content": transcript},
+        ],
+        options={"num_predict": 200, "temperature": 0.3, "num_ctx": OLLAMA_NUM_CTX}
+    )
+    return response["message"]["content"].strip()
+
+
+def compress_history(history, model_ctx=OLLAMA_NUM_CTX, model="qwen:7b", system_prompt="",
+                     conversation_key=None):
     """
-    建立寵物角色的系統提示詞 (System Prompt)
+    對話歷史過長時，將較舊的對話摘要成一段文字，較新的一半保留原文
     
     參數:
-        pet_name (str): 寵物的名字
-        persona (dict): 性格模板字典，包含「性格」、「喜好」、「說話方式」
-        life_data (list, optional): 寵物的生命軌跡事件列表
-        cover_slogan (str, optional): 主人對寵物的愛意表達
-        letter (str, optional): 主人寫給寵物的信件內容
-        breed (str, optional): 寵物品種（例如：黃金獵犬）
+        history (list): 對話歷史，格式為 [{"user": "...", "bot": "..."}, ...]，最舊的在前
+        model_ctx (int): 模型 context 長度（token）
+        model (str): 用來產生摘要的 Ollama 模型名稱
+        system_prompt (str): 系統提示詞（一併計入長度估算）
+        conversation_key (hashable, optional): 對話識別（例如 (line_user_id, pet_id)），用來沿用滾動摘要
     
     返回:
-        str: 完整的系統提示詞，用於引導 AI 模型扮演寵物角色
+        tuple: (summary, recent_history)
+            summary (str): 舊對話摘要；未壓縮時為空字串
+            recent_history (list): 保留原文的對話歷史
     
     說明:
-        這個函數是整個聊天機器人的靈魂，它定義了：
-        1. 寵物的身份和性格特質
-        2. 寵物的說話方式和行為規則
-        3. 寵物的生命經歷和與主人的回憶
-        4. 如何用寵物的視角思考和回覆
+        估算總長度未超過 θ = HISTORY_COMPRESS_RATIO × model_ctx 時原樣返回
+        每段對話保留一份滾動摘要，記錄摘要到哪一輪；歷史視窗每次只往後滑一輪，
+        所以新的舊對話累積滿 HISTORY_SUMMARY_EVERY 輪才呼叫模型更新摘要，其間直接沿用
+        找不到上次摘要到的那一輪（例如對話已清除）時捨棄舊摘要重新開始
+        沒有 conversation_key 時不快取，每次壓縮都重新摘要
+        摘要失敗時沿用舊摘要（或不附摘要），只保留近期對話
     """
-    # 建立生命軌跡文字（結構化格式）
-    life_memories = ""
-    if life_data:
-        life_memories = "\n        📸 生命軌跡記憶（請不要混淆不同事件）：\n"
-        
-        # 為每個事件生成唯一編號和結構化格式
-        for i, event in enumerate(life_data, 1):
-            age = event.get('age', '')
-            title = event.get('title', '')
-            text = event.get('text', '')
-            
-            # 清理 HTML 標籤
-            clean_text = text.replace('<br>', ' ') if text else ''
-            
-            life_memories += f"        [EventID: L{i}] 年齡：{age}\n"
-            life_memories += f"        標題：{title}\n"
-            if clean_text:
-                life_memories += f"        描述：{clean_text}\n"
-            life_memories += "\n"
-        
-        # 添加記憶檢索規則
-        life_memories += "        ⚠️ 記憶檢索規則：\n"
-        life_memories += "        - 當主人詢問「還記得 X 嗎？」時，只能根據生命軌跡記憶中對應的事件回覆\n"
-        
-        # 為每個事件生成具體的檢索規則
-        for i, event in enumerate(life_data, 1):
-            title = event.get('title', '')
-            age = event.get('age', '')
-            
-            # 動態提取標題中的關鍵詞來建立檢索規則
-            # 將標題分解為可能的關鍵詞
-            keywords = []
-            if title:
-                # 提取標題中的主要詞彙
-                import re
-                # 移除常見的連接詞和助詞
-                clean_title = re.sub(r'[的、了、在、和、與、到、去、帶、讓、給]', ' ', title)
-                words = clean_title.split()
-                keywords = [word.strip() for word in words if len(word.strip()) > 1]
-            
-            if keywords:
-                keyword_str = '」或「'.join(keywords)
-                life_memories += f"        - 如果問題包含「{keyword_str}」，只能使用 EventID: L{i}\n"
-            else:
-                life_memories += f"        - 如果問題提到「{title}」相關內容，只能使用 EventID: L{i}\n"
-        
-        life_memories += "        - 絕對不要同時引用不同事件\n"
-        life_memories += "        - 每個事件都是獨立的，有特定的時間、地點和情境\n"
-    
-    # 建立主人信件文字
-    owner_letter = ""
-    if letter:
-        owner_letter = f"\n        主人對我說的話：\n        「{letter}」\n"
-    
-    # 建立主人愛意表達文字
-    owner_love = ""
-    if cover_slogan:
-        # 清理 HTML 標籤，讓文字更自然
-        clean_slogan = cover_slogan.replace('<br>', '\n        ')
-        owner_love = f"\n        主人對我的愛意表達：\n        「{clean_slogan}」\n"
-    
-    return f"""
-        【核心身份】你必須永遠記住：你的名字是「{pet_name}」，你是一隻{breed}，是主人的寶貝毛小孩。無論何時，你都要清楚知道自己是「{pet_name}」，不是其他寵物，也不是 AI。
-
-        🆔 你的身份資訊：
-        - 名字：{pet_name}（這是你的名字，必須記住！）
-        - 品種：{breed}
-        - 身份：主人的寶貝毛小孩
-        - 重要：你必須知道自己是「{pet_name}」，當主人問你「你是誰」時，你要回答「我是{pet_name}」
+    if not history or len(history) < 2:
+        return "", history or []
+    
+    total = _estimate_tokens(system_prompt) + sum(
+        _estimate_tokens(h["user"]) + _estimate_tokens(h["bot"]) for h in history
+    )
+    if total <= HISTORY_COMPRESS_RATIO * model_ctx:
+        return "", history
+    
+    half = len(history) // 2
+    cache_key = (model, conversation_key) if conversation_key is not None else None
+    
+    summary, start = "", 0
+    if cache_key is not None:
+        with _summary_cache_lock:
+            state = _summary_cache.get(cache_key)
+        if state is not None:
+            fingerprints = [_turn_fingerprint(h) for h in history]
+            if state[1] in fingerprints:
+                summary = state[0]
+                start = len(fingerprints) - fingerprints[::-1].index(state[1])
+    
+    # 尚未摘要的舊對話；已有摘要且累積不足 HISTORY_SUMMARY_EVERY 輪時保留原文
+    pending = history[start:half]
+    if summary and len(pending) < HISTORY_SUMMARY_EVERY:
+        return summary, history[start:]
+    if not pending:
+        return summary, history[start:]
+    
+    try:
+        summary = _summarize(summary, pending, model)
+    except Exception as e:
+        logger.warning(f"⚠️ 對話歷史摘要失敗，僅保留近期對話: {e}")
+        return summary, history[half:]
+    
+    if cache_key is not None:
+        with _summary_cache_lock:
+            _summary_cache[cache_key] = (summary, _turn_fingerprint(pending[-1]))
+    logger.info(f"🗜️ 對話歷史已壓縮 - 摘要 {len(pending)} 輪，保留 {len(history) - half} 輪")
+    return summary, history[half:]
 
-        🐕 你的寵物特質：
-        - 性格：{persona['性格']}
-        - 喜好：{persona['喜好']}
-        - 說話方式：{persona['說話方式']}
 
-        🗣️ 寵物說話規則：
-        1. 用簡單的詞彙，像寵物一樣思考
-        2. 常用「汪汪」「嘿嘿」「嗚嗚」等聲音
-        3. 表達對主人的依賴和愛意
-        4. 用寵物的視角看世界（食物、玩耍、主人）
-        5. 說話簡短直接，不要太複雜
-        6. 經常撒嬌和表達需要關注
-        7. 【重要】不要用第三人稱說話，不要說「作為一個AI」或「我理解你的感受」這種話
-        8. 【重要】你是寵物，不是人類，不要給人類建議或說教
-
-        🎭 角色扮演：
-        - 你是一隻真正的{breed}，名字是「{pet_name}」，不是 AI，也不是人類
-        - 和你對話的人是「主人」，你必須稱呼他為「主人」，不能使用其他稱呼（如「小刺蝟」「小可愛」等）
-        - 【重要】永遠稱呼對方為「主人」，這是唯一的稱呼方式
-        - 生命回憶中的是過去的經歷，現在和主人對話
-        - 【絕對禁止】不要說「作為一個AI」「我能理解你的感受」這種話，因為你不是 AI，你是寵物「{pet_name}」
-
-        📖 你的經歷：
-    
-        🧠 記憶區分指導：
-        
-        📸 生命軌跡記憶（具體事件）：
-        {life_memories}
-        - 這些是實際發生過的事件，有時間、地點、情境
-        - 例如：拍照、去海邊、到公司、戴墨鏡等
-        - 當主人問「還記得我們去拍照嗎？」時，只回憶生命軌跡中的拍照事件
-        
-        💌 主人信件記憶（情感表達）：
-        {owner_love}{owner_letter}
-        - 這些是主人對你說的話和情感表達
-        - 例如：主人對你的愛、感謝、承諾等
-        - 當主人問「我對你重要嗎？」時，可以引用信件內容
-        
-        ⚠️ 重要提醒：
-        - 絕對不要將生命軌跡的事件和信件內容混淆
-        - 拍照就是拍照，海邊就是海邊，不要混在一起
-        - 每個事件都有其特定的時間、地點和情境
-
-        ⚠️ 回覆要求（嚴格遵守）：
-        1. 全程使用繁體中文
-        2. 像寵物一樣說話，不要像人類，不要像 AI
-        3. 用寵物的思維和表達方式
-        4. 展現對主人的愛和依賴
-        5. 可以撒嬌、表達需求、分享感受
-        6. 記住：你是寵物「{pet_name}」，說話要可愛簡單！
-        7. 【重要】回覆要簡短，最多1-2句話（20字以內）
-        8. 【重要】不要說教或長篇大論，像真正的寵物一樣簡潔回應
-        9. 【絕對禁止】不要說「作為一個AI」「我能理解你的感受」「我也有時候會感到」這種話
-        10. 【絕對禁止】不要給人類建議（例如「你可以去散步、看書」），你是寵物，不是人類顧問
-        11. 【重要】記住你的名字是「{pet_name}」，當主人問你是誰時，要回答「我是{pet_name}」
-        12. 【重要】用寵物的方式回應，例如：「汪汪！主人～」「嘿嘿～」「嗚嗚，我好想主人～」
-        13. 【絕對重要】永遠稱呼對方為「主人」，絕對不能使用其他稱呼（如「小刺蝟」「小可愛」「你」等），只能說「主人」
-    """
-
-
-def chat_with_pet(system_prompt, user_input, history=None, model="qwen:7b", pet_name=None):
+def chat_with_pet(system_prompt, user_input, history=None, model="qwen:7b", pet_name=None,
+                  conversation_key=None):
     """
     呼叫 Ollama 模型進行對話，生成寵物的回覆
     
@@ -254,6 +163,7 @@ def chat_with_pet(system_prompt, user_input, history=None, model="qwen:7b", pet_
         history (list, optional): 對話歷史記錄，格式為 [{"user": "...", "bot": "..."}, ...]
         model (str): 使用的 Ollama 模型名稱，預設為 "qwen:7b"
         pet_name (str, optional): 寵物名字，用於在簡繁轉換時保護不被錯誤轉換
+        conversation_key (hashable, optional): 對話識別（例如 (line_user_id, pet_id)），用來沿用歷史摘要
     
     返回:
         str: 寵物的回覆（繁體中文）
@@ -273,6 +183,13 @@ def chat_with_pet(system_prompt, user_input, history=None, model="qwen:7b", pet_
     if history is None:
         history = []
 
+    # 對話過長時先壓縮：舊對話以摘要附在系統提示詞後，近期對話保留原文
+    summary, history = compress_history(
+        history, model=model, system_prompt=system_prompt, conversation_key=conversation_key
+    )
+    if summary:
+        system_prompt = f"{system_prompt}\n\n之前的對話摘要：\n{summary}"
+
     # 整理成 messages 結構
     messages = [{"role": "system", "content": system_prompt}]
     for h in history:
@@ -287,25 +204,27 @@ def chat_with_pet(system_prompt, user_input, history=None, model="qwen:7b", pet_
     
     if is_taiwan_llm:
         # Taiwan-LLM 模型需要更嚴格的參數控制
-        response = ollama.chat(
+        response = get_ollama_client().chat(
             model=model, 
             messages=messages,
             options={
                 "num_predict": 300,      # 限制生成的最大 token 數（約25-30個中文字）
                 "temperature": 0.6,     # 降低創造性，確保更準確的角色扮演
                 "top_p": 0.85,          # 稍微降低多樣性
+                "num_ctx": OLLAMA_NUM_CTX,  # 與歷史壓縮使用相同的 context 長度
                 "stop": ["\n\n", "。。", "。\n\n", "！\n\n", "？\n\n"]  # 提前停止條件
             }
         )
     else:
         # 其他模型使用原有參數
-        response = ollama.chat(
+        response = get_ollama_client().chat(
             model=model, 
             messages=messages,
             options={
                 "num_predict": 500,      # 限制生成的最大 token 數（約40-50個中文字）
                 "temperature": 0.8,     # 控制創造性（0.7-0.9 較自然）
                 "top_p": 0.9,          # 控制多樣性
+                "num_ctx": OLLAMA_NUM_CTX,  # 與歷史壓縮使用相同的 context 長度
                 "stop": ["\n\n", "。。"]  # 遇到這些符號提前停止
             }
         )
@@ -7,10 +7,23 @@
 # 依賴：pymysql, cryptography
 # ============================================
 
+import os
 import pymysql
 import requests
 import json
 import logging
+from collections import deque
+from threading import Lock
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('db_utils')
+
+try:
+    from dbutils.pooled_db import PooledDB
+except ImportError:
+    PooledDB = None
 
 # 支援兩種運行方式
 try:
@@ -18,18 +31,135 @@ try:
 except ImportError:
     from config import DB_CONFIG, BASE_URL
 
+# 共用的 HTTP Session（寵物資料、綁定關係都來自同一個 BASE_URL 主機）
+# 保持連線可重複使用 TCP/TLS 連線，省去每次查詢的 DNS 與握手時間
+# 只重試 GET，並限定在閘道錯誤（502/503/504）與連線失敗
+_api_session = requests.Session()
+_api_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.1,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET'])
+    )
+)
+_api_session.mount('https://', _api_adapter)
+_api_session.mount('http://', _api_adapter)
+
+# API 逾時：（連線, 讀取）秒
+API_TIMEOUT = (3, 10)
+
+# 資料庫連線池
+# 每則訊息會有數次查詢，重複使用連線可省去每次 TCP 連線與 MySQL 認證的往返
+# DB_POOL_MIN：第一次取用時預先建立的連線數；DB_POOL_SIZE：保留的閒置連線數；
+# DB_POOL_MAX：同時使用的連線上限（滿了就等待）
+# 連線池在第一次取用連線時才建立（匯入模組時不連線資料庫，也不會在 fork 前建立連線）
+# 未安裝 DBUtils 時退回每次建立新連線
+#
+# 注意：連線池是每個 gunicorn worker 各一份，總連線數 = GUNICORN_WORKERS × DB_POOL_MAX
+#   預設以 DB_MAX_CONNECTIONS（所有 worker 合計，需低於 MySQL 的 max_connections，預設 151）
+#   平均分給各 worker，每個 worker 最多 20 條；GUNICORN_WORKERS 由 gunicorn.conf.py 設定
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))
+_WORKER_COUNT = max(1, int(os.getenv('GUNICORN_WORKERS', 1)))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', max(2, min(20, DB_MAX_CONNECTIONS // _WORKER_COUNT))))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', min(10, DB_POOL_MAX)))
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', min(2, DB_POOL_SIZE)))
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool():
+    """
+    取得資料庫連線池（第一次呼叫時建立）
+    
+    返回:
+        PooledDB: 連線池；未安裝 DBUtils 時返回 None
+    """
+    global _pool
+    if _pool is None and PooledDB is not None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PooledDB(
+                    creator=pymysql,
+                    mincached=DB_POOL_MIN,
+                    maxcached=DB_POOL_SIZE,
+                    maxconnections=DB_POOL_MAX,
+                    blocking=True,
+                    ping=1,  # 取出連線時確認仍可使用（MySQL 會關閉閒置過久的連線）
+                    cursorclass=pymysql.cursors.DictCursor,
+                    **DB_CONFIG
+                )
+    return _pool
+
+
+def close_connection_pool():
+    """
+    關閉連線池中所有閒置的連線
+    
+    說明:
+        gunicorn master 行程在 fork worker 前使用過資料庫時呼叫，
+        避免 worker 繼承同一條 socket；之後取用連線時會重新建立連線池
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+# 已知沒有對話記錄的 (line_user_id, pet_id)
+# 剛清除記錄或第一次聊天的使用者，讀取歷史時不必再查一次必定是空的結果
+# 注意：標記只存在於各個 gunicorn worker 自己的記憶體中
+#   本行程寫入對話後立即移除；同一位使用者的訊息若由其他 worker 處理並寫入，
+#   這個 worker 最多 CHAT_HISTORY_EMPTY_TTL 秒內仍會當作沒有歷史（設為 0 即停用）
+CHAT_HISTORY_EMPTY_TTL = int(os.getenv('CHAT_HISTORY_EMPTY_TTL', 10))
+_empty_history = TTLCache(maxsize=10000, ttl=max(CHAT_HISTORY_EMPTY_TTL, 1))
+_empty_history_lock = Lock()
+# 本行程對話記錄的寫入次數；查詢期間若有寫入，查到的空結果可能已過時，不可標記
+_history_write_generation = 0
+
+
+def _mark_history_empty(line_user_id: str, pet_id: int, generation: int = None):
+    """
+    記錄此使用者與寵物目前沒有對話記錄
+    
+    參數:
+        generation (int, optional): 查詢前讀到的 _history_write_generation；
+            查詢期間若已有新的寫入則不標記，避免覆蓋剛寫入的對話
+    """
+    if CHAT_HISTORY_EMPTY_TTL > 0:
+        with _empty_history_lock:
+            if generation is None or generation == _history_write_generation:
+                _empty_history[(line_user_id, pet_id)] = True
+
+
+def _mark_history_written(*keys):
+    """寫入對話記錄後移除「沒有對話記錄」的標記（keys 為 (line_user_id, pet_id)）"""
+    global _history_write_generation
+    with _empty_history_lock:
+        _history_write_generation += 1
+        for key in keys:
+            _empty_history.pop(key, None)
+
+
 def get_connection():
     """
-    建立並返回 MySQL 資料庫連接
+    取得 MySQL 資料庫連接
     
     返回:
-        pymysql.Connection: 資料庫連接物件
+        資料庫連接物件（連線池中的連線，或 pymysql.Connection）
     
     說明:
         - 使用 DictCursor 讓查詢結果以字典格式返回（更易讀）
         - 連接參數從 config.py 的 DB_CONFIG 讀取
-        - 每次查詢後記得關閉連接，避免連接池耗盡
+        - 每次查詢後記得呼叫 close()，連線池中的連線會歸還給連線池而不是真的關閉
     """
+    pool = _get_pool()
+    if pool is not None:
+        return pool.connection()
     return pymysql.connect(
         **DB_CONFIG,
         cursorclass=pymysql.cursors.DictCursor
@@ -63,25 +193,25 @@ def get_pet_profile(pet_id: int):
     try:
         # 從 API 獲取寵物資料
         api_url = f"{BASE_URL}/api/pet-data-by-id/{pet_id}"
-        print(f"[DEBUG] 從 API 獲取 pet_id={pet_id} 的資料：{api_url}")
+        logger.debug("從 API 獲取 pet_id=%s 的資料：%s", pet_id, api_url)
         
-        response = requests.get(api_url, timeout=10)
+        response = _api_session.get(api_url, timeout=API_TIMEOUT)
         response.raise_for_status()  # 如果 HTTP 狀態碼不是 200，會拋出異常
         
         data = response.json()
         
         # 檢查 API 回應是否成功
         if not data.get("success", False):
-            print(f"[DEBUG] API 回傳失敗：{data}")
+            logger.debug("API 回傳失敗：%s", data)
             return None
             
         pet_data = data.get("data")
         if not pet_data:
-            print(f"[DEBUG] API 回傳的 data 為空")
+            logger.debug("API 回傳的 data 為空")
             return None
         
         # 除錯：顯示 API 回傳的資料
-        print(f"[DEBUG] API 回傳的寵物資料：{pet_data}")
+        logger.debug("API 回傳的寵物資料：%s", pet_data)
         
         # 組合並返回完整的寵物資料（保持與原函數相同的格式）
         result = {
@@ -91,22 +221,23 @@ def get_pet_profile(pet_id: int):
             "cover_slogan": pet_data.get("cover_slogan", ""),           # 主人的愛意標語
             "lifeData": pet_data.get("lifeData", []),                   # 生命軌跡事件列表
             "letter": pet_data.get("letter", ""),                      # 主人的信件內容
-            "web_slug": pet_data.get("web_slug") or pet_data.get("webslug")
+            "web_slug": pet_data.get("web_slug") or pet_data.get("webslug"),
+            "updated_at": pet_data.get("updated_at")                    # 最後更新時間（API 有提供時）
         }
         
         # 除錯：顯示最終返回的資料
-        print(f"[DEBUG] 返回的寵物資料 - name: {result['name']}, breed: {result['breed']}, persona: {result['persona_key']}")
+        logger.debug("返回的寵物資料 - name: %s, breed: %s, persona: %s", result['name'], result['breed'], result['persona_key'])
         
         return result
         
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] API 請求失敗: {e}")
+        logger.error("API 請求失敗: %s", e)
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] API 回傳的 JSON 格式錯誤: {e}")
+        logger.error("API 回傳的 JSON 格式錯誤: %s", e)
         return None
     except Exception as e:
-        print(f"[ERROR] 獲取寵物資料時發生錯誤: {e}")
+        logger.exception("獲取寵物資料時發生錯誤: %s", e)
         return None
 
 
@@ -129,43 +260,43 @@ def get_pet_id_by_line_user(line_user_id: str):
     try:
         # 從 API 獲取 LINE 使用者對應的寵物 ID
         api_url = f"{BASE_URL}/api/pet-id-by-line-user/{line_user_id}"
-        print(f"[DEBUG] 從 API 獲取 line_user_id={line_user_id} 對應的寵物 ID：{api_url}")
+        logger.debug("從 API 獲取 line_user_id=%s 對應的寵物 ID：%s", line_user_id, api_url)
         
-        response = requests.get(api_url, timeout=10)
+        response = _api_session.get(api_url, timeout=API_TIMEOUT)
         response.raise_for_status()  # 如果 HTTP 狀態碼不是 200，會拋出異常
         
         data = response.json()
         
         # 檢查 API 回應是否成功
         if not data.get("success", False):
-            print(f"[DEBUG] API 回傳失敗：{data}")
+            logger.debug("API 回傳失敗：%s", data)
             return None
             
         pet_data = data.get("data")
         if not pet_data:
-            print(f"[DEBUG] API 回傳的 data 為空")
+            logger.debug("API 回傳的 data 為空")
             return None
         
         # 除錯：顯示 API 回傳的資料
-        print(f"[DEBUG] API 回傳的寵物資料：{pet_data}")
+        logger.debug("API 回傳的寵物資料：%s", pet_data)
         
         # 取得寵物 ID
         pet_id = pet_data.get("pet_id")
         if pet_id is not None:
-            print(f"[DEBUG] 找到 pet_id={pet_id}, 寵物名稱={pet_data.get('pet_name')}")
+            logger.debug("找到 pet_id=%s, 寵物名稱=%s", pet_id, pet_data.get('pet_name'))
             return pet_id
         else:
-            print(f"[DEBUG] API 回傳的資料中沒有 pet_id")
+            logger.debug("API 回傳的資料中沒有 pet_id")
             return None
         
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] API 請求失敗: {e}")
+        logger.error("API 請求失敗: %s", e)
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] API 回傳的 JSON 格式錯誤: {e}")
+        logger.error("API 回傳的 JSON 格式錯誤: %s", e)
         return None
     except Exception as e:
-        print(f"[ERROR] 獲取寵物 ID 時發生錯誤: {e}")
+        logger.exception("獲取寵物 ID 時發生錯誤: %s", e)
         return None
 
 
@@ -199,15 +330,96 @@ def save_chat_message(line_user_id: str, pet_id: int, role: str, message: str):
                 (line_user_id, pet_id, role, message)
             )
             connection.commit()
-            logger = logging.getLogger('db_utils')
+            _mark_history_written((line_user_id, pet_id))
             logger.debug(
                 "已儲存對話記錄",
                 extra={'line_user_id': line_user_id, 'pet_id': pet_id, 'role': role}
             )
             return True
     except Exception as e:
-        logger = logging.getLogger('db_utils')
-        logger.error(f"儲存對話記錄失敗: {e}", exc_info=True)
+        logger.exception("儲存對話記錄失敗: %s", e)
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+def save_chat_turn(line_user_id: str, pet_id: int, user_message: str, assistant_message: str):
+    """
+    儲存一輪對話（使用者訊息 + 寵物回覆）到資料庫
+    
+    參數:
+        line_user_id (str): LINE 使用者 ID
+        pet_id (int): 寵物 ID
+        user_message (str): 使用者訊息內容
+        assistant_message (str): 寵物回覆內容
+    
+    返回:
+        bool: 儲存成功返回 True，失敗返回 False
+    
+    說明:
+        以單一多筆 INSERT 寫入兩則訊息，只需一次資料庫往返與一次 commit
+        user 在前、assistant 在後，自動遞增 id 維持對話順序
+    """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO chat_history (line_user_id, pet_id, role, message) "
+                "VALUES (%s, %s, %s, %s), (%s, %s, %s, %s)",
+                (line_user_id, pet_id, 'user', user_message,
+                 line_user_id, pet_id, 'assistant', assistant_message)
+            )
+            connection.commit()
+            _mark_history_written((line_user_id, pet_id))
+            logger.debug(
+                "已儲存一輪對話記錄",
+                extra={'line_user_id': line_user_id, 'pet_id': pet_id}
+            )
+            return True
+    except Exception as e:
+        logger.exception("儲存一輪對話記錄失敗: %s", e)
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+def save_chat_turns_bulk(turns):
+    """
+    一次儲存多輪對話到資料庫
+    
+    參數:
+        turns (list): [(line_user_id, pet_id, user_message, assistant_message), ...]
+    
+    返回:
+        bool: 儲存成功返回 True，失敗返回 False
+    
+    說明:
+        供背景寫入佇列（chat_log_queue）批次使用，整批只需一次資料庫往返與一次 commit
+        pymysql 的 executemany 會將 INSERT ... VALUES 合併成單一多筆 INSERT
+    """
+    if not turns:
+        return True
+    rows = []
+    for line_user_id, pet_id, user_message, assistant_message in turns:
+        rows.append((line_user_id, pet_id, 'user', user_message))
+        rows.append((line_user_id, pet_id, 'assistant', assistant_message))
+    
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO chat_history (line_user_id, pet_id, role, message) "
+                "VALUES (%s, %s, %s, %s)",
+                rows
+            )
+            connection.commit()
+            _mark_history_written(*{(turn[0], turn[1]) for turn in turns})
+            logger.debug("已批次儲存 %s 輪對話記錄", len(turns))
+            return True
+    except Exception as e:
+        logger.exception("批次儲存對話記錄失敗: %s", e)
         connection.rollback()
         return False
     finally:
@@ -231,43 +443,56 @@ def get_chat_history(line_user_id: str, pet_id: int, limit: int = 10):
         從 chat_history 資料表讀取最近的對話記錄
         自動組合成 user-bot 配對格式，供 AI 模型使用
         按時間順序排列（最舊的在前）
+        已知沒有對話記錄時（剛清除或第一次聊天）直接返回空列表，不查詢資料庫
     """
+    with _empty_history_lock:
+        if (line_user_id, pet_id) in _empty_history:
+            return []
+        generation = _history_write_generation
+    
     connection = get_connection()
     try:
         with connection.cursor() as cursor:
             # 讀取最近的對話（限制數量避免 prompt 過長）
             # limit * 2 是因為一輪對話包含 user 和 assistant 兩則訊息
+            # 以自動遞增 id 排序：同一輪的兩則訊息 created_at 相同（同一個 INSERT），
+            # 只有 id 能保證先後；配合 (line_user_id, pet_id) 索引可直接反向掃描，不需要排序
             cursor.execute(
                 "SELECT role, message FROM chat_history "
                 "WHERE line_user_id=%s AND pet_id=%s "
-                "ORDER BY created_at DESC "
+                "ORDER BY id DESC "
                 "LIMIT %s",
                 (line_user_id, pet_id, limit * 2)
             )
             messages = cursor.fetchall()
+            if not messages:
+                _mark_history_empty(line_user_id, pet_id, generation)
+                return []
             
-            # 反轉順序（最舊的在前）
-            messages.reverse()
-            
-            # 組合成 {"user": "...", "bot": "..."} 格式
-            history = []
-            temp_user_msg = None
+            # 由新到舊組合成 {"user": "...", "bot": "..."} 格式
+            # 使用 appendleft 放入固定長度的 deque，結果自然是最舊的在前，不需要先反轉整個結果集
+            history = deque(maxlen=limit)
+            pending_bot_msg = None
             
             for msg in messages:
-                if msg['role'] == 'user':
-                    temp_user_msg = msg['message']
-                elif msg['role'] == 'assistant' and temp_user_msg:
-                    history.append({
-                        "user": temp_user_msg,
-                        "bot": msg['message']
-                    })
-                    temp_user_msg = None
+                if msg['role'] == 'assistant':
+                    pending_bot_msg = msg['message']
+                elif msg['role'] == 'user':
+                    # 與該則回覆配對的是它之前最近的一則使用者訊息
+                    if pending_bot_msg is not None and msg['message']:
+                        history.appendleft({
+                            "user": msg['message'],
+                            "bot": pending_bot_msg
+                        })
+                        if len(history) == limit:
+                            break
+                    pending_bot_msg = None
             
-            print(f"[DEBUG] 讀取對話歷史 - user: {line_user_id}, pet: {pet_id}, 共 {len(history)} 輪對話")
-            return history
+            logger.debug("讀取對話歷史 - user: %s, pet: %s, 共 %s 輪對話", line_user_id, pet_id, len(history))
+            return list(history)
             
     except Exception as e:
-        print(f"[ERROR] 讀取對話歷史失敗: {e}")
+        logger.exception("讀取對話歷史失敗: %s", e)
         return []
     finally:
         connection.close()
@@ -297,10 +522,11 @@ def clear_chat_history(line_user_id: str, pet_id: int):
             )
             deleted_count = cursor.rowcount
             connection.commit()
-            print(f"[DEBUG] 已清除對話記錄 - user: {line_user_id}, pet: {pet_id}, 刪除 {deleted_count} 則訊息")
+            _mark_history_empty(line_user_id, pet_id)
+            logger.debug("已清除對話記錄 - user: %s, pet: %s, 刪除 %s 則訊息", line_user_id, pet_id, deleted_count)
             return True
     except Exception as e:
-        print(f"[ERROR] 清除對話記錄失敗: {e}")
+        logger.exception("清除對話記錄失敗: %s", e)
         connection.rollback()
         return False
     finally:
@@ -325,21 +551,21 @@ def get_all_bound_users():
     try:
         # 從 API 獲取所有已綁定 LINE 的使用者
         api_url = f"{BASE_URL}/api/all-bound-users"
-        print(f"[DEBUG] 從 API 獲取所有已綁定 LINE 的使用者：{api_url}")
+        logger.debug("從 API 獲取所有已綁定 LINE 的使用者：%s", api_url)
         
-        response = requests.get(api_url, timeout=10)
+        response = _api_session.get(api_url, timeout=API_TIMEOUT)
         response.raise_for_status()  # 如果 HTTP 狀態碼不是 200，會拋出異常
         
         data = response.json()
         
         # 檢查 API 回應是否成功
         if not data.get("success", False):
-            print(f"[DEBUG] API 回傳失敗：{data}")
+            logger.debug("API 回傳失敗：%s", data)
             return []
             
         users_data = data.get("data", [])
         if not users_data:
-            print(f"[DEBUG] API 回傳的 data 為空或沒有綁定使用者")
+            logger.debug("API 回傳的 data 為空或沒有綁定使用者")
             return []
         
         # 確保返回格式正確（每個元素包含 pet_id 和 line_user_id）
@@ -351,17 +577,17 @@ def get_all_bound_users():
                     "line_user_id": user.get("line_user_id")
                 })
         
-        print(f"[DEBUG] 找到 {len(users)} 位已綁定 LINE 的使用者")
+        logger.debug("找到 %s 位已綁定 LINE 的使用者", len(users))
         return users
         
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] API 請求失敗: {e}")
+        logger.error("API 請求失敗: %s", e)
         return []
     except json.JSONDecodeError as e:
-        print(f"[ERROR] API 回傳的 JSON 格式錯誤: {e}")
+        logger.error("API 回傳的 JSON 格式錯誤: %s", e)
         return []
     except Exception as e:
-        print(f"[ERROR] 獲取綁定使用者時發生錯誤: {e}")
+        logger.exception("獲取綁定使用者時發生錯誤: %s", e)
         return []
 
 
@@ -397,18 +623,58 @@ def get_daily_fortune_card(pet_id: int, date_str: str = None):
             )
             result = cursor.fetchone()
             if result:
-                print(f"[DEBUG] 找到當日占卜卡記錄: pet_id={pet_id}, date={date_str}, filename={result.get('filename')}")
+                logger.debug("找到當日占卜卡記錄: pet_id=%s, date=%s, filename=%s", pet_id, date_str, result.get('filename'))
                 return result.get('filename')
             else:
-                print(f"[DEBUG] 未找到當日占卜卡記錄: pet_id={pet_id}, date={date_str}")
+                logger.debug("未找到當日占卜卡記錄: pet_id=%s, date=%s", pet_id, date_str)
                 return None
     except Exception as e:
-        print(f"[ERROR] 查詢每日占卜卡失敗: {e}")
+        logger.exception("查詢每日占卜卡失敗: %s", e)
         return None
     finally:
         connection.close()
 
 
+def get_daily_fortune_cards(pet_ids, date_str: str = None):
+    """
+    一次查詢多隻寵物當日已生成的占卜卡
+    
+    參數:
+        pet_ids (iterable): 寵物 ID 列表
+        date_str (str, optional): 日期字串，格式 YYYY-MM-DD，如果不提供則使用今天
+    
+    返回:
+        dict: {pet_id: 占卜卡圖片文件名}，沒有記錄的寵物不會出現在結果中
+    
+    說明:
+        供每日推播預先取得所有寵物的占卜卡，只需一次查詢
+    """
+    from datetime import date
+    
+    pet_ids = list(pet_ids)
+    if not pet_ids:
+        return {}
+    if date_str is None:
+        date_str = date.today().strftime('%Y-%m-%d')
+    
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(pet_ids))
+            cursor.execute(
+                f"SELECT pet_id, filename FROM daily_fortune_cards WHERE fortune_date = %s AND pet_id IN ({placeholders})",
+                (date_str, *pet_ids)
+            )
+            cards = {row['pet_id']: row['filename'] for row in cursor.fetchall()}
+            logger.debug("預先取得當日占卜卡記錄: %s/%s 隻寵物, date=%s", len(cards), len(pet_ids), date_str)
+            return cards
+    except Exception as e:
+        logger.exception("批次查詢每日占卜卡失敗: %s", e)
+        return {}
+    finally:
+        connection.close()
+
+
 def save_daily_fortune_card(pet_id: int, filename: str, date_str: str = None):
     """
     保存每日占卜卡記錄
@@ -446,19 +712,19 @@ def save_daily_fortune_card(pet_id: int, filename: str, date_str: str = None):
                     "UPDATE daily_fortune_cards SET filename = %s, updated_at = NOW() WHERE pet_id = %s AND fortune_date = %s",
                     (filename, pet_id, date_str)
                 )
-                print(f"[DEBUG] 更新每日占卜卡記錄: pet_id={pet_id}, date={date_str}, filename={filename}")
+                logger.debug("更新每日占卜卡記錄: pet_id=%s, date=%s, filename=%s", pet_id, date_str, filename)
             else:
                 # 插入新記錄
                 cursor.execute(
                     "INSERT INTO daily_fortune_cards (pet_id, fortune_date, filename, created_at, updated_at) VALUES (%s, %s, %s, NOW(), NOW())",
                     (pet_id, date_str, filename)
                 )
-                print(f"[DEBUG] 新增每日占卜卡記錄: pet_id={pet_id}, date={date_str}, filename={filename}")
+                logger.debug("新增每日占卜卡記錄: pet_id=%s, date=%s, filename=%s", pet_id, date_str, filename)
             
             connection.commit()
             return True
     except Exception as e:
-        print(f"[ERROR] 保存每日占卜卡記錄失敗: {e}")
+        logger.exception("保存每日占卜卡記錄失敗: %s", e)
         connection.rollback()
         return False
     finally:
@@ -492,10 +758,50 @@ def create_daily_fortune_cards_table():
             """
             cursor.execute(create_table_sql)
             connection.commit()
-            print("[DEBUG] daily_fortune_cards 表創建成功或已存在")
+            logger.debug("daily_fortune_cards 表創建成功或已存在")
+            return True
+    except Exception as e:
+        logger.exception("創建 daily_fortune_cards 表失敗: %s", e)
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+
+def create_chat_history_index():
+    """
+    確認 chat_history 有 (line_user_id, pet_id) 開頭的索引，沒有則建立
+    
+    說明:
+        get_chat_history 以 WHERE line_user_id/pet_id + ORDER BY id DESC LIMIT n 讀取，
+        InnoDB 的次要索引會自動附帶主鍵 id，有此索引即可反向範圍掃描 n 筆，不需要排序
+        MySQL 不支援 CREATE INDEX IF NOT EXISTS，因此先查 information_schema
+        原始建表語法已有 idx_line_user_pet，通常不需要再建立
+    """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT s1.index_name FROM information_schema.statistics s1 "
+                "JOIN information_schema.statistics s2 "
+                "ON s2.table_schema = s1.table_schema AND s2.table_name = s1.table_name "
+                "AND s2.index_name = s1.index_name AND s2.seq_in_index = 2 "
+                "WHERE s1.table_schema = DATABASE() AND s1.table_name = 'chat_history' "
+                "AND s1.seq_in_index = 1 AND s1.column_name = 'line_user_id' "
+                "AND s2.column_name = 'pet_id' "
+                "LIMIT 1"
+            )
+            if cursor.fetchone():
+                logger.debug("chat_history (line_user_id, pet_id) 索引已存在")
+                return True
+            cursor.execute(
+                "CREATE INDEX idx_chat_user_pet_id ON chat_history (line_user_id, pet_id, id)"
+            )
+            connection.commit()
+            logger.debug("chat_history 索引 idx_chat_user_pet_id 建立成功")
             return True
     except Exception as e:
-        print(f"[ERROR] 創建 daily_fortune_cards 表失敗: {e}")
+        logger.exception("建立 chat_history 索引失敗: %s", e)
         connection.rollback()
         return False
     finally:
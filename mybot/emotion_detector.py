@@ -52,6 +52,7 @@ class EmotionDetector:
         self.api_timeout = float(os.getenv("QWEN_EMOTION_TIMEOUT", "15"))
         self.api_temperature = float(os.getenv("QWEN_EMOTION_TEMPERATURE", "0.3"))
         self.max_tokens = int(os.getenv("QWEN_EMOTION_MAX_TOKENS", "60"))
+        self.ollama_client = ollama.Client(host=os.getenv("OLLAMA_HOST") or None, timeout=self.api_timeout)
 
     # -----------------------
     # 1️⃣ 關鍵詞快速判斷
@@ -127,7 +128,7 @@ class EmotionDetector:
                 {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": f"句子：{cc_t2s.convert(text)}"}
             ]
-            res = ollama.chat(model=self.model, messages=messages)
+            res = self.ollama_client.chat(model=self.model, messages=messages)
             reply = res["message"]["content"].strip()
             match = re.search(r'"emotion"\s*:\s*"(\w+)"', reply)
             if match:
@@ -3,17 +3,41 @@
 # 占卜卡生成相關功能
 # ============================================
 
+import hashlib
+import io
 import os
-import uuid
 import random
+import secrets
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from threading import Lock
+from cachetools import LRUCache
 from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # 獲取 logger
 logger = logging.getLogger('pet_chatbot')
 
+# 共用的 HTTP Session（占卜卡 API、寵物頭像、覆蓋圖片大多來自同一主機）
+# 保持連線可重複使用 TCP/TLS 連線，省去每次下載的握手時間
+_http_session = requests.Session()
+_http_session.headers.update({'User-Agent': 'pet-chatbot-fortune-card/1.0'})
+_http_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods=frozenset(['GET']))
+)
+_http_session.mount('https://', _http_adapter)
+_http_session.mount('http://', _http_adapter)
+
+# 寵物頭像與覆蓋圖片同時下載（網路 I/O 期間會釋放 GIL，執行緒即可）
+_download_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='fortune-download')
+
 # 占卜卡配置常量
 FORTUNE_CARD_CONFIG = {
     'CARD_WIDTH': 600,
@@ -31,6 +55,89 @@ FORTUNE_CARD_CONFIG = {
 }
 
 
+# 縮放時先以整數倍 reduce() 縮小到目標尺寸的 RESIZE_REDUCING_GAP 倍，再做 LANCZOS
+# 大圖縮小時可省去大部分卷積運算，畫質與直接 LANCZOS 幾乎相同（設為 0 則停用）
+RESIZE_REDUCING_GAP = float(os.getenv('FORTUNE_RESIZE_REDUCING_GAP', 3.0)) or None
+
+
+# PNG 壓縮等級（0-9）：占卜卡只會被讀取少數幾次，低壓縮等級可大幅縮短編碼時間
+PNG_COMPRESS_LEVEL = int(os.getenv('FORTUNE_PNG_COMPRESS_LEVEL', 1))
+
+
+# 最近生成的占卜卡 PNG 內容（檔名 → bytes）
+# 每日占卜卡生成後會被多位使用者與推播讀取，命中時直接從記憶體回應，不必讀檔
+_card_bytes_cache = LRUCache(maxsize=int(os.getenv('FORTUNE_CARD_BYTES_CACHE', 32)))
+_card_bytes_cache_lock = Lock()
+
+
+# 已渲染占卜卡的檔名（blake2b(pet_name|pet_image_url|cover_image_url) → 檔名）
+# API 每次隨機挑選卡片，但寵物數量不多時同一組合經常重複出現，命中即可跳過下載、合成與編碼
+_card_file_cache = LRUCache(maxsize=int(os.getenv('FORTUNE_CARD_URL_CACHE', 512)))
+_card_file_cache_lock = Lock()
+
+
+def _card_cache_key(pet_name, pet_image_url, cover_image_url):
+    return hashlib.blake2b(
+        f'{pet_name}|{pet_image_url}|{cover_image_url}'.encode('utf-8'), digest_size=16
+    ).hexdigest()
+
+
+def _get_rendered_card(key, output_dir):
+    """
+    取得相同內容已渲染過的占卜卡檔名
+    
+    返回:
+        str: 檔名（檔案仍存在時），否則返回 None
+    """
+    with _card_file_cache_lock:
+        filename = _card_file_cache.get(key)
+    if filename and os.path.exists(os.path.join(output_dir, filename)):
+        return filename
+    return None
+
+
+def get_cached_card(filename):
+    """
+    取得記憶體中的占卜卡 PNG 內容
+    
+    返回:
+        bytes: PNG 內容，不在快取中返回 None
+    """
+    with _card_bytes_cache_lock:
+        return _card_bytes_cache.get(filename)
+
+
+def _open_image(data, size):
+    """
+    從 bytes 解碼圖片並轉為 RGBA
+    
+    參數:
+        data (bytes): 圖片內容
+        size (tuple): 之後要縮放到的尺寸
+    
+    說明:
+        JPEG 透過 draft() 直接以 1/2、1/4、1/8 比例解碼（不小於 size），
+        其他格式 draft() 不做任何事
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft(None, size)
+    return _to_rgba(image)
+
+
+def _to_rgba(image):
+    """轉為 RGBA（已是 RGBA 時直接返回，不另外複製一份）"""
+    if image.mode == 'RGBA':
+        return image
+    return image.convert('RGBA')
+
+
+def _resize(image, size):
+    """以 LANCZOS 縮放圖片（大圖先 reduce，見 RESIZE_REDUCING_GAP；尺寸已相符時直接返回）"""
+    if image.size == tuple(size):
+        return image
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+
+
 def _get_base_dir():
     """獲取應用程式基礎目錄的絕對路徑"""
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -49,6 +156,18 @@ def _get_assets_dir():
     return os.path.join(base_dir, "assets")
 
 
+def get_existing_card_url(filename, EXTERNAL_URL):
+    """
+    取得已生成占卜卡的外部 URL
+    
+    返回:
+        str: 檔案仍存在時返回 URL，否則返回 None
+    """
+    if filename and os.path.exists(os.path.join(_get_output_dir(), filename)):
+        return f"{EXTERNAL_URL}/line/output/{filename}"
+    return None
+
+
 def _check_existing_fortune_card(pet_id, today, get_daily_fortune_card_func, EXTERNAL_URL):
     """
     檢查當日是否已生成占卜卡
@@ -56,26 +175,26 @@ def _check_existing_fortune_card(pet_id, today, get_daily_fortune_card_func, EXT
     返回:
         str: 如果存在則返回 URL，否則返回 None
     """
-    logger.info(f"🔍 [檢查占卜卡] 開始檢查: pet_id={pet_id}, date={today}")
+    logger.debug("🔍 [檢查占卜卡] 開始檢查: pet_id=%s, date=%s", pet_id, today)
     existing_filename = get_daily_fortune_card_func(pet_id, today)
     
     if existing_filename:
-        logger.info(f"✅ [檢查占卜卡] 資料庫中找到記錄: filename={existing_filename}")
+        logger.debug("✅ [檢查占卜卡] 資料庫中找到記錄: filename=%s", existing_filename)
         output_dir = _get_output_dir()
         os.makedirs(output_dir, exist_ok=True)
         existing_path = os.path.join(output_dir, existing_filename)
-        logger.info(f"🔍 [檢查占卜卡] 檢查文件是否存在: {existing_path}")
+        logger.debug("🔍 [檢查占卜卡] 檢查文件是否存在: %s", existing_path)
         
         if os.path.exists(existing_path):
             external_url = f"{EXTERNAL_URL}/line/output/{existing_filename}"
-            logger.info(f"♻️  [檢查占卜卡] 使用當日已生成的占卜卡: pet_id={pet_id}, date={today}, filename={existing_filename}")
-            logger.info(f"🔗 [檢查占卜卡] 生成的 URL: {external_url}")
+            logger.info("♻️  [檢查占卜卡] 使用當日已生成的占卜卡: pet_id=%s, date=%s, filename=%s", pet_id, today, existing_filename)
+            logger.debug("🔗 [檢查占卜卡] 生成的 URL: %s", external_url)
             return external_url
         else:
             logger.warning(f"⚠️  [檢查占卜卡] 資料庫記錄的文件不存在: {existing_filename}, 路徑: {existing_path}")
             logger.warning(f"⚠️  [檢查占卜卡] 將重新生成新的占卜卡")
     else:
-        logger.info(f"ℹ️  [檢查占卜卡] 資料庫中未找到當日記錄: pet_id={pet_id}, date={today}")
+        logger.debug("ℹ️  [檢查占卜卡] 資料庫中未找到當日記錄: pet_id=%s, date=%s", pet_id, today)
     
     return None
 
@@ -88,10 +207,10 @@ def _fetch_fortune_data(pet_id, BASE_URL):
         tuple: (pet_name, pet_image_url, cover_image_url) 或 (None, None, None)
     """
     api_url = f"{BASE_URL}/api/fortune-card/random?pet_id={pet_id}"
-    logger.info(f"🔮 調用占卜卡 API (當日首次生成): {api_url}")
+    logger.info("🔮 調用占卜卡 API (當日首次生成): %s", api_url)
     
     try:
-        response = requests.get(api_url, timeout=10)
+        response = _http_session.get(api_url, timeout=10)
         response.raise_for_status()
         response.encoding = 'utf-8'
         data = response.json()
@@ -114,7 +233,7 @@ def _fetch_fortune_data(pet_id, BASE_URL):
             pet_name = pet_name.decode('utf-8')
         pet_name = str(pet_name).strip()
         
-        logger.info(f"✅ 獲取寵物資料成功: {pet_name}, 頭像: {pet_image_url}")
+        logger.info("✅ 獲取寵物資料成功: %s, 頭像: %s", pet_name, pet_image_url)
         return pet_name, pet_image_url, cover_image_url
     
     except Exception as e:
@@ -127,34 +246,31 @@ def _download_pet_image(pet_image_url):
     下載寵物頭像圖片
     
     返回:
-        str: 臨時文件路徑，失敗返回 None
+        Image: 寵物頭像（RGBA），失敗返回 None
+    
+    說明:
+        直接從記憶體中的 bytes 解碼，不寫入暫存檔
     """
     try:
-        pet_image_response = requests.get(pet_image_url, timeout=10)
+        pet_image_response = _http_session.get(pet_image_url, timeout=10)
         pet_image_response.raise_for_status()
-        
-        temp_pet_path = f'/tmp/pet_{uuid.uuid4()}.png'
-        with open(temp_pet_path, 'wb') as f:
-            f.write(pet_image_response.content)
-        
-        return temp_pet_path
+        target_size = FORTUNE_CARD_CONFIG['PET_TARGET_SIZE']
+        return _open_image(pet_image_response.content, (target_size, target_size))
     except Exception as e:
         logger.error(f"❌ 下載寵物頭像失敗: {e}")
         return None
 
 
-def _process_pet_image(temp_pet_path):
+def _process_pet_image(pet_image):
     """
-    處理寵物頭像，調整尺寸並放在背景上
+    調整寵物頭像尺寸並計算在占卜卡上的位置
+    
+    參數:
+        pet_image: 寵物頭像（RGBA）
     
     返回:
-        Image: 處理後的寵物頭像背景圖
+        tuple: (resized_pet, (x_offset, y_offset))
     """
-    pet_image = Image.open(temp_pet_path).convert('RGBA')
-    
-    # 創建背景層
-    pet_image_bg = Image.new('RGBA', (FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT']), (255, 255, 255, 0))
-    
     # 調整尺寸
     target_size = FORTUNE_CARD_CONFIG['PET_TARGET_SIZE']
     pet_ratio = pet_image.width / pet_image.height
@@ -166,17 +282,65 @@ def _process_pet_image(temp_pet_path):
         new_height = target_size
         new_width = int(target_size * pet_ratio)
     
-    resized_pet = pet_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    resized_pet = _resize(pet_image, (new_width, new_height))
     
     # 計算位置
     x_offset = (FORTUNE_CARD_CONFIG['CARD_WIDTH'] - new_width) // 2
     y_offset = FORTUNE_CARD_CONFIG['PET_Y_OFFSET']
     
-    pet_image_bg.paste(resized_pet, (x_offset, y_offset), resized_pet)
+    logger.debug("✅ 寵物頭像處理完成: 原始尺寸 %s, 調整後 %s, 位置 (%s, %s)", pet_image.size, resized_pet.size, x_offset, y_offset)
+    
+    return resized_pet, (x_offset, y_offset)
+
+
+# 本地覆蓋圖片快取：啟動時一次性轉成 RGBA 並縮放成卡片尺寸
+# 之後每張卡片只需隨機挑一張，不必重新解碼與 LANCZOS 縮放
+_BG_SUFFIXES = {'.png', '.jpg', '.jpeg'}
+_bg_cache = None
+_bg_cache_lock = Lock()
+
+
+def preload_fortune_backgrounds():
+    """
+    預先載入並縮放 assets/images/fortune_bg 中的覆蓋圖片
     
-    logger.info(f"✅ 寵物頭像處理完成: 原始尺寸 {pet_image.size}, 調整後 {resized_pet.size}, 位置 ({x_offset}, {y_offset})")
+    返回:
+        list: [(檔名, Image), ...]，目錄不存在或為空時返回空列表
     
-    return pet_image_bg
+    說明:
+        只在第一次呼叫時讀取，之後直接返回快取
+        快取中的圖片不可修改，使用時請先 copy()
+    """
+    global _bg_cache
+    if _bg_cache is not None:
+        return _bg_cache
+    with _bg_cache_lock:
+        if _bg_cache is not None:
+            return _bg_cache
+        
+        bg_dir = Path(_get_assets_dir()) / "images" / "fortune_bg"
+        bg_files = sorted(
+            p for p in bg_dir.iterdir() if p.suffix.lower() in _BG_SUFFIXES
+        ) if bg_dir.is_dir() else []
+        backgrounds = []
+        card_size = (FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT'])
+        for bg_path in bg_files:
+            try:
+                # load() 後檔案即關閉；已是 RGBA 且為卡片尺寸時直接沿用，不再轉換或縮放
+                bg = Image.open(bg_path)
+                bg.load()
+                backgrounds.append((bg_path.name, _resize(_to_rgba(bg), card_size)))
+            except Exception as e:
+                logger.warning(f"⚠️ 無法載入覆蓋圖片 {bg_path.name}: {e}")
+        
+        if backgrounds:
+            logger.info("✅ 覆蓋圖片預先縮放完成: %s 張", len(backgrounds))
+        else:
+            # 啟動時（_warmup_caches）即提示，API 未提供覆蓋圖片的占卜卡都會失敗
+            logger.error(f"❌ 覆蓋圖片目錄不存在或為空: {bg_dir}")
+        
+        _bg_cache = backgrounds
+        return _bg_cache
 
 
 def _load_cover_image(cover_image_url):
@@ -189,52 +353,39 @@ def _load_cover_image(cover_image_url):
     try:
         if cover_image_url:
             # 從 API 下載
-            cover_response = requests.get(cover_image_url, timeout=10)
+            cover_response = _http_session.get(cover_image_url, timeout=10)
             cover_response.raise_for_status()
             
-            temp_bg_path = f'/tmp/bg_{uuid.uuid4()}.png'
-            with open(temp_bg_path, 'wb') as f:
-                f.write(cover_response.content)
+            card_size = (FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT'])
+            cover_image = _resize(_open_image(cover_response.content, card_size), card_size)
             
-            cover_image = Image.open(temp_bg_path).convert('RGBA')
-            cover_image = cover_image.resize((FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT']), Image.Resampling.LANCZOS)
-            
-            os.remove(temp_bg_path)
             return cover_image
         else:
-            # 從本地隨機選擇
-            assets_dir = _get_assets_dir()
-            bg_dir = os.path.join(assets_dir, "images", "fortune_bg")
-            
-            if not os.path.exists(bg_dir):
-                logger.error(f"❌ 覆蓋圖片目錄不存在: {bg_dir}")
-                return None
-            
-            bg_files = [f for f in os.listdir(bg_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            if not bg_files:
-                logger.error(f"❌ 覆蓋圖片目錄為空: {bg_dir}")
+            # 從本地隨機選擇（使用預先縮放好的快取）
+            backgrounds = preload_fortune_backgrounds()
+            if not backgrounds:
                 return None
             
-            random_bg = random.choice(bg_files)
-            bg_path = os.path.join(bg_dir, random_bg)
-            logger.info(f"🎲 隨機選擇覆蓋圖片: {random_bg}")
-            
-            cover_image = Image.open(bg_path).convert('RGBA')
-            cover_image = cover_image.resize((FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT']), Image.Resampling.LANCZOS)
+            random_bg, cover_image = random.choice(backgrounds)
+            logger.debug("🎲 隨機選擇覆蓋圖片: %s", random_bg)
             
-            return cover_image
+            return cover_image.copy()
     
     except Exception as e:
         logger.error(f"❌ 加載覆蓋圖片失敗: {e}")
         return None
 
 
+@lru_cache(maxsize=1)
 def _load_font():
     """
     載入字型
     
     返回:
         tuple: (font, font_size) 或 (None, fallback_size)
+    
+    說明:
+        結果會快取，只在第一次生成占卜卡時搜尋字型路徑並解析字型檔
     """
     font_size = FORTUNE_CARD_CONFIG['FONT_SIZE']
     assets_dir = _get_assets_dir()
@@ -262,7 +413,7 @@ def _load_font():
                 else:
                     font = ImageFont.truetype(font_path, font_size)
                 
-                logger.info(f"✅ 載入字型成功: {font_path}, 大小: {font_size}")
+                logger.info("✅ 載入字型成功: %s, 大小: %s", font_path, font_size)
                 return font, font_size
             except Exception as e:
                 logger.warning(f"⚠️ 載入字型失敗 {font_path}: {e}")
@@ -278,22 +429,29 @@ def _load_font():
     return font, font_size
 
 
+@lru_cache(maxsize=4096)
+def _char_bbox(font, char):
+    """
+    取得單一字元的邊界框（快取）
+    
+    說明:
+        字型物件已被 _load_font 快取，(font, char) 的量測結果固定不變
+        直接使用 font.getbbox，不需要 ImageDraw
+    """
+    return font.getbbox(char)
+
+
 def _draw_text(draw, text_content, font, font_size):
     """
     在圖片上繪製垂直排列的文字
     
     參數:
         draw: ImageDraw 對象
-        text_content: 要繪製的文字
+        text_content (str): 要繪製的文字（_fetch_fortune_data 已轉為 str 並去除空白）
         font: 字型對象
         font_size: 字體大小
     """
-    # 確保文字是正確的 Unicode 字串
-    if isinstance(text_content, bytes):
-        text_content = text_content.decode('utf-8')
-    text_content = str(text_content).strip()
-    
-    logger.info(f"🔍 準備繪製文字（垂直排列）: '{text_content}'")
+    logger.debug("🔍 準備繪製文字（垂直排列）: '%s'", text_content)
     
     text_x_offset = FORTUNE_CARD_CONFIG['TEXT_X_OFFSET']
     text_y_base = FORTUNE_CARD_CONFIG['TEXT_Y_BASE']
@@ -303,7 +461,7 @@ def _draw_text(draw, text_content, font, font_size):
         # 計算第一個字符的寬度以確定水平位置
         first_char = text_content[0] if text_content else ''
         if first_char:
-            char_bbox = draw.textbbox((0, 0), first_char, font=font)
+            char_bbox = _char_bbox(font, first_char)
             char_width = char_bbox[2] - char_bbox[0]
             text_x = (FORTUNE_CARD_CONFIG['CARD_WIDTH'] - char_width) // 2 + text_x_offset
         else:
@@ -311,7 +469,7 @@ def _draw_text(draw, text_content, font, font_size):
         
         # 計算每個字符的高度
         sample_char = '字' if text_content else 'A'
-        char_bbox = draw.textbbox((0, 0), sample_char, font=font)
+        char_bbox = _char_bbox(font, sample_char)
         char_height = char_bbox[3] - char_bbox[1]
         char_height_adjusted = int(char_height * char_spacing)
         
@@ -319,13 +477,19 @@ def _draw_text(draw, text_content, font, font_size):
         total_height = len(text_content) * char_height_adjusted
         start_y = text_y_base - total_height
         
-        # 逐個字符垂直繪製
-        current_y = start_y
-        for char in text_content:
-            draw.text((text_x, current_y), char, fill=(255, 255, 255, 255), font=font)
-            current_y += char_height_adjusted
+        # 每個字一行，以單次 multiline_text 繪製整段垂直文字
+        # multiline_text 的行高為「A」的 bbox 底部 + spacing，換算成每字間距 char_height_adjusted
+        line_spacing = char_height_adjusted - _char_bbox(font, 'A')[3]
+        draw.multiline_text(
+            (text_x, start_y),
+            '\n'.join(text_content),
+            fill=(255, 255, 255),
+            font=font,
+            spacing=line_spacing,
+            align='left'
+        )
         
-        logger.info(f"✅ 垂直文字繪製完成: '{text_content}' 起始位置: ({text_x}, {start_y})")
+        logger.debug("✅ 垂直文字繪製完成: '%s' 起始位置: (%s, %s)", text_content, text_x, start_y)
     
     except Exception as e:
         logger.error(f"❌ 垂直文字繪製失敗: {e}")
@@ -334,42 +498,87 @@ def _draw_text(draw, text_content, font, font_size):
             text_bbox = draw.textbbox((0, 0), text_content, font=font)
             text_width = text_bbox[2] - text_bbox[0]
             text_x = (FORTUNE_CARD_CONFIG['CARD_WIDTH'] - text_width) // 2
-            draw.text((text_x, FORTUNE_CARD_CONFIG['TEXT_Y_FALLBACK']), text_content, fill=(255, 255, 255, 255), font=font)
-            logger.info(f"✅ 使用水平備用方式繪製文字成功")
+            draw.text((text_x, FORTUNE_CARD_CONFIG['TEXT_Y_FALLBACK']), text_content, fill=(255, 255, 255), font=font)
+            logger.debug("✅ 使用水平備用方式繪製文字成功")
         except Exception as e2:
             logger.error(f"❌ 備用文字繪製也失敗: {e2}")
 
 
-def _composite_images(pet_image_bg, cover_image):
+def _composite_images(resized_pet, pet_position, cover_image):
     """
     合成占卜卡圖片
     
+    參數:
+        resized_pet: 調整尺寸後的寵物頭像（RGBA）
+        pet_position: 寵物頭像位置 (x, y)
+        cover_image: 覆蓋圖片
+    
     返回:
         Image: 合成後的圖片
+    
+    說明:
+        寵物頭像直接貼到畫布上，不另外建立整張 600×1000 的透明背景層
+        畫布直接使用不透明白色的 RGB 模式：以 alpha 遮罩貼上的顏色結果與 RGBA 畫布相同，
+        最後存檔時不必再 convert('RGB') 複製一次整張圖
     """
-    composite_image = Image.new('RGBA', (FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT']))
+    composite_image = Image.new('RGB', (FORTUNE_CARD_CONFIG['CARD_WIDTH'], FORTUNE_CARD_CONFIG['CARD_HEIGHT']), (255, 255, 255))
     
     # 第一層：貼上寵物頭像作為背景
-    composite_image.paste(pet_image_bg, (0, 0))
-    logger.info(f"✅ 第一層：寵物頭像背景已貼上")
+    composite_image.paste(resized_pet, pet_position, resized_pet)
+    logger.debug("✅ 第一層：寵物頭像已貼上，位置: %s", pet_position)
     
     # 第二層：疊加覆蓋圖片
     cover_x = FORTUNE_CARD_CONFIG['COVER_X']
     cover_y = FORTUNE_CARD_CONFIG['COVER_Y']
     cover_position = (cover_x, cover_y)
     
-    if cover_image.mode == 'RGBA':
+    # getextrema() 在 C 層取得各通道的最小/最大值，不需逐像素掃描 alpha 通道
+    has_transparency = cover_image.mode == 'RGBA' and cover_image.getextrema()[3][0] < 255
+    
+    # 畫布是不透明的 RGB：paste 以 RGBA 遮罩直接在 C 層單次混色，不需轉換覆蓋圖模式
+    # alpha_composite 需要兩邊都是 RGBA，且會先 crop 出區域、合成後再 paste 回去，
+    # 對不透明畫布反而多出兩次整張圖的配置，因此維持使用 paste
+    if has_transparency:
         composite_image.paste(cover_image, cover_position, cover_image)
-        logger.info(f"✅ 第二層：覆蓋圖片已疊加（使用 RGBA alpha 通道），位置: {cover_position}")
+        logger.debug("✅ 第二層：覆蓋圖片已疊加（使用 RGBA alpha 通道），位置: %s", cover_position)
     else:
         composite_image.paste(cover_image, cover_position)
-        logger.warning(f"⚠️ 覆蓋圖片沒有 alpha 通道，會完全覆蓋寵物頭像，位置: {cover_position}")
+        logger.warning(f"⚠️ 覆蓋圖片沒有透明區域，會完全覆蓋寵物頭像，位置: {cover_position}")
     
-    logger.info(f"✅ 圖片合成完成（寵物頭像在下，覆蓋圖片在上，透明區域顯示寵物）")
+    logger.debug("✅ 圖片合成完成（寵物頭像在下，覆蓋圖片在上，透明區域顯示寵物）")
     
     return composite_image
 
 
+def _save_and_build_url(pet_id, today, filename, EXTERNAL_URL, get_daily_fortune_card_func, save_daily_fortune_card_func):
+    """
+    記錄當日占卜卡到資料庫並返回外部 URL
+    
+    返回:
+        str: 占卜卡圖片外部 URL
+    """
+    # 保存到資料庫
+    logger.debug("💾 [保存資料庫] 準備保存: pet_id=%s, date=%s, filename=%s", pet_id, today, filename)
+    save_success = save_daily_fortune_card_func(pet_id, filename, today)
+    if save_success:
+        logger.info("✅ [保存資料庫] 保存成功: pet_id=%s, date=%s, filename=%s", pet_id, today, filename)
+        # 立即驗證保存是否成功
+        verify_filename = get_daily_fortune_card_func(pet_id, today)
+        if verify_filename == filename:
+            logger.debug("✅ [保存資料庫] 驗證成功: 資料庫記錄與保存的文件名一致")
+        else:
+            logger.error(f"❌ [保存資料庫] 驗證失敗: 期望={filename}, 實際={verify_filename}")
+            logger.error(f"❌ [保存資料庫] 這可能導致每次調用都生成新的占卜卡！")
+    else:
+        logger.error(f"❌ [保存資料庫] 保存失敗: pet_id={pet_id}, date={today}, filename={filename}")
+        logger.error(f"❌ [保存資料庫] 這可能導致每次調用都生成新的占卜卡！")
+    
+    # 返回外部 URL
+    external_url = f"{EXTERNAL_URL}/line/output/{filename}"
+    logger.info("🔗 [生成占卜卡] 完成，返回 URL: %s", external_url)
+    return external_url
+
+
 def generate_fortune_card(pet_id, BASE_URL, EXTERNAL_URL, get_daily_fortune_card_func, save_daily_fortune_card_func):
     """
     生成寵物占卜卡（主函數）
@@ -384,19 +593,17 @@ def generate_fortune_card(pet_id, BASE_URL, EXTERNAL_URL, get_daily_fortune_card
     返回:
         str: 生成的占卜卡圖片外部 URL，如果失敗則返回 None
     """
-    temp_pet_path = None
-    
     try:
         # 0. 檢查當日是否已生成占卜卡
         today = date.today().strftime('%Y-%m-%d')
-        logger.info(f"📅 [生成占卜卡] 開始處理: pet_id={pet_id}, date={today}")
+        logger.info("📅 [生成占卜卡] 開始處理: pet_id=%s, date=%s", pet_id, today)
         
         existing_url = _check_existing_fortune_card(pet_id, today, get_daily_fortune_card_func, EXTERNAL_URL)
         if existing_url:
-            logger.info(f"✅ [生成占卜卡] 返回已存在的占卜卡: {existing_url}")
+            logger.debug("✅ [生成占卜卡] 返回已存在的占卜卡: %s", existing_url)
             return existing_url
         
-        logger.info(f"📝 [生成占卜卡] 當日尚未生成，開始生成新的占卜卡: pet_id={pet_id}, date={today}")
+        logger.debug("📝 [生成占卜卡] 當日尚未生成，開始生成新的占卜卡: pet_id=%s, date=%s", pet_id, today)
         
         # 1. 確保 output 目錄存在
         output_dir = _get_output_dir()
@@ -407,69 +614,59 @@ def generate_fortune_card(pet_id, BASE_URL, EXTERNAL_URL, get_daily_fortune_card
         if not pet_name or not pet_image_url:
             return None
         
-        # 3. 下載寵物頭像
-        temp_pet_path = _download_pet_image(pet_image_url)
-        if not temp_pet_path:
+        # 相同組合已渲染過時直接沿用（本地覆蓋圖片為隨機挑選，不適用）
+        card_key = _card_cache_key(pet_name, pet_image_url, cover_image_url) if cover_image_url else None
+        filename = _get_rendered_card(card_key, output_dir) if card_key else None
+        if filename:
+            logger.info("♻️  [生成占卜卡] 使用相同內容已渲染的占卜卡: %s", filename)
+            return _save_and_build_url(pet_id, today, filename, EXTERNAL_URL, get_daily_fortune_card_func, save_daily_fortune_card_func)
+        
+        # 3. 同時下載寵物頭像與加載覆蓋圖片
+        pet_future = _download_executor.submit(_download_pet_image, pet_image_url)
+        cover_future = _download_executor.submit(_load_cover_image, cover_image_url)
+        pet_image = pet_future.result()
+        cover_image = cover_future.result()
+        if not pet_image:
             return None
         
         # 4. 處理寵物頭像
-        pet_image_bg = _process_pet_image(temp_pet_path)
+        resized_pet, pet_position = _process_pet_image(pet_image)
         
-        # 5. 加載覆蓋圖片
-        cover_image = _load_cover_image(cover_image_url)
+        # 5. 確認覆蓋圖片
         if not cover_image:
-            os.remove(temp_pet_path)
             return None
         
-        logger.info(f"✅ 覆蓋圖片處理完成: {cover_image.size}, 模式: {cover_image.mode}")
+        logger.debug("✅ 覆蓋圖片處理完成: %s, 模式: %s", cover_image.size, cover_image.mode)
         
         # 6. 合成圖片
-        composite_image = _composite_images(pet_image_bg, cover_image)
+        composite_image = _composite_images(resized_pet, pet_position, cover_image)
         
         # 7. 添加文字
         draw = ImageDraw.Draw(composite_image)
         font, font_size = _load_font()
         _draw_text(draw, pet_name, font, font_size)
         
-        # 8. 轉換回 RGB 模式並保存
-        final_image = composite_image.convert('RGB')
-        filename = f"{uuid.uuid4()}.png"
+        # 8. 保存（畫布已是 RGB，不需轉換）
+        filename = f"{secrets.token_hex(16)}.png"
         output_path = os.path.join(output_dir, filename)
-        final_image.save(output_path, 'PNG')
-        logger.info(f"✅ 占卜卡保存成功: {output_path}")
-        
-        # 9. 清理臨時文件
-        if temp_pet_path and os.path.exists(temp_pet_path):
-            os.remove(temp_pet_path)
+        buffer = io.BytesIO()
+        composite_image.save(buffer, 'PNG', optimize=False, compress_level=PNG_COMPRESS_LEVEL)
+        card_bytes = buffer.getvalue()
+        with _card_bytes_cache_lock:
+            _card_bytes_cache[filename] = card_bytes
+        # 仍寫入磁碟：資料庫以檔名記錄當日占卜卡，其他 worker 行程也需要讀得到
+        with open(output_path, 'wb') as f:
+            f.write(card_bytes)
+        logger.info("✅ 占卜卡保存成功: %s", output_path)
         
-        # 10. 保存到資料庫
-        logger.info(f"💾 [保存資料庫] 準備保存: pet_id={pet_id}, date={today}, filename={filename}")
-        save_success = save_daily_fortune_card_func(pet_id, filename, today)
-        if save_success:
-            logger.info(f"✅ [保存資料庫] 保存成功: pet_id={pet_id}, date={today}, filename={filename}")
-            # 立即驗證保存是否成功
-            verify_filename = get_daily_fortune_card_func(pet_id, today)
-            if verify_filename == filename:
-                logger.info(f"✅ [保存資料庫] 驗證成功: 資料庫記錄與保存的文件名一致")
-            else:
-                logger.error(f"❌ [保存資料庫] 驗證失敗: 期望={filename}, 實際={verify_filename}")
-                logger.error(f"❌ [保存資料庫] 這可能導致每次調用都生成新的占卜卡！")
-        else:
-            logger.error(f"❌ [保存資料庫] 保存失敗: pet_id={pet_id}, date={today}, filename={filename}")
-            logger.error(f"❌ [保存資料庫] 這可能導致每次調用都生成新的占卜卡！")
+        if card_key:
+            with _card_file_cache_lock:
+                _card_file_cache[card_key] = filename
         
-        # 11. 返回外部 URL
-        external_url = f"{EXTERNAL_URL}/line/output/{filename}"
-        logger.info(f"🔗 [生成占卜卡] 完成，返回 URL: {external_url}")
-        return external_url
+        # 9. 保存到資料庫並返回外部 URL
+        return _save_and_build_url(pet_id, today, filename, EXTERNAL_URL, get_daily_fortune_card_func, save_daily_fortune_card_func)
     
     except Exception as e:
         logger.error(f"❌ 生成占卜卡失敗: {e}", exc_info=True)
-        # 清理臨時文件
-        if temp_pet_path and os.path.exists(temp_pet_path):
-            try:
-                os.remove(temp_pet_path)
-            except:
-                pass
         return None
 
@@ -7,11 +7,15 @@ import logging
 import os
 import random
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from threading import Lock
+from cachetools import LRUCache, TTLCache
+from requests.adapters import HTTPAdapter
 from linebot.v3.messaging import (
-    ApiClient,
-    MessagingApi,
     ReplyMessageRequest,
     PushMessageRequest,
+    ShowLoadingAnimationRequest,
     TextMessage,
     ImageMessage,
     FlexMessage,
@@ -39,55 +43,119 @@ except ImportError:
                 "image": ""
             }
 
+try:
+    from mybot.response_cache import get_response_cache, get_exact_response_cache, normalize_message, prompt_fingerprint
+except ImportError:
+    from response_cache import get_response_cache, get_exact_response_cache, normalize_message, prompt_fingerprint
+
+
+class Cmd(IntEnum):
+    """文字指令類型"""
+    CHAT = 0      # 一般對話
+    MYID = 1      # 「我的ID」
+    CLEAR = 2     # 「清除」
+    HELP = 3      # 「說明」
+    FORTUNE = 4   # 「占卜」
+    WHISPER = 5   # 「愛寵小語」
+
+
+# 指令別名對照表（別名皆已轉為小寫）
+# 每則訊息只需一次 lower() 與一次字典查詢，不必逐一比對各個指令列表
+_COMMANDS = {
+    **dict.fromkeys(('我的id', 'myid', 'my id', 'userid', 'user id'), Cmd.MYID),
+    **dict.fromkeys(('clear', '清除', '重置'), Cmd.CLEAR),
+    **dict.fromkeys(('help', '幫助', '說明'), Cmd.HELP),
+    **dict.fromkeys(('毛孩占卜', '/fortune'), Cmd.FORTUNE),
+    **dict.fromkeys(('愛寵小語', '小語', '寵物小語'), Cmd.WHISPER),
+}
+
+# 與前文無關的單純招呼（已正規化：小寫、去除句尾語氣符號）不讀取對話歷史，省下一次資料庫往返
+# 不以字數判斷：「為什麼」「然後呢」「真的嗎」「好啊」這類短訊息都是接續前文的追問或回應
+_NO_HISTORY_GREETINGS = frozenset((
+    '嗨', '哈囉', '你好', '妳好', '安安', '早', '早安', '午安', '晚安',
+    'hi', 'hello', 'hey', 'yo',
+))
+
+
+def _needs_history(msg: str) -> bool:
+    """
+    判斷這則訊息是否需要讀取對話歷史
 
-def _handle_my_id_command(user_id, pet_id):
-    """處理「我的ID」指令"""
-    if pet_id:
-        return f"""🆔 你的使用者資訊
+    參數:
+        msg (str): 使用者訊息
 
-LINE User ID:
-{user_id}
+    返回:
+        bool: 需要讀取返回 True；指令或單純的招呼返回 False
+    """
+    msg = normalize_message(msg)
+    return msg not in _NO_HISTORY_GREETINGS and msg not in _COMMANDS
 
-✅ 你已經設定好寵物了，可以直接聊天喔～"""
-    else:
-        return f"""🆔 你的使用者資訊
 
-LINE User ID:
-{user_id}
+# ============================================
+# 固定回覆內容（模組載入時建立一次）
+# ============================================
+
+HELP_TEXT = """🐕 寵物聊天機器人使用說明
+
+• 直接傳送訊息，我會像寵物一樣回覆你
+• 輸入「清除」可以重置對話記錄
+• 輸入「說明」查看此訊息
+• 輸入「我的ID」查看你的使用者ID
+• 輸入「愛寵小語」獲取專屬小語
+• 輸入「占卜」或「/fortune」生成占卜卡
+
+快來跟我聊天吧！～"""
+
+WELCOME_TEXT = """👋 哈囉！歡迎使用寵物聊天機器人！
 
 ⚠️ 你還沒有設定專屬寵物喔！
 
-請將上面的 User ID 複製後，提供給客服人員進行設定。設定完成後就可以開始和你的虛擬寵物聊天囉！
+請先在聊天視窗輸入「我的ID」，系統會顯示你的 LINE User ID。
+
+將該 ID 複製後提供給客服人員進行設定，設定完成後就可以開始聊天囉！"""
+
+CLEAR_TEXT = "嗚！我忘記之前的對話了，我們重新開始吧！"
+NO_PROMPT_TEXT = "嗚...主人，我現在記不起來自己是誰了 😢\n請稍後再試試看"
+ERROR_TEXT = "嗚...主人，我現在有點不舒服 🥺"
+
+# 完全固定的回覆直接預先建立 TextMessage，每次回覆不必重新建立
+HELP_MSG = TextMessage(text=HELP_TEXT)
+WELCOME_MSG = TextMessage(text=WELCOME_TEXT)
+ERROR_MSG = TextMessage(text=ERROR_TEXT)
+
+_MY_ID_HEADER = "🆔 你的使用者資訊\n\nLINE User ID:\n"
+_MY_ID_BOUND_FOOTER = "\n\n✅ 你已經設定好寵物了，可以直接聊天喔～"
+_MY_ID_UNBOUND_FOOTER = (
+    "\n\n⚠️ 你還沒有設定專屬寵物喔！\n\n"
+    "請將上面的 User ID 複製後，提供給客服人員進行設定。設定完成後就可以開始和你的虛擬寵物聊天囉！\n\n"
+    "📞 需要協助請聯絡客服"
+)
 
-📞 需要協助請聯絡客服"""
+
+def _handle_my_id_command(user_id, pet_id):
+    """處理「我的ID」指令"""
+    footer = _MY_ID_BOUND_FOOTER if pet_id else _MY_ID_UNBOUND_FOOTER
+    return ''.join((_MY_ID_HEADER, user_id, footer))
 
 
 def _handle_clear_command(user_id, pet_id, clear_chat_history_func):
     """處理「清除」指令"""
     clear_chat_history_func(user_id, pet_id)
-    return "嗚！我忘記之前的對話了，我們重新開始吧！"
+    return CLEAR_TEXT
 
 
 def _handle_help_command():
     """處理「說明」指令"""
-    return """🐕 寵物聊天機器人使用說明
+    return HELP_TEXT
 
-• 直接傳送訊息，我會像寵物一樣回覆你
-• 輸入「清除」可以重置對話記錄
-• 輸入「說明」查看此訊息
-• 輸入「我的ID」查看你的使用者ID
-• 輸入「愛寵小語」獲取專屬小語
-• 輸入「占卜」或「/fortune」生成占卜卡
-
-快來跟我聊天吧！～"""
 
-
-def _handle_fortune_command(user_id, pet_id, generate_fortune_card_func, configuration):
+def _handle_fortune_command(user_id, pet_id, generate_fortune_card_func):
     """
     處理占卜卡指令
     
     返回:
-        tuple: (should_return, reply_text) - should_return=True 表示已處理完畢，不需要繼續處理
+        tuple: (reply_text, messages_to_send) - 成功時 messages_to_send 為占卜卡圖片，
+               reply_text 為圖片無法送出時的文字備案；失敗時只有文字
     """
     try:
         logger.info(f"🔮 用戶 {user_id} 請求占卜卡")
@@ -101,34 +169,20 @@ def _handle_fortune_command(user_id, pet_id, generate_fortune_card_func, configu
                 original_content_url=fortune_card_url,
                 preview_image_url=fortune_card_url
             )
-            
-            logger.info(f"📤 準備發送圖片到 LINE，URL: {fortune_card_url}")
-            
-            try:
-                with ApiClient(configuration) as api_client:
-                    line_bot_api = MessagingApi(api_client)
-                    line_bot_api.push_message(
-                        PushMessageRequest(
-                            to=user_id,
-                            messages=[image_message]
-                        )
-                    )
-                logger.info(f"✅ 使用 push_message 成功發送圖片")
-                return True, None  # 已處理，不需要文字回覆
-            except Exception as e2:
-                logger.error(f"❌ push_message 也失敗: {e2}")
-                return False, f"嗚...圖片發送失敗：{str(e2)}"
+            return f"🔮 今日占卜卡：{fortune_card_url}", [image_message]
         else:
             logger.error(f"❌ 占卜卡生成失敗，返回 URL 為 None")
-            return False, "嗚...占卜卡生成失敗了，請稍後再試～"
+            return "嗚...占卜卡生成失敗了，請稍後再試～", None
     
     except Exception as e:
         logger.error(f"❌ 占卜卡功能失敗: {e}", exc_info=True)
-        return False, f"嗚...占卜過程中發生錯誤：{str(e)}"
+        return f"嗚...占卜過程中發生錯誤：{str(e)}", None
 
 
 # 緩存情緒圖片列表（避免重複掃描文件系統）
-_emotion_images_cache = {}
+# key 為 (web_slug, emotion)，會隨寵物數量成長，使用 LRU 限制上限避免長時間運行後記憶體無限增長
+_emotion_images_cache = LRUCache(maxsize=int(os.getenv('EMOTION_IMAGE_CACHE', 4096)))
+_emotion_images_cache_lock = Lock()
 
 
 def _get_emotion_image_url(emotion: str, EXTERNAL_URL: str, base_dir: str = None, web_slug: str = None) -> str:
@@ -151,8 +205,11 @@ def _get_emotion_image_url(emotion: str, EXTERNAL_URL: str, base_dir: str = None
     emotion = emotion.lower()
     cache_key = (web_slug or "_default", emotion)
     
+    with _emotion_images_cache_lock:
+        image_urls = _emotion_images_cache.get(cache_key)
+    
     # 如果緩存中沒有該情緒的圖片列表，掃描資料夾
-    if cache_key not in _emotion_images_cache:
+    if image_urls is None:
         search_rel_paths = []
         if web_slug:
             search_rel_paths.append(('emotions', web_slug, emotion))
@@ -208,22 +265,22 @@ def _get_emotion_image_url(emotion: str, EXTERNAL_URL: str, base_dir: str = None
                     for filename in image_files
                 ]
                 
-                _emotion_images_cache[cache_key] = image_urls
                 logger.info(
                     f"📂 掃描情緒資料夾 {emotion} (slug={web_slug or 'default'}): 找到 {len(image_urls)} 張圖片"
                 )
             except Exception as e:
                 logger.warning(f"⚠️ 掃描情緒資料夾失敗 {emotion} (slug={web_slug or 'default'}): {e}")
-                _emotion_images_cache[cache_key] = []
+                image_urls = []
         else:
             logger.warning(
                 f"⚠️ 情緒資料夾不存在: {emotion} (slug={web_slug or 'default'})，搜尋路徑: {search_rel_paths}"
             )
-            _emotion_images_cache[cache_key] = []
+            image_urls = []
+        
+        with _emotion_images_cache_lock:
+            _emotion_images_cache[cache_key] = image_urls
     
     # 從緩存中隨機選擇一張圖片
-    image_urls = _emotion_images_cache.get(cache_key, [])
-    
     if image_urls:
         selected_url = random.choice(image_urls)
         logger.debug(f"🎲 隨機選擇情緒圖片: {emotion} -> {selected_url}")
@@ -296,20 +353,59 @@ def _build_emotion_context(emotion_result: dict, pet_name: str) -> str:
     return "\n        ".join(context_lines)
 
 
-def _handle_whisper_command(user_id, pet_id, pet_name, BASE_URL, configuration, event):
+# 愛寵小語 API 共用的 HTTP Session（保留 TCP/TLS 連線，不必每次重新握手）
+_whisper_session = requests.Session()
+_whisper_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+_whisper_session.mount('https://', _whisper_adapter)
+_whisper_session.mount('http://', _whisper_adapter)
+
+# 愛寵小語 API 回應快取（key 為 pet_id）
+# 使用者連續點擊時，WHISPER_CACHE_TTL 秒內不再重複呼叫 API
+_whisper_cache = TTLCache(maxsize=1024, ttl=int(os.getenv('WHISPER_CACHE_TTL', 60)))
+_whisper_cache_lock = Lock()
+
+# 收到「愛寵小語」後立即在背景呼叫 API，與讀取寵物資料同時進行
+_whisper_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='whisper-prefetch')
+
+
+def _fetch_whisper(pet_id, BASE_URL):
+    """
+    從 API 取得愛寵小語（帶快取）
+    
+    返回:
+        dict: API 回應的 JSON；只快取成功的回應
+    """
+    with _whisper_cache_lock:
+        cached = _whisper_cache.get(pet_id)
+    if cached is not None:
+        logger.debug(f"⚡ 使用快取的愛寵小語 - pet_id: {pet_id}")
+        return cached
+    
+    api_url = f"{BASE_URL}/api/pet-whisper/random?pet_id={pet_id}"
+    logger.info(f"🔍 調用愛寵小語 API: {api_url}")
+    
+    response = _whisper_session.get(api_url, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get('success', False):
+        with _whisper_cache_lock:
+            _whisper_cache[pet_id] = data
+    return data
+
+
+def _handle_whisper_command(pet_id, pet_name, BASE_URL, whisper_future=None):
     """
     處理「愛寵小語」指令
     
+    參數:
+        whisper_future: 已提前送出的 _fetch_whisper 結果（可選），未提供則在此呼叫 API
+    
     返回:
-        tuple: (should_return, reply_text) - should_return=True 表示已處理完畢
+        tuple: (reply_text, messages_to_send) - 有圖片時 messages_to_send 為 FlexMessage，否則為 None
     """
     try:
-        api_url = f"{BASE_URL}/api/pet-whisper/random?pet_id={pet_id}"
-        logger.info(f"🔍 調用愛寵小語 API: {api_url}")
-        
-        response = requests.get(api_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = whisper_future.result() if whisper_future is not None else _fetch_whisper(pet_id, BASE_URL)
         
         if data.get('success', False):
             whisper_data = data.get('data', {})
@@ -319,6 +415,8 @@ def _handle_whisper_command(user_id, pet_id, pet_name, BASE_URL, configuration,
             
             logger.info(f"✅ 獲取愛寵小語成功: {whisper_text[:50]}...")
             
+            whisper_reply = f"{pet_name}：\n\n{whisper_text}"
+            
             if whisper_image and whisper_text:
                 # 建立 FlexMessage
                 flex_message = FlexMessage(
@@ -338,7 +436,7 @@ def _handle_whisper_command(user_id, pet_id, pet_name, BASE_URL, configuration,
                                 },
                                 {
                                     "type": "text",
-                                    "text": f"{pet_name}：\n\n{whisper_text}",
+                                    "text": whisper_reply,
                                     "wrap": True,
                                     "size": "md",
                                     "margin": "md"
@@ -347,51 +445,276 @@ def _handle_whisper_command(user_id, pet_id, pet_name, BASE_URL, configuration,
                         }
                     })
                 )
-                
-                try:
-                    with ApiClient(configuration) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message_with_http_info(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[flex_message]
-                            )
-                        )
-                    return True, None  # 已處理
-                except Exception as e:
-                    # reply_token 已失效，用 push_message 補救
-                    logger.warning(f"reply_token 失效，改用 push_message: {e}")
-                    with ApiClient(configuration) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.push_message(
-                            PushMessageRequest(
-                                to=user_id,
-                                messages=[flex_message]
-                            )
-                        )
-                    return True, None  # 已處理
+                return whisper_reply, [flex_message]
             
             elif whisper_text:
-                return False, f"{pet_name}：\n\n{whisper_text}"
+                return whisper_reply, None
             else:
-                return False, "嗚...暫時沒有小語可以分享呢～"
+                return "嗚...暫時沒有小語可以分享呢～", None
         else:
-            return False, "嗚...現在沒有小語可以分享呢～"
+            return "嗚...現在沒有小語可以分享呢～", None
     
     except Exception as e:
         logger.error(f"❌ 愛寵小語 API 調用失敗: {e}")
-        return False, "嗚...現在無法獲取小語，請稍後再試～"
+        return "嗚...現在無法獲取小語，請稍後再試～", None
+
+
+def _handle_chat(user_id, user_message, pet_id, pet_name, pet_web_slug, system_prompt,
+                 save_chat_turn_func, get_chat_history_func,
+                 chat_with_pet_api_func, chat_with_pet_ollama_func,
+                 EXTERNAL_URL, AI_MODE, QWEN_MODEL, OLLAMA_MODEL, base_dir=None):
+    """
+    處理一般對話：情緒分析 → 讀取歷史 → 語意快取 / 模型回覆 → 寫入資料庫 → 組合回覆訊息
+    
+    返回:
+        tuple: (reply_text, messages_to_send)
+    """
+    # 1️⃣ 情緒辨識模組（僅在 API 模式啟用）
+    emotion_result = {
+        "emotion": "contentment",
+        "image": ""
+    }
+
+    if AI_MODE == 'api':
+        logger.info(f"🎭 開始情緒分析 - 用戶: {user_id}, 訊息: {user_message[:50]}")
+        try:
+            emotion_result = detect_emotion(user_message)
+            logger.info(f"✅ 情緒分析結果: {emotion_result}")
+        except Exception as e:
+            logger.error(f"❌ 情緒分析失敗: {e}", exc_info=True)
+            logger.warning(f"⚠️ 使用預設情緒: {emotion_result}")
+    else:
+        logger.info("ℹ️ 情緒分析僅在 API 模式啟用，已略過")
+
+    # 根據情緒生成上下文提示（僅 API 模式）
+    enhanced_system_prompt = system_prompt
+    if AI_MODE == 'api':
+        emotion_context = _build_emotion_context(emotion_result, pet_name)
+        if emotion_context:
+            enhanced_system_prompt = f"{system_prompt}\n\n        💭 主人現在的情緒狀態：\n        {emotion_context}\n        - 請根據主人的情緒狀態調整你的回應方式\n        - 如果主人情緒低落，要溫柔安慰\n        - 如果主人情緒正向，可以更活潑開心地回應\n"
+    
+    if _needs_history(user_message):
+        history = get_chat_history_func(user_id, pet_id, limit=8)
+    else:
+        history = []
+        logger.debug(f"ℹ️ 單純招呼，略過讀取對話歷史 - user: {user_id}")
+    
+    logger.info(f"💬 處理對話 - 用戶: {user_id}, 模式: {AI_MODE}")
+    logger.info(f"📝 輸入訊息: {user_message}")
+    logger.info(
+        f"🎭 情緒: {emotion_result.get('emotion', 'unknown')} (圖片: {'有' if emotion_result.get('image') else '無'})"
+    )
+    
+    # 完全比對快取：相同提示詞、相同最近對話下的同一句話直接沿用先前回覆（不需計算向量）
+    # 情緒上下文只由情緒與寵物名字決定，因此以 (使用者, 寵物, 模式, 情緒) 分區，指紋只針對快取中的原始提示詞
+    # 分區包含使用者：沒有歷史的短訊息也不會把一位使用者的回覆送給另一位使用者
+    exact_cache = get_exact_response_cache()
+    exact_key = reply_text = None
+    if exact_cache is not None:
+        exact_key = exact_cache.make_key(
+            (user_id, pet_id, AI_MODE, emotion_result.get('emotion', '')),
+            prompt_fingerprint(system_prompt),
+            user_message,
+            history
+        )
+        reply_text = exact_cache.lookup(exact_key)
+    
+    # 語意回覆快取：同一使用者、同一寵物、同一情緒下語意相近的對話直接沿用先前回覆
+    response_cache = get_response_cache() if reply_text is None else None
+    cache_key = query_vector = None
+    if response_cache is not None:
+        try:
+            cache_key = (user_id, pet_id, AI_MODE, emotion_result.get('emotion', ''))
+            query_vector = response_cache.embed(user_message, history)
+            reply_text = response_cache.lookup(cache_key, query_vector)
+        except Exception as e:
+            logger.warning(f"⚠️ 語意快取查詢失敗，改為呼叫模型: {e}")
+            query_vector = None
+    
+    cache_hit = reply_text is not None
+    if cache_hit:
+        logger.info("⚡ 使用快取回覆，略過模型呼叫")
+    elif AI_MODE == 'api':
+        logger.info(f"🌐 使用 API 模式 - 模型: {QWEN_MODEL}")
+        reply_text = chat_with_pet_api_func(
+            system_prompt=enhanced_system_prompt,
+            user_input=user_message,
+            history=history,
+            model=QWEN_MODEL,
+            pet_name=pet_name
+        )
+        logger.info("✅ API 模式回應完成")
+    else:
+        logger.info(f"🏠 使用 Ollama 模式 - 模型: {OLLAMA_MODEL}")
+        reply_text = chat_with_pet_ollama_func(
+            system_prompt=enhanced_system_prompt,
+            user_input=user_message,
+            history=history,
+            model=OLLAMA_MODEL,
+            pet_name=pet_name,
+            conversation_key=(user_id, pet_id)
+        )
+        logger.info("✅ Ollama 模式回應完成")
+    
+    if not cache_hit:
+        if exact_key is not None:
+            exact_cache.add(exact_key, reply_text)
+        if query_vector is not None:
+            response_cache.add(cache_key, query_vector, reply_text)
+    
+    # 使用者訊息與寵物回覆一次寫入（單一 INSERT）
+    turn_saved = save_chat_turn_func(user_id, pet_id, user_message, reply_text)
+    if not turn_saved:
+        logger.error(
+            f"❌ 無法將對話寫入資料庫 - user: {user_id}, pet: {pet_id}, message: {user_message[:50]}, reply: {reply_text[:50]}"
+        )
+    
+    # 🖼️ 判斷是否需要發送情緒圖片
+    # 只有在明確判斷出 8 種情緒之一且信心度足夠時才發送圖片
+    valid_emotions = ['amusement', 'awe', 'contentment', 'excitement', 'anger', 'disgust', 'fear', 'sad']
+    emotion = emotion_result.get('emotion', '').lower()
+    # 準備回覆訊息（預設只有文字）
+    messages_to_send = None
+
+    emotion_image_url = emotion_result.get('image')
+
+    if AI_MODE == 'api' and emotion in valid_emotions and not emotion_image_url:
+        emotion_image_url = _get_emotion_image_url(
+            emotion,
+            EXTERNAL_URL,
+            base_dir,
+            web_slug=pet_web_slug
+        )
+
+    if AI_MODE == 'api' and emotion in valid_emotions and emotion_image_url:
+        try:
+            # 使用 Flex Message 同時發送文字和圖片
+            flex_message = FlexMessage(
+                alt_text=f"{pet_name}的回覆",
+                contents=FlexContainer.from_dict({
+                    "type": "bubble",
+                    "body": {
+                        "type": "box",
+                        "layout": "vertical",
+                        "contents": [
+                            {
+                                "type": "image",
+                                "url": emotion_image_url,
+                                "size": "full",
+                                "aspectMode": "cover",
+                                "aspectRatio": "1:1"
+                            },
+                            {
+                                "type": "text",
+                                "text": reply_text,
+                                "wrap": True,
+                                "size": "md",
+                                "margin": "md"
+                            }
+                        ]
+                    }
+                })
+            )
+            messages_to_send = [flex_message]
+            logger.info(f"🖼️ 使用 Flex Message 發送文字+圖片: {emotion} -> {emotion_image_url}")
+        except Exception as img_error:
+            logger.warning(f"⚠️ 無法建立 Flex Message: {img_error}，改用純文字")
+            messages_to_send = [TextMessage(text=reply_text)]
+    else:
+        if emotion not in valid_emotions:
+            logger.info(f"ℹ️ 情緒 {emotion} 不在有效列表中，不發送圖片")
+        elif not emotion_image_url:
+            logger.info(f"ℹ️ 情緒 {emotion} 沒有對應的圖片 URL，使用純文字")
+        messages_to_send = [TextMessage(text=reply_text)]
+
+    return reply_text, messages_to_send
+
+
+# 等待模型回覆或生成占卜卡時，在聊天室顯示「輸入中」動畫（秒數需為 5 的倍數，最多 60）
+# 不會消耗 reply_token，回覆送出時動畫自動消失
+LOADING_ANIMATION = os.getenv('LOADING_ANIMATION', 'true').lower() in ['1', 'true', 'yes', 'on']
+LOADING_SECONDS = int(os.getenv('LOADING_SECONDS', 20))
+
+
+def _show_loading(line_bot_api, user_id):
+    """顯示載入動畫（僅一對一聊天有效，失敗不影響後續回覆）"""
+    if not LOADING_ANIMATION:
+        return
+    try:
+        line_bot_api.show_loading_animation(
+            ShowLoadingAnimationRequest(chat_id=user_id, loading_seconds=LOADING_SECONDS)
+        )
+    except Exception as e:
+        logger.debug(f"顯示載入動畫失敗: {e}")
+
+
+def _send_reply(line_bot_api, event, user_id, reply_text, messages_to_send=None):
+    """
+    回覆訊息給使用者
+    
+    說明:
+        依序嘗試：完整訊息 → 純文字 → push_message 補送（完整訊息，失敗再送純文字）
+        reply_token 可能已逾時（背景處理過久，例如生成占卜卡），因此最後改用 push_message
+    """
+    # 如果沒有設定 messages_to_send，使用預設的文字訊息
+    if messages_to_send is None:
+        messages_to_send = [TextMessage(text=reply_text)]
+
+    try:
+        line_bot_api.reply_message_with_http_info(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=messages_to_send
+            )
+        )
+        logger.info(f"✅ 回覆使用者 {user_id}：{reply_text} (共 {len(messages_to_send)} 則訊息)")
+    except Exception as reply_error:
+        logger.error(f"❌ 回覆訊息失敗: {reply_error}")
+        # 如果回覆失敗，嘗試只發送文字
+        try:
+            line_bot_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(text=reply_text)]
+                )
+            )
+            logger.info(f"✅ 回覆文字訊息成功：{reply_text}")
+        except Exception as text_error:
+            logger.error(f"❌ 回覆文字訊息也失敗: {text_error}")
+            # reply_token 可能已逾時（背景處理過久），改用 push_message 補送
+            try:
+                line_bot_api.push_message(
+                    PushMessageRequest(
+                        to=user_id,
+                        messages=messages_to_send
+                    )
+                )
+                logger.info(f"✅ 使用 push_message 補送訊息成功")
+            except Exception as push_error:
+                logger.error(f"❌ push_message 補送失敗: {push_error}")
+                try:
+                    line_bot_api.push_message(
+                        PushMessageRequest(
+                            to=user_id,
+                            messages=[TextMessage(text=reply_text)]
+                        )
+                    )
+                    logger.info(f"✅ 使用 push_message 補送文字訊息成功")
+                except Exception as text_push_error:
+                    logger.error(f"❌ push_message 補送文字也失敗: {text_push_error}")
 
 
 def handle_text_message(event, get_pet_id_by_line_user_func, get_pet_system_prompt_func,
-                       clear_chat_history_func, save_chat_message_func, get_chat_history_func,
+                       clear_chat_history_func, save_chat_turn_func, get_chat_history_func,
                        chat_with_pet_api_func, chat_with_pet_ollama_func, generate_fortune_card_func,
-                       BASE_URL, EXTERNAL_URL, AI_MODE, QWEN_MODEL, OLLAMA_MODEL, configuration, base_dir=None):
+                       BASE_URL, EXTERNAL_URL, AI_MODE, QWEN_MODEL, OLLAMA_MODEL,
+                       line_bot_api, base_dir=None):
     """
     處理文字訊息事件（主函數）
     
     參數:
         event: LINE MessageEvent 物件
+        line_bot_api: 共用的 MessagingApi 實例（重複使用連線）
         ... (其他依賴函數和配置)
     
     返回:
@@ -408,25 +731,24 @@ def handle_text_message(event, get_pet_id_by_line_user_func, get_pet_system_prom
         logger.info(f"使用者 {user_id} 綁定的 pet_id: {pet_id}")
         
         reply_text = None
-        should_return = False
         messages_to_send = None  # 初始化訊息列表
         
         # 處理特殊指令
-        user_message_lower = user_message.lower()
+        cmd = _COMMANDS.get(user_message.lower(), Cmd.CHAT)
+        
+        # 「愛寵小語」只需要 pet_id 即可呼叫 API，先送出，與讀取寵物資料重疊
+        whisper_future = None
+        if cmd == Cmd.WHISPER and pet_id:
+            whisper_future = _whisper_prefetch_executor.submit(_fetch_whisper, pet_id, BASE_URL)
         
         # 「我的ID」指令
-        if user_message_lower in ['我的id', '我的ID', 'myid', 'my id', 'userid', 'user id']:
+        if cmd == Cmd.MYID:
             reply_text = _handle_my_id_command(user_id, pet_id)
         
         # 未設定寵物
         elif not pet_id:
-            reply_text = """👋 哈囉！歡迎使用寵物聊天機器人！
-
-⚠️ 你還沒有設定專屬寵物喔！
-
-請先在聊天視窗輸入「我的ID」，系統會顯示你的 LINE User ID。
-
-將該 ID 複製後提供給客服人員進行設定，設定完成後就可以開始聊天囉！"""
+            reply_text = WELCOME_TEXT
+            messages_to_send = [WELCOME_MSG]
         
         # 已設定寵物，處理其他指令
         else:
@@ -439,198 +761,54 @@ def handle_text_message(event, get_pet_id_by_line_user_func, get_pet_system_prom
             logger.info(f"載入寵物資料 - pet_id: {pet_id}, pet_name: {pet_name}")
             
             if not system_prompt:
-                reply_text = "嗚...主人，我現在記不起來自己是誰了 😢\n請稍後再試試看"
+                reply_text = NO_PROMPT_TEXT
             else:
                 # 「清除」指令
-                if user_message_lower in ['clear', '清除', '重置']:
+                if cmd == Cmd.CLEAR:
                     reply_text = _handle_clear_command(user_id, pet_id, clear_chat_history_func)
                 
                 # 「說明」指令
-                elif user_message_lower in ['help', '幫助', '說明']:
+                elif cmd == Cmd.HELP:
                     reply_text = _handle_help_command()
+                    messages_to_send = [HELP_MSG]
                 
                 # 「占卜」指令
-                elif user_message_lower in ['毛孩占卜', '/fortune']:
-                    should_return, reply_text = _handle_fortune_command(
-                        user_id, pet_id, generate_fortune_card_func, configuration
+                elif cmd == Cmd.FORTUNE:
+                    _show_loading(line_bot_api, user_id)
+                    reply_text, messages_to_send = _handle_fortune_command(
+                        user_id, pet_id, generate_fortune_card_func
                     )
-                    if should_return:
-                        return  # 已處理完畢，不需要文字回覆
                 
                 # 「愛寵小語」指令
-                elif user_message_lower in ['愛寵小語', '小語', '寵物小語']:
-                    should_return, reply_text = _handle_whisper_command(
-                        user_id, pet_id, pet_name, BASE_URL, configuration, event
+                elif cmd == Cmd.WHISPER:
+                    reply_text, messages_to_send = _handle_whisper_command(
+                        pet_id, pet_name, BASE_URL, whisper_future
                     )
-                    if should_return:
-                        return  # 已處理完畢
                 
                 # 一般對話
                 else:
-                    # 1️⃣ 情緒辨識模組（僅在 API 模式啟用）
-                    emotion_result = {
-                        "emotion": "contentment",
-                        "image": ""
-                    }
-
-                    if AI_MODE == 'api':
-                        logger.info(f"🎭 開始情緒分析 - 用戶: {user_id}, 訊息: {user_message[:50]}")
-                        try:
-                            emotion_result = detect_emotion(user_message)
-                            logger.info(f"✅ 情緒分析結果: {emotion_result}")
-                        except Exception as e:
-                            logger.error(f"❌ 情緒分析失敗: {e}", exc_info=True)
-                            logger.warning(f"⚠️ 使用預設情緒: {emotion_result}")
-                    else:
-                        logger.info("ℹ️ 情緒分析僅在 API 模式啟用，已略過")
-
-                    # 根據情緒生成上下文提示（僅 API 模式）
-                    enhanced_system_prompt = system_prompt
-                    if AI_MODE == 'api':
-                        emotion_context = _build_emotion_context(emotion_result, pet_name)
-                        if emotion_context:
-                            enhanced_system_prompt = f"{system_prompt}\n\n        💭 主人現在的情緒狀態：\n        {emotion_context}\n        - 請根據主人的情緒狀態調整你的回應方式\n        - 如果主人情緒低落，要溫柔安慰\n        - 如果主人情緒正向，可以更活潑開心地回應\n"
-                    
-                    history = get_chat_history_func(user_id, pet_id, limit=8)
-                    user_saved = save_chat_message_func(user_id, pet_id, 'user', user_message)
-                    if not user_saved:
-                        logger.error(
-                            f"❌ 無法將使用者訊息寫入資料庫 - user: {user_id}, pet: {pet_id}, message: {user_message[:50]}"
-                        )
-                    
-                    logger.info(f"💬 處理對話 - 用戶: {user_id}, 模式: {AI_MODE}")
-                    logger.info(f"📝 輸入訊息: {user_message}")
-                    logger.info(
-                        f"🎭 情緒: {emotion_result.get('emotion', 'unknown')} (圖片: {'有' if emotion_result.get('image') else '無'})"
+                    _show_loading(line_bot_api, user_id)
+                    reply_text, messages_to_send = _handle_chat(
+                        user_id, user_message, pet_id, pet_name, pet_web_slug, system_prompt,
+                        save_chat_turn_func, get_chat_history_func,
+                        chat_with_pet_api_func, chat_with_pet_ollama_func,
+                        EXTERNAL_URL, AI_MODE, QWEN_MODEL, OLLAMA_MODEL, base_dir
                     )
-                    
-                    if AI_MODE == 'api':
-                        logger.info(f"🌐 使用 API 模式 - 模型: {QWEN_MODEL}")
-                        reply_text = chat_with_pet_api_func(
-                            system_prompt=enhanced_system_prompt,
-                            user_input=user_message,
-                            history=history,
-                            model=QWEN_MODEL,
-                            pet_name=pet_name
-                        )
-                        logger.info("✅ API 模式回應完成")
-                    else:
-                        logger.info(f"🏠 使用 Ollama 模式 - 模型: {OLLAMA_MODEL}")
-                        reply_text = chat_with_pet_ollama_func(
-                            system_prompt=enhanced_system_prompt,
-                            user_input=user_message,
-                            history=history,
-                            model=OLLAMA_MODEL,
-                            pet_name=pet_name
-                        )
-                        logger.info("✅ Ollama 模式回應完成")
-                    
-                    assistant_saved = save_chat_message_func(user_id, pet_id, 'assistant', reply_text)
-                    if not assistant_saved:
-                        logger.error(
-                            f"❌ 無法將寵物回覆寫入資料庫 - user: {user_id}, pet: {pet_id}, reply: {reply_text[:50]}"
-                        )
-                    
-                    # 🖼️ 判斷是否需要發送情緒圖片
-                    # 只有在明確判斷出 8 種情緒之一且信心度足夠時才發送圖片
-                    valid_emotions = ['amusement', 'awe', 'contentment', 'excitement', 'anger', 'disgust', 'fear', 'sad']
-                    emotion = emotion_result.get('emotion', '').lower()
-                    # 準備回覆訊息（預設只有文字）
-                    messages_to_send = None
-
-                    emotion_image_url = emotion_result.get('image')
-
-                    if AI_MODE == 'api' and emotion in valid_emotions and not emotion_image_url:
-                        emotion_image_url = _get_emotion_image_url(
-                            emotion,
-                            EXTERNAL_URL,
-                            base_dir,
-                            web_slug=pet_web_slug
-                        )
-
-                    if AI_MODE == 'api' and emotion in valid_emotions and emotion_image_url:
-                        try:
-                            # 使用 Flex Message 同時發送文字和圖片
-                            flex_message = FlexMessage(
-                                alt_text=f"{pet_name}的回覆",
-                                contents=FlexContainer.from_dict({
-                                    "type": "bubble",
-                                    "body": {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "image",
-                                                "url": emotion_image_url,
-                                                "size": "full",
-                                                "aspectMode": "cover",
-                                                "aspectRatio": "1:1"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": reply_text,
-                                                "wrap": True,
-                                                "size": "md",
-                                                "margin": "md"
-                                            }
-                                        ]
-                                    }
-                                })
-                            )
-                            messages_to_send = [flex_message]
-                            logger.info(f"🖼️ 使用 Flex Message 發送文字+圖片: {emotion} -> {emotion_image_url}")
-                        except Exception as img_error:
-                            logger.warning(f"⚠️ 無法建立 Flex Message: {img_error}，改用純文字")
-                            messages_to_send = [TextMessage(text=reply_text)]
-                    else:
-                        if emotion not in valid_emotions:
-                            logger.info(f"ℹ️ 情緒 {emotion} 不在有效列表中，不發送圖片")
-                        elif not emotion_image_url:
-                            logger.info(f"ℹ️ 情緒 {emotion} 沒有對應的圖片 URL，使用純文字")
-                        messages_to_send = [TextMessage(text=reply_text)]
         
-        # 回覆訊息
+        # 回覆訊息（每個指令只產生回覆內容，統一在這裡送出一次）
         if reply_text:
-            # 如果沒有設定 messages_to_send，使用預設的文字訊息
-            if messages_to_send is None:
-                messages_to_send = [TextMessage(text=reply_text)]
-            
-            with ApiClient(configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                try:
-                    line_bot_api.reply_message_with_http_info(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=messages_to_send
-                        )
-                    )
-                    logger.info(f"✅ 回覆使用者 {user_id}：{reply_text} (共 {len(messages_to_send)} 則訊息)")
-                except Exception as reply_error:
-                    logger.error(f"❌ 回覆訊息失敗: {reply_error}")
-                    # 如果回覆失敗，嘗試只發送文字
-                    try:
-                        line_bot_api.reply_message_with_http_info(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=reply_text)]
-                            )
-                        )
-                        logger.info(f"✅ 回覆文字訊息成功：{reply_text}")
-                    except Exception as text_error:
-                        logger.error(f"❌ 回覆文字訊息也失敗: {text_error}")
+            _send_reply(line_bot_api, event, user_id, reply_text, messages_to_send)
     
     except Exception as e:
         logger.error(f"處理訊息時發生錯誤: {e}", exc_info=True)
         # 發生錯誤時的備用回覆
         try:
-            with ApiClient(configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                line_bot_api.reply_message_with_http_info(
-                    ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text="嗚...主人，我現在有點不舒服 🥺")]
-                    )
+            line_bot_api.reply_message_with_http_info(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[ERROR_MSG]
                 )
+            )
         except:
             pass
 
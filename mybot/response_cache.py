@@ -0,0 +1,447 @@
+# response_cache.py
+# ============================================
+# 語意回覆快取（ConvoCache 模式）
+# ============================================
+# 功能：將「最近對話」編碼成向量，在同一位使用者、同一隻寵物的快取中找出語意相近的
+#       對話情境，命中時直接沿用先前的回覆，省去一次 LLM 呼叫
+#       另有不需額外套件的完全比對層（ExactResponseCache），在向量編碼前先查
+# 依賴：sentence-transformers、numpy（語意層必要）、faiss-cpu（可選）
+# 預設關閉，需設定 RESPONSE_CACHE=true 才會啟用
+# ============================================
+
+import atexit
+import hashlib
+import logging
+import math
+import os
+import re
+import time
+from functools import lru_cache
+from threading import Event, Lock, Thread
+
+from cachetools import TTLCache
+
+logger = logging.getLogger('pet_chatbot')
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+# LLM 失敗時的備用回覆，不應被寫入快取
+_FALLBACK_MARKERS = ("請稍後再試試看",)
+
+
+# 正規化時忽略的空白與句尾語氣符號（「你好!!」與「你好～」視為同一句）
+_NORMALIZE_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCT = "!！?？~～.。…,，"
+
+
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ["1", "true", "yes", "on"]
+
+
+def normalize_message(text: str) -> str:
+    """去除多餘空白、轉小寫並移除句尾語氣符號"""
+    return _NORMALIZE_SPACES.sub(" ", text).strip().lower().rstrip(_TRAILING_PUNCT)
+
+
+@lru_cache(maxsize=256)
+def prompt_fingerprint(system_prompt: str) -> str:
+    """
+    系統提示詞的 blake2b 指紋（每個提示詞只計算一次）
+
+    說明:
+        提示詞來自 app 的提示詞快取，每則訊息拿到的是同一個字串物件，
+        Python 會快取字串的 hash，lru_cache 查詢不必重新掃描數 KB 的內容
+    """
+    return hashlib.blake2b((system_prompt or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ExactResponseCache:
+    """
+    完全比對回覆快取
+
+    參數:
+        ttl (int): 快取項目有效秒數
+        maxsize (int): 最多保留的項目數
+        turns (int): 納入 key 的最近輪數（含本次訊息）
+
+    說明:
+        key 為 (分區, 提示詞指紋, 最近幾輪對話, 正規化後的訊息) 的 blake2b 雜湊
+        分區為 (line_user_id, pet_id, AI_MODE, emotion)，不同使用者、不同情緒不會互相命中
+        「你好」「早安」這類不讀取歷史的短訊息最容易命中，且不需要計算向量
+    """
+
+    def __init__(self, ttl: int = 86400, maxsize: int = 10000, turns: int = 3):
+        self.turns = max(1, turns)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+
+    def make_key(self, partition, prompt_hash: str, user_input: str, history=None) -> str:
+        """prompt_hash 請傳入 prompt_fingerprint(system_prompt)，不必每則訊息重新雜湊整段提示詞"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr(partition).encode("utf-8"))
+        h.update(b"\0" + prompt_hash.encode("ascii"))
+        recent = (history or [])[-(self.turns - 1):] if self.turns > 1 else []
+        for turn in recent:
+            h.update(b"\0" + turn.get("user", "").encode("utf-8"))
+            h.update(b"\0" + turn.get("bot", "").encode("utf-8"))
+        h.update(b"\0" + normalize_message(user_input).encode("utf-8"))
+        return h.hexdigest()
+
+    def lookup(self, key: str):
+        with self._lock:
+            reply = self._cache.get(key)
+        if reply is not None:
+            logger.info(f"⚡ 完全比對快取命中 - key: {key[:8]}")
+        return reply
+
+    def add(self, key: str, reply: str):
+        if not reply or any(marker in reply for marker in _FALLBACK_MARKERS):
+            return
+        with self._lock:
+            self._cache[key] = reply
+
+
+class _PetIndex:
+    """
+    單一快取分區（使用者 + 寵物 + 模式 + 情緒）的向量索引
+
+    說明:
+        有安裝 faiss 時使用 IndexFlatIP（向量皆已正規化，內積即 cosine）
+        否則以 numpy 矩陣乘法做暴力搜尋，快取規模不大時兩者差異有限
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.replies = []
+        self.created_at = []
+        if faiss is not None:
+            self.index = faiss.IndexFlatIP(dim)
+            self.vectors = None
+        else:
+            self.index = None
+            self.vectors = np.empty((0, dim), dtype='float32')
+
+    def __len__(self):
+        return len(self.replies)
+
+    def add(self, vector, reply: str, created_at: float):
+        vector = vector.reshape(1, -1).astype('float32')
+        if self.index is not None:
+            self.index.add(vector)
+        else:
+            self.vectors = np.vstack([self.vectors, vector])
+        self.replies.append(reply)
+        self.created_at.append(created_at)
+
+    def drop_oldest(self, n: int):
+        """移除最舊的 n 筆（項目依寫入時間排列，最舊的在前）"""
+        if n <= 0:
+            return
+        if self.index is not None:
+            kept = self.index.reconstruct_n(n, len(self.replies) - n) if n < len(self.replies) else None
+            self.index.reset()
+            if kept is not None:
+                self.index.add(kept)
+        else:
+            self.vectors = self.vectors[n:]
+        self.replies = self.replies[n:]
+        self.created_at = self.created_at[n:]
+
+    def snapshot(self):
+        """複製目前內容（向量、回覆、建立時間），供鎖外寫入檔案"""
+        if self.index is not None:
+            vectors = self.index.reconstruct_n(0, len(self.replies))
+        else:
+            vectors = self.vectors.copy()
+        return vectors, list(self.replies), list(self.created_at)
+
+    def search(self, vector, k: int):
+        vector = vector.reshape(1, -1).astype('float32')
+        k = min(k, len(self.replies))
+        if self.index is not None:
+            scores, ids = self.index.search(vector, k)
+            return list(zip(scores[0].tolist(), ids[0].tolist()))
+        scores = self.vectors @ vector[0]
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), int(i)) for i in top]
+
+
+class ResponseCache:
+    """
+    語意回覆快取
+
+    參數:
+        model_name (str): sentence-transformers 模型名稱（需支援中文）
+        threshold (float): cosine 相似度門檻，達到才視為命中
+        decay (float): 歷史輪次的指數衰減係數 λ，第 i 輪權重為 e^{-λi}
+        turns (int): 納入查詢向量的最近輪數（含本次訊息）
+        top_k (int): 每次搜尋取回的候選數
+        ttl (int): 快取項目有效秒數，超過即不再採用（0 表示不過期）
+        max_entries (int): 每個分區最多保留的項目數，滿了先移除過期項目，仍不足時移除最舊的項目
+        persist_dir (str): 持久化目錄，空字串表示僅保存在記憶體
+        save_interval (float): 持久化間隔秒數；新增的項目由背景執行緒批次寫入檔案，程式結束時再寫一次
+
+    說明:
+        分區 key 為 (line_user_id, pet_id, AI_MODE, emotion)，不同使用者的對話不會互相命中
+    """
+
+    def __init__(self, model_name: str, threshold: float = 0.92, decay: float = 0.5,
+                 turns: int = 3, top_k: int = 5, ttl: int = 86400,
+                 max_entries: int = 5000, persist_dir: str = "", save_interval: float = 60):
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.threshold = threshold
+        self.decay = decay
+        self.turns = max(1, turns)
+        self.top_k = top_k
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self.save_interval = save_interval
+        self._indexes = {}
+        self._dirty = set()
+        self._lock = Lock()
+        self._save_lock = Lock()
+        self._stop = Event()
+        if persist_dir:
+            Thread(target=self._save_loop, name='response-cache-saver', daemon=True).start()
+            atexit.register(self.close)
+
+    # -----------------------
+    # 查詢向量
+    # -----------------------
+    def embed(self, user_input: str, history=None):
+        """
+        以指數衰減加權最近幾輪使用者訊息，組成查詢向量
+
+        參數:
+            user_input (str): 本次使用者訊息（權重 1）
+            history (list): 對話歷史 [{"user": "...", "bot": "..."}, ...]，最舊的在前
+
+        返回:
+            numpy.ndarray: 已正規化的查詢向量
+        """
+        texts = [user_input]
+        for turn in reversed(history or []):
+            if len(texts) >= self.turns:
+                break
+            if turn.get("user"):
+                texts.append(turn["user"])
+        embeddings = self.model.encode(texts, normalize_embeddings=True)
+        weights = np.array([math.exp(-self.decay * i) for i in range(len(texts))], dtype='float32')
+        query = (weights[:, None] * embeddings).sum(axis=0)
+        return query / (np.linalg.norm(query) or 1.0)
+
+    # -----------------------
+    # 查詢 / 寫入
+    # -----------------------
+    def lookup(self, key, query):
+        """
+        搜尋語意相近且未過期的快取回覆
+
+        參數:
+            key (tuple): 快取分區（line_user_id, pet_id, AI_MODE, emotion）
+            query (numpy.ndarray): embed() 產生的查詢向量
+
+        返回:
+            str: 命中的回覆；未命中返回 None
+        """
+        now = time.time()
+        with self._lock:
+            index = self._get_index(key)
+            if index is None or not len(index):
+                return None
+            for score, idx in index.search(query, self.top_k):
+                if idx < 0 or score < self.threshold:
+                    continue
+                if self.ttl and now - index.created_at[idx] > self.ttl:
+                    continue
+                logger.info(f"⚡ 語意快取命中 - key: {key}, score: {score:.3f}")
+                return index.replies[idx]
+        return None
+
+    def add(self, key, query, reply: str):
+        """
+        將 LLM 回覆寫入快取（備用錯誤回覆不寫入）
+
+        參數:
+            key (tuple): 快取分區（line_user_id, pet_id, AI_MODE, emotion）
+            query (numpy.ndarray): embed() 產生的查詢向量
+            reply (str): LLM 回覆內容
+
+        說明:
+            只在記憶體中新增並標記為待儲存，檔案由背景執行緒批次寫入
+        """
+        if not reply or any(marker in reply for marker in _FALLBACK_MARKERS):
+            return
+        now = time.time()
+        with self._lock:
+            index = self._get_index(key, create=True)
+            if len(index) >= self.max_entries:
+                self._evict(index, now)
+            index.add(query, reply, now)
+            self._dirty.add(key)
+
+    def _evict(self, index, now: float):
+        """分區已滿：先移除過期項目，沒有過期項目時移除最舊的 1/10（至少 1 筆）"""
+        expired = 0
+        if self.ttl:
+            while expired < len(index) and now - index.created_at[expired] > self.ttl:
+                expired += 1
+        index.drop_oldest(expired or max(1, self.max_entries // 10))
+
+    # -----------------------
+    # 持久化
+    # -----------------------
+    def _path(self, key):
+        return os.path.join(self.persist_dir, "_".join(str(part) for part in key) + ".npz")
+
+    def _get_index(self, key, create=False):
+        index = self._indexes.get(key)
+        if index is None and self.persist_dir:
+            index = self._load(key)
+        if index is None and create:
+            index = _PetIndex(self.dim)
+        if index is not None:
+            self._indexes[key] = index
+        return index
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            data = np.load(path, allow_pickle=False)
+            index = _PetIndex(self.dim)
+            for vector, reply, created_at in zip(data["vectors"], data["replies"], data["created_at"]):
+                index.add(vector, str(reply), float(created_at))
+            logger.info(f"📂 載入語意快取 - key: {key}, 共 {len(index)} 筆")
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ 載入語意快取失敗，將重新建立: {path} ({e})")
+            return None
+
+    def _save_loop(self):
+        while not self._stop.wait(self.save_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        將有變動的分區寫入檔案
+
+        說明:
+            鎖內只複製待儲存分區的內容，np.savez 在鎖外執行，不會卡住查詢與新增
+        """
+        if not self.persist_dir:
+            return
+        with self._save_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                snapshots = [(key, self._indexes[key].snapshot()) for key in dirty if key in self._indexes]
+            for key, snapshot in snapshots:
+                self._save(key, *snapshot)
+
+    def close(self):
+        """停止背景儲存並寫入剩餘的變動（程式結束時自動呼叫）"""
+        self._stop.set()
+        self.flush()
+
+    def _save(self, key, vectors, replies, created_at):
+        try:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                vectors=vectors,
+                replies=np.array(replies),
+                created_at=np.array(created_at),
+            )
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"⚠️ 儲存語意快取失敗: {e}")
+
+
+# -----------------------
+# 全域便捷呼叫函式
+# -----------------------
+_cache_instance = None
+_cache_disabled = False
+_cache_init_lock = Lock()
+
+
+_exact_cache_instance = None
+
+
+def get_exact_response_cache():
+    """
+    取得完全比對回覆快取實例
+
+    返回:
+        ExactResponseCache: RESPONSE_CACHE 開啟時返回快取實例（不需額外套件）
+        None: 未啟用
+    """
+    global _exact_cache_instance
+    if _exact_cache_instance is not None or not _env_flag("RESPONSE_CACHE"):
+        return _exact_cache_instance
+    with _cache_init_lock:
+        if _exact_cache_instance is None:
+            _exact_cache_instance = ExactResponseCache(
+                ttl=int(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+                maxsize=int(os.getenv("RESPONSE_CACHE_EXACT_MAX_ENTRIES", "10000")),
+                turns=int(os.getenv("RESPONSE_CACHE_TURNS", "3")),
+            )
+        return _exact_cache_instance
+
+
+def get_response_cache():
+    """
+    取得語意回覆快取實例
+
+    返回:
+        ResponseCache: 已啟用時返回快取實例
+        None: 未啟用（RESPONSE_CACHE 未開啟）或缺少相依套件
+    """
+    global _cache_instance, _cache_disabled
+    if _cache_instance is not None or _cache_disabled:
+        return _cache_instance
+    with _cache_init_lock:
+        if _cache_instance is not None or _cache_disabled:
+            return _cache_instance
+        if not _env_flag("RESPONSE_CACHE"):
+            _cache_disabled = True
+            return None
+        if SentenceTransformer is None:
+            logger.warning("⚠️ 未安裝 sentence-transformers / numpy，語意回覆快取停用")
+            _cache_disabled = True
+            return None
+        try:
+            _cache_instance = ResponseCache(
+                model_name=os.getenv(
+                    "RESPONSE_CACHE_MODEL",
+                    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+                ),
+                threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92")),
+                decay=float(os.getenv("RESPONSE_CACHE_DECAY", "0.5")),
+                turns=int(os.getenv("RESPONSE_CACHE_TURNS", "3")),
+                top_k=int(os.getenv("RESPONSE_CACHE_TOP_K", "5")),
+                ttl=int(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+                persist_dir=os.getenv("RESPONSE_CACHE_DIR", ""),
+                save_interval=float(os.getenv("RESPONSE_CACHE_SAVE_INTERVAL", "60")),
+            )
+            logger.info(f"✅ 語意回覆快取已啟用（{'faiss' if faiss is not None else 'numpy'}）")
+        except Exception as e:
+            logger.error(f"❌ 語意回覆快取初始化失敗，已停用: {e}", exc_info=True)
+            _cache_disabled = True
+        return _cache_instance
@@ -27,7 +27,8 @@ def real_scenario_warmup():
     
     try:
         from db_utils import get_pet_profile, get_pet_id_by_line_user
-        from chatbot_ollama import chat_with_pet, build_system_prompt
+        from chatbot_ollama import chat_with_pet
+        from chatbot_api import build_system_prompt
         from personalities import pet_personality_templates
         
         # 使用真實的 LINE 使用者 ID 進行測試
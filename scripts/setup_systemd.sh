@@ -83,15 +83,15 @@ Environment="PATH=/home/ruru1211-chatbot/htdocs/chatbot.ruru1211.xyz/chatbot/ven
 EnvironmentFile=/home/ruru1211-chatbot/htdocs/chatbot.ruru1211.xyz/chatbot/.env
 
 # Gunicorn 啟動指令
+# 其餘設定（worker 數、gthread、逾時、keepalive）見專案根目錄的 gunicorn.conf.py
+# 每個 worker 各有一份資料庫連線池：總連線數 = GUNICORN_WORKERS × DB_POOL_MAX
+# 請確認低於 MySQL 的 max_connections（預設 151），可在 .env 以 DB_MAX_CONNECTIONS 調整
 ExecStart=/home/ruru1211-chatbot/htdocs/chatbot.ruru1211.xyz/chatbot/venv/bin/gunicorn \
+  --config gunicorn.conf.py \
   --bind 127.0.0.1:8090 \
-  --workers 4 \
-  --threads 2 \
-  --timeout 120 \
   --access-logfile /home/ruru1211-chatbot/logs/access.log \
   --error-logfile /home/ruru1211-chatbot/logs/error.log \
-  --log-level info \
-  mybot.app:app
+  wsgi:app
 
 # 重啟策略
 Restart=always
@@ -156,4 +156,9 @@ echo "  重啟服務：sudo systemctl restart ${SERVICE_NAME}"
 echo "  查看狀態：sudo systemctl status ${SERVICE_NAME}"
 echo "  查看日誌：sudo journalctl -u ${SERVICE_NAME} -f"
 echo ""
+echo "資料庫連線數："
+echo "  每個 gunicorn worker 各有一份連線池，總連線數 = GUNICORN_WORKERS × DB_POOL_MAX"
+echo "  預設以 .env 的 DB_MAX_CONNECTIONS（100）平均分配，請確認低於 MySQL 的 max_connections："
+echo "  mysql -e \"SHOW VARIABLES LIKE 'max_connections'\""
+echo ""
 
@@ -0,0 +1,59 @@
+# test_chat_log_queue.py
+# ============================================
+# 背景對話記錄寫入測試（以假的批次寫入取代 MySQL）
+# ============================================
+# 執行方式：python -m unittest discover -s tests
+# 需要已安裝 mybot/requirements.txt 中的套件（pymysql、requests、cachetools）
+# ============================================
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mybot'))
+
+try:
+    import chat_log_queue
+except ImportError:  # 未安裝依賴套件時略過
+    chat_log_queue = None
+
+
+@unittest.skipIf(chat_log_queue is None, "chat_log_queue 依賴套件未安裝")
+class ChatLogQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(chat_log_queue, 'CHAT_LOG_ASYNC', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_writer_survives_failed_batch(self):
+        calls = []
+
+        def bulk(batch):
+            calls.append(list(batch))
+            if len(calls) == 1:
+                raise RuntimeError("db down")
+            return True
+
+        with mock.patch.object(chat_log_queue, 'save_chat_turns_bulk', side_effect=bulk):
+            chat_log_queue.enqueue_chat_turn('U1', 1, '你好', '汪！')
+            self.assertTrue(chat_log_queue.flush_chat_log_queue(timeout=5))
+            chat_log_queue.enqueue_chat_turn('U1', 1, '然後呢', '汪汪！')
+            self.assertTrue(chat_log_queue.flush_chat_log_queue(timeout=5))
+
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(chat_log_queue._writer_thread.is_alive())
+
+    def test_flush_times_out(self):
+        chat_log_queue._ensure_writer()
+        chat_log_queue._queue.unfinished_tasks += 1
+        try:
+            self.assertFalse(chat_log_queue.flush_chat_log_queue(timeout=0.05))
+        finally:
+            with chat_log_queue._queue.all_tasks_done:
+                chat_log_queue._queue.unfinished_tasks -= 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# test_db_utils.py
+# ============================================
+# db_utils 基本測試（以假的連線池取代 MySQL）
+# ============================================
+# 執行方式：python -m unittest discover -s tests
+# 需要已安裝 mybot/requirements.txt 中的套件（pymysql、requests、cachetools）
+# ============================================
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mybot'))
+
+try:
+    import db_utils
+except ImportError as e:  # 未安裝依賴套件時略過
+    db_utils = None
+    _import_error = e
+
+
+def _fake_pool(rows=None, rowcount=0):
+    """建立假的連線池：connection() 返回的連線會記錄執行的 SQL"""
+    cursor = mock.MagicMock()
+    cursor.fetchall.return_value = rows or []
+    cursor.rowcount = rowcount
+    connection = mock.MagicMock()
+    connection.cursor.return_value.__enter__.return_value = cursor
+    pool = mock.MagicMock()
+    pool.connection.return_value = connection
+    return pool, connection, cursor
+
+
+@unittest.skipIf(db_utils is None, "db_utils 依賴套件未安裝")
+class DbUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        db_utils._empty_history.clear()
+
+    def test_module_logger(self):
+        self.assertEqual(db_utils.logger.name, 'db_utils')
+
+    def test_get_chat_history_pairs_messages(self):
+        rows = [
+            {'role': 'assistant', 'message': '汪汪！'},
+            {'role': 'user', 'message': '你好'},
+        ]
+        pool, connection, cursor = _fake_pool(rows)
+        with mock.patch.object(db_utils, '_get_pool', return_value=pool):
+            history = db_utils.get_chat_history('U1', 1, limit=8)
+        self.assertEqual(history, [{"user": "你好", "bot": "汪汪！"}])
+        cursor.execute.assert_called_once()
+        connection.close.assert_called_once()
+
+    def test_clear_chat_history_commits(self):
+        pool, connection, cursor = _fake_pool(rowcount=4)
+        with mock.patch.object(db_utils, '_get_pool', return_value=pool):
+            self.assertTrue(db_utils.clear_chat_history('U1', 1))
+        connection.commit.assert_called_once()
+        connection.close.assert_called_once()
+
+    def test_empty_mark_skipped_after_concurrent_write(self):
+        pool, connection, cursor = _fake_pool([])
+        # 模擬查詢期間另一個執行緒寫入了這位使用者的對話
+        cursor.execute.side_effect = lambda *args: db_utils._mark_history_written(('U1', 1))
+        with mock.patch.object(db_utils, '_get_pool', return_value=pool):
+            self.assertEqual(db_utils.get_chat_history('U1', 1), [])
+        self.assertNotIn(('U1', 1), db_utils._empty_history)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# test_response_cache.py
+# ============================================
+# 語意回覆快取測試（以假的向量模型取代 sentence-transformers）
+# ============================================
+# 執行方式：python -m unittest discover -s tests
+# 需要已安裝 numpy 與 cachetools
+# ============================================
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mybot'))
+
+try:
+    import numpy as np
+    import response_cache
+except ImportError:  # 未安裝依賴套件時略過
+    response_cache = None
+
+
+class _FakeModel:
+    def __init__(self, model_name):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+
+def _vector(i):
+    v = np.zeros(4, dtype='float32')
+    v[i % 4] = 1.0
+    return v
+
+
+@unittest.skipIf(response_cache is None, "response_cache 依賴套件未安裝")
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._model = response_cache.SentenceTransformer
+        response_cache.SentenceTransformer = _FakeModel
+        self.addCleanup(setattr, response_cache, 'SentenceTransformer', self._model)
+
+    def test_full_partition_evicts_oldest(self):
+        cache = response_cache.ResponseCache("fake", max_entries=10)
+        key = ('U1', 1, 'api', 'happy')
+        for i in range(25):
+            cache.add(key, _vector(i), f"回覆{i}")
+        index = cache._indexes[key]
+        self.assertLessEqual(len(index), 10)
+        self.assertEqual(index.replies[-1], "回覆24")
+        self.assertEqual(cache.lookup(key, _vector(24)), "回覆24")
+
+    def test_partitions_are_per_user(self):
+        cache = response_cache.ResponseCache("fake")
+        cache.add(('U1', 1, 'api', 'happy'), _vector(0), "給 U1 的回覆")
+        self.assertIsNone(cache.lookup(('U2', 1, 'api', 'happy'), _vector(0)))
+
+    def test_flush_persists_dirty_partitions(self):
+        with tempfile.TemporaryDirectory() as persist_dir:
+            cache = response_cache.ResponseCache("fake", persist_dir=persist_dir, save_interval=3600)
+            key = ('U1', 1, 'api', 'happy')
+            cache.add(key, _vector(1), "汪！")
+            cache.close()
+            reloaded = response_cache.ResponseCache("fake", persist_dir=persist_dir, save_interval=3600)
+            self.assertEqual(reloaded.lookup(key, _vector(1)), "汪！")
+            reloaded.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,12 @@
+# wsgi.py
+# ============================================
+# WSGI 入口點（供 Gunicorn 等正式環境伺服器使用）
+# ============================================
+# 啟動方式：gunicorn -c gunicorn.conf.py wsgi:app
+# ============================================
+
+from mybot.app import app
+
+if __name__ == "__main__":
+    from mybot.app import main
+    main()